@@ -0,0 +1,145 @@
+"""
+Headless bulk extraction, reusing the pipeline of the application.
+
+Usage (from the app directory):
+    python batch.py --year 2021 --sirens sirens.txt \
+        --engines table_transformer,extract_table --workers 8
+
+Results are appended to a JSON lines checkpoint file as documents
+complete; running the same command again skips the documents already
+processed. The ExtractTable token is read from --token or from the
+EXTRACT_TABLE_TOKEN environment variable.
+"""
+from typing import Dict, Set, Tuple
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from concurrency import RateLimiter, run_concurrently
+from pipeline import AUTO_ENGINE, ENGINE_NAMES, process_document
+from utils import check_siren_length, get_file_system, get_querier
+
+
+def read_checkpoint(checkpoint_path: Path) -> Set[Tuple[str, int]]:
+    """
+    Documents already processed according to a checkpoint file.
+
+    Args:
+        checkpoint_path (Path): Checkpoint file.
+
+    Returns:
+        Set[Tuple[str, int]]: Processed SIRENs and years.
+    """
+    if not checkpoint_path.exists():
+        return set()
+    processed = set()
+    with open(checkpoint_path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["status"] != "failed":
+                processed.add((record["siren"], int(record["year"])))
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk extraction of subsidiaries tables.")
+    parser.add_argument("--year", type=int, required=True)
+    parser.add_argument(
+        "--sirens", type=Path, required=True, help="File with one SIREN per line."
+    )
+    parser.add_argument(
+        "--engines",
+        default="table_transformer",
+        help=f"Comma-separated extraction engines among {', '.join(ENGINE_NAMES)}, "
+        f"or {AUTO_ENGINE} to escalate to extract_table only when needed.",
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=5.0,
+        help="Maximum number of INPI API calls per second.",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=2,
+        help="Maximum number of retries of each download. Extractions are not "
+        "retried: failed documents are processed again by the next run.",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        default=None,
+        help="Checkpoint file, defaults to batch_{year}.jsonl.",
+    )
+    parser.add_argument("--token", default=os.getenv("EXTRACT_TABLE_TOKEN"))
+    args = parser.parse_args()
+
+    engines = args.engines.split(",")
+    unknown_engines = set(engines) - set(ENGINE_NAMES) - {AUTO_ENGINE}
+    if unknown_engines:
+        parser.error(f"Unknown engines: {', '.join(sorted(unknown_engines))}.")
+    if {"extract_table", AUTO_ENGINE} & set(engines) and not args.token:
+        parser.error(f"An ExtractTable token is required to use extract_table or {AUTO_ENGINE}.")
+
+    sirens = list(dict.fromkeys(args.sirens.read_text().split()))
+    invalid_sirens = [siren for siren in sirens if not check_siren_length(siren)]
+    if invalid_sirens:
+        print(f"Ignoring {len(invalid_sirens)} invalid SIRENs: {', '.join(invalid_sirens)}")
+    checkpoint_path = args.checkpoint or Path(f"batch_{args.year}.jsonl")
+    processed = read_checkpoint(checkpoint_path)
+    valid_sirens = [siren for siren in sirens if check_siren_length(siren)]
+    sirens = [siren for siren in valid_sirens if (siren, args.year) not in processed]
+    print(
+        f"{len(valid_sirens) - len(sirens)} documents already processed, "
+        f"{len(sirens)} to process."
+    )
+
+    fs = get_file_system()
+    document_querier = get_querier()
+    rate_limiter = RateLimiter(args.rate_limit)
+    counts: Dict[str, int] = {"done": 0, "unavailable": 0, "failed": 0}
+    start = time.perf_counter()
+    outputs = run_concurrently(
+        lambda siren: process_document(
+            fs,
+            document_querier,
+            siren,
+            args.year,
+            engines,
+            token=args.token,
+            rate_limiter=rate_limiter,
+            download_retries=args.retries,
+        ),
+        sirens,
+        max_workers=args.workers,
+        # Only the download is retried, by process_document
+        retries=0,
+    )
+    with open(checkpoint_path, "a") as checkpoint:
+        for n_done, (siren, result, error) in enumerate(outputs, 1):
+            if error is not None:
+                record = {"siren": siren, "status": "failed", "error": f"{type(error).__name__}: {error}"}
+            elif not result["available"]:
+                record = {"siren": siren, "status": "unavailable"}
+            else:
+                record = {"siren": siren, "status": "done", "result": result}
+            record["year"] = args.year
+            checkpoint.write(json.dumps(record) + "\n")
+            checkpoint.flush()
+            counts[record["status"]] += 1
+            elapsed = time.perf_counter() - start
+            print(
+                f"[{n_done}/{len(sirens)}] {siren}: {record['status']} "
+                f"({n_done / elapsed:.2f} documents/s)"
+            )
+    print(
+        f"{counts['done']} extracted, {counts['unavailable']} unavailable, "
+        f"{counts['failed']} failed. Checkpoint: {checkpoint_path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
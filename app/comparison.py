@@ -0,0 +1,579 @@
+"""
+Cell-level comparison of the tables extracted by Table Transformer and
+ExtractTable from the same document.
+
+Rows and columns of two tables are aligned on their text, cells compared
+with a numeric tolerance and fuzzy text matching, and agreement metrics
+computed per document. The comparison can be run over all the documents
+extracted with both engines, producing a report.
+
+Usage (from the app directory):
+    python comparison.py [--year 2021] [--workers 4] [--output report.csv]
+"""
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+import argparse
+import io
+import multiprocessing
+import numpy as np
+import pandas as pd
+from s3fs import S3FileSystem
+from concurrency import run_concurrently
+from constants import AGREEMENT_THRESHOLD, COMPARISON_REPORT_PATH, MAX_ALIGNMENT_PAIRS
+from extract_table_parser import parse_french_numbers
+from extraction_index import filter_index, index_to_frame, read_index
+from page_selection import normalize_text
+from storage import TableReference, load_table
+
+
+# Compared engines: the free engine first, the paid one second
+COMPARED_ENGINES = ("table_transformer", "extract_table")
+
+# Status of aligned cells
+EQUAL = "equal"
+DIFFERENT = "different"
+MISSING_LEFT = "missing_left"
+MISSING_RIGHT = "missing_right"
+
+# Columns of comparison reports
+REPORT_COLUMNS = [
+    "siren",
+    "year",
+    "n_tables_left",
+    "n_tables_right",
+    "n_rows_left",
+    "n_rows_right",
+    "n_columns_right",
+    "same_shape",
+    "n_cells",
+    "agreement",
+    "numeric_agreement",
+    "error",
+]
+
+
+def table_grid(df: pd.DataFrame) -> np.ndarray:
+    """
+    Cells of a table as normalized strings, empty for null cells. Column
+    labels which are not positional are kept as a first row, since engines
+    differ in whether they detect a header.
+
+    Args:
+        df (pd.DataFrame): Table.
+
+    Returns:
+        np.ndarray: 2D array of strings.
+    """
+    cells = df.to_numpy(dtype=object)
+    labels = [str(label) for label in df.columns]
+    if any(label != str(position) for position, label in enumerate(labels)):
+        cells = np.vstack([np.array([labels], dtype=object), cells])
+    text = (
+        pd.Series(cells.ravel(), dtype=object)
+        .astype("string")
+        .fillna("")
+        .map(lambda value: normalize_text(value).strip())
+    )
+    return text.to_numpy(dtype=object).reshape(cells.shape)
+
+
+def align_sequences(
+    keys_left: List[str], keys_right: List[str], min_similarity: float = 0.5
+) -> List[Tuple[Optional[int], Optional[int]]]:
+    """
+    Align two sequences of rows (or columns) on their keys. Identical keys
+    are used as anchors, and rows between anchors are aligned on the
+    similarity of their keys.
+
+    Args:
+        keys_left (List[str]): Keys of the left rows.
+        keys_right (List[str]): Keys of the right rows.
+        min_similarity (float): Minimum similarity ratio of paired keys
+            between anchors.
+
+    Returns:
+        List[Tuple[Optional[int], Optional[int]]]: Pairs of positions in
+            order, None for rows with no counterpart.
+    """
+    pairs = []
+    matcher = SequenceMatcher(None, keys_left, keys_right, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            pairs += [(i1 + k, j1 + k) for k in range(i2 - i1)]
+        else:
+            pairs += [
+                (None if i is None else i1 + i, None if j is None else j1 + j)
+                for i, j in _align_block(keys_left[i1:i2], keys_right[j1:j2], min_similarity)
+            ]
+    return pairs
+
+
+def _align_block(
+    keys_left: List[str], keys_right: List[str], min_similarity: float
+) -> List[Tuple[Optional[int], Optional[int]]]:
+    # Monotonic alignment maximizing the total similarity of paired keys,
+    # by dynamic programming
+    n_left, n_right = len(keys_left), len(keys_right)
+    if n_left * n_right > MAX_ALIGNMENT_PAIRS:
+        n_paired = min(n_left, n_right)
+        return (
+            [(k, k) for k in range(n_paired)]
+            + [(i, None) for i in range(n_paired, n_left)]
+            + [(None, j) for j in range(n_paired, n_right)]
+        )
+    similarity = np.zeros((n_left, n_right))
+    matcher = SequenceMatcher(None)
+    for j, key_right in enumerate(keys_right):
+        # The second sequence is indexed once and compared with all the left
+        # keys, cheap upper bounds of the ratio discard most pairs
+        matcher.set_seq2(key_right)
+        for i, key_left in enumerate(keys_left):
+            matcher.set_seq1(key_left)
+            if matcher.real_quick_ratio() < min_similarity or matcher.quick_ratio() < min_similarity:
+                continue
+            ratio = matcher.ratio()
+            similarity[i, j] = ratio if ratio >= min_similarity else 0.0
+    score = np.zeros((n_left + 1, n_right + 1))
+    for i in range(n_left - 1, -1, -1):
+        for j in range(n_right - 1, -1, -1):
+            score[i, j] = max(
+                score[i + 1, j], score[i, j + 1], similarity[i, j] + score[i + 1, j + 1]
+            )
+
+    pairs, i, j = [], 0, 0
+    while i < n_left or j < n_right:
+        paired = i < n_left and j < n_right and similarity[i, j] > 0
+        if paired and score[i, j] == similarity[i, j] + score[i + 1, j + 1]:
+            pairs.append((i, j))
+            i, j = i + 1, j + 1
+        elif j == n_right or (i < n_left and score[i, j] == score[i + 1, j]):
+            pairs.append((i, None))
+            i += 1
+        else:
+            pairs.append((None, j))
+            j += 1
+    return pairs
+
+
+def _keys(grid: np.ndarray) -> List[str]:
+    # Text of each row without whitespace, so that a cell split over two
+    # columns by one engine does not prevent the rows from matching
+    return ["".join(row).replace(" ", "") for row in grid]
+
+
+def cells_agree(
+    left: np.ndarray,
+    right: np.ndarray,
+    tolerance: float = 0.01,
+    min_similarity: float = 0.8,
+) -> np.ndarray:
+    """
+    Element-wise agreement of two arrays of normalized cells: numbers agree
+    within a relative tolerance, other cells when their text similarity is
+    high enough.
+
+    Args:
+        left (np.ndarray): Left cells.
+        right (np.ndarray): Right cells.
+        tolerance (float): Relative tolerance on numbers.
+        min_similarity (float): Minimum similarity ratio of texts.
+
+    Returns:
+        np.ndarray: Boolean array.
+    """
+    agree = left == right
+    numbers_left = parse_french_numbers(left)
+    numbers_right = parse_french_numbers(right)
+    numeric = ~np.isnan(numbers_left) & ~np.isnan(numbers_right)
+    agree |= numeric & np.isclose(numbers_left, numbers_right, rtol=tolerance, atol=0)
+    for idx in zip(*np.nonzero(~agree & ~numeric)):
+        agree[idx] = SequenceMatcher(None, left[idx], right[idx]).ratio() >= min_similarity
+    return agree
+
+
+@dataclass
+class TableComparison:
+    """
+    Comparison of two tables.
+    """
+
+    shape_left: Tuple[int, int]
+    shape_right: Tuple[int, int]
+    # Aligned cells and status of each aligned cell
+    left: np.ndarray = field(repr=False)
+    right: np.ndarray = field(repr=False)
+    status: np.ndarray = field(repr=False)
+    # Cells non-empty in at least one table, numeric ones and agreeing ones
+    n_cells: int = 0
+    n_numeric: int = 0
+    n_agreeing: int = 0
+    n_numeric_agreeing: int = 0
+
+    @property
+    def agreement(self) -> float:
+        return self.n_agreeing / self.n_cells if self.n_cells else 1.0
+
+    @property
+    def numeric_agreement(self) -> float:
+        return self.n_numeric_agreeing / self.n_numeric if self.n_numeric else 1.0
+
+    def to_frames(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """
+        Aligned tables and cell status as DataFrames.
+
+        Returns:
+            Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]: Left table,
+                right table and status.
+        """
+        return pd.DataFrame(self.left), pd.DataFrame(self.right), pd.DataFrame(self.status)
+
+
+def compare_tables(
+    df_left: pd.DataFrame,
+    df_right: pd.DataFrame,
+    tolerance: float = 0.01,
+    min_similarity: float = 0.8,
+) -> TableComparison:
+    """
+    Align two tables and compare their cells.
+
+    Args:
+        df_left (pd.DataFrame): Left table.
+        df_right (pd.DataFrame): Right table.
+        tolerance (float): Relative tolerance on numbers.
+        min_similarity (float): Minimum similarity ratio of texts.
+
+    Returns:
+        TableComparison: Comparison.
+    """
+    grid_left, grid_right = table_grid(df_left), table_grid(df_right)
+    rows = align_sequences(_keys(grid_left), _keys(grid_right))
+    columns = align_sequences(_keys(grid_left.T), _keys(grid_right.T))
+
+    def aligned(grid: np.ndarray, side: int) -> np.ndarray:
+        out = np.full((len(rows), len(columns)), "", dtype=object)
+        row_idx = [(pos, pair[side]) for pos, pair in enumerate(rows) if pair[side] is not None]
+        col_idx = [(pos, pair[side]) for pos, pair in enumerate(columns) if pair[side] is not None]
+        if row_idx and col_idx:
+            out_rows, grid_rows = zip(*row_idx)
+            out_cols, grid_cols = zip(*col_idx)
+            out[np.ix_(out_rows, out_cols)] = grid[np.ix_(grid_rows, grid_cols)]
+        return out
+
+    left, right = aligned(grid_left, 0), aligned(grid_right, 1)
+    non_empty_left, non_empty_right = left != "", right != ""
+    agree = cells_agree(left, right, tolerance, min_similarity)
+    status = np.where(agree, EQUAL, DIFFERENT).astype(object)
+    status[non_empty_left & ~non_empty_right] = MISSING_RIGHT
+    status[~non_empty_left & non_empty_right] = MISSING_LEFT
+
+    compared = non_empty_left | non_empty_right
+    numeric = compared & (
+        ~np.isnan(parse_french_numbers(left)) | ~np.isnan(parse_french_numbers(right))
+    )
+    return TableComparison(
+        shape_left=grid_left.shape,
+        shape_right=grid_right.shape,
+        left=left,
+        right=right,
+        status=status,
+        n_cells=int(compared.sum()),
+        n_numeric=int(numeric.sum()),
+        n_agreeing=int((compared & agree).sum()),
+        n_numeric_agreeing=int((numeric & agree).sum()),
+    )
+
+
+def pair_tables(
+    tables_left: List[pd.DataFrame], tables_right: List[pd.DataFrame], **kwargs
+) -> List[Tuple[int, int, TableComparison]]:
+    """
+    Pair the tables extracted from a document by two engines, best agreeing
+    pairs first.
+
+    Args:
+        tables_left (List[pd.DataFrame]): Tables of the left engine.
+        tables_right (List[pd.DataFrame]): Tables of the right engine.
+        kwargs: Options of `compare_tables`.
+
+    Returns:
+        List[Tuple[int, int, TableComparison]]: Table indices and
+            comparison of each pair, in left table order.
+    """
+    candidates = [
+        (i, j, compare_tables(df_left, df_right, **kwargs))
+        for i, df_left in enumerate(tables_left)
+        for j, df_right in enumerate(tables_right)
+    ]
+    candidates.sort(key=lambda candidate: candidate[2].n_agreeing, reverse=True)
+    pairs, paired_left, paired_right = [], set(), set()
+    for i, j, comparison in candidates:
+        if i not in paired_left and j not in paired_right:
+            pairs.append((i, j, comparison))
+            paired_left.add(i)
+            paired_right.add(j)
+    return sorted(pairs, key=lambda pair: pair[0])
+
+
+def compare_document(
+    tables_left: List[pd.DataFrame], tables_right: List[pd.DataFrame], **kwargs
+) -> Dict:
+    """
+    Agreement metrics of the tables extracted from a document by two
+    engines. Unpaired tables count as entirely missing.
+
+    Args:
+        tables_left (List[pd.DataFrame]): Tables of the left engine.
+        tables_right (List[pd.DataFrame]): Tables of the right engine.
+        kwargs: Options of `compare_tables`.
+
+    Returns:
+        Dict: Metrics.
+    """
+    pairs = pair_tables(tables_left, tables_right, **kwargs)
+    paired_left = {i for i, _, _ in pairs}
+    paired_right = {j for _, j, _ in pairs}
+    n_unpaired_cells = sum(
+        int((table_grid(df) != "").sum())
+        for tables, paired in [(tables_left, paired_left), (tables_right, paired_right)]
+        for idx, df in enumerate(tables)
+        if idx not in paired
+    )
+    n_cells = sum(comparison.n_cells for _, _, comparison in pairs) + n_unpaired_cells
+    n_agreeing = sum(comparison.n_agreeing for _, _, comparison in pairs)
+    n_numeric = sum(comparison.n_numeric for _, _, comparison in pairs)
+    n_numeric_agreeing = sum(comparison.n_numeric_agreeing for _, _, comparison in pairs)
+    return {
+        "n_tables_left": len(tables_left),
+        "n_tables_right": len(tables_right),
+        "n_rows_left": sum(df.shape[0] for df in tables_left),
+        "n_rows_right": sum(df.shape[0] for df in tables_right),
+        "n_columns_right": max((df.shape[1] for df in tables_right), default=0),
+        "same_shape": len(tables_left) == len(tables_right)
+        and all(c.shape_left == c.shape_right for _, _, c in pairs),
+        "n_cells": n_cells,
+        "agreement": n_agreeing / n_cells if n_cells else 1.0,
+        "numeric_agreement": n_numeric_agreeing / n_numeric if n_numeric else 1.0,
+    }
+
+
+def load_document_tables(fs: S3FileSystem, entry: Dict) -> List[pd.DataFrame]:
+    """
+    Load the tables of an extraction.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        entry (Dict): Index entry of the extraction.
+
+    Returns:
+        List[pd.DataFrame]: Tables.
+    """
+    return [
+        load_table(
+            fs,
+            TableReference(entry["engine"], entry["siren"], int(entry["year"]), table_idx),
+            with_confidence=False,
+        )[0]
+        for table_idx in range(entry["n_tables"])
+    ]
+
+
+def document_pairs(
+    index: pd.DataFrame,
+    sirens: Optional[List[str]] = None,
+    years: Optional[List[int]] = None,
+) -> List[Tuple[Dict, Dict]]:
+    """
+    Index entries of the documents extracted with both compared engines.
+
+    Args:
+        index (pd.DataFrame): Index.
+        sirens (Optional[List[str]]): Firm identifiers, all if not
+            specified.
+        years (Optional[List[int]]): Years, all if not specified.
+
+    Returns:
+        List[Tuple[Dict, Dict]]: Entries of the left and right engines.
+    """
+    engine_left, engine_right = COMPARED_ENGINES
+    left = filter_index(index, engine_left, sirens, years)
+    right = filter_index(index, engine_right, sirens, years)
+    merged = left.merge(right, on=["siren", "year"], suffixes=("_left", "_right"))
+    return [
+        tuple(
+            dict(
+                engine=row[f"engine_{side}"],
+                siren=row["siren"],
+                year=row["year"],
+                n_tables=row[f"n_tables_{side}"],
+            )
+            for side in ("left", "right")
+        )
+        for row in merged.to_dict("records")
+    ]
+
+
+def compare_all(
+    fs: S3FileSystem,
+    sirens: Optional[List[str]] = None,
+    years: Optional[List[int]] = None,
+    max_workers: int = 4,
+    max_download_workers: int = 16,
+) -> pd.DataFrame:
+    """
+    Compare the extractions of all documents extracted with both engines.
+    Tables are downloaded over threads and compared over processes.
+    Documents which could not be compared are kept in the results, with
+    the error in the "error" column.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        sirens (Optional[List[str]]): Firm identifiers, all if not
+            specified.
+        years (Optional[List[int]]): Years, all if not specified.
+        max_workers (int): Number of comparison processes.
+        max_download_workers (int): Maximum number of concurrent downloads.
+
+    Returns:
+        pd.DataFrame: One row of metrics per document.
+    """
+    pairs = document_pairs(index_to_frame(read_index(fs)), sirens, years)
+    rows = []
+    # Processes are spawned rather than forked, since download threads are
+    # running and the caller may be the multithreaded Streamlit server
+    with ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = []
+        for (entry, _), tables, error in run_concurrently(
+            lambda pair: (load_document_tables(fs, pair[0]), load_document_tables(fs, pair[1])),
+            pairs,
+            max_workers=max_download_workers,
+        ):
+            document = dict(siren=entry["siren"], year=int(entry["year"]))
+            if error is not None:
+                rows.append(dict(document, error=f"{type(error).__name__}: {error}"))
+            else:
+                futures.append((document, executor.submit(compare_document, *tables)))
+        for document, future in futures:
+            try:
+                rows.append(dict(document, **future.result()))
+            except Exception as e:
+                rows.append(dict(document, error=f"{type(e).__name__}: {e}"))
+    return pd.DataFrame(rows, columns=REPORT_COLUMNS)
+
+
+def failed_documents(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Documents of a comparison which could not be compared.
+
+    Args:
+        results (pd.DataFrame): Output of `compare_all`.
+
+    Returns:
+        pd.DataFrame: Siren, year and error of each failed document.
+    """
+    if "error" not in results:
+        return pd.DataFrame(columns=["siren", "year", "error"])
+    return results.loc[results["error"].notna(), ["siren", "year", "error"]]
+
+
+def summary_report(results: pd.DataFrame, threshold: float = AGREEMENT_THRESHOLD) -> pd.DataFrame:
+    """
+    Summary of a comparison by table layout (number of columns of the
+    ExtractTable tables).
+
+    Args:
+        results (pd.DataFrame): Output of `compare_all`.
+        threshold (float): Agreement above which engines are considered
+            equivalent.
+
+    Returns:
+        pd.DataFrame: Number of compared documents, mean agreements and
+            share of documents where engines agree, per layout and overall,
+            with the number of documents which could not be compared.
+    """
+    n_failed = len(failed_documents(results))
+    if "error" in results:
+        results = results[results["error"].isna()]
+    layout = pd.cut(
+        results["n_columns_right"],
+        bins=[-1, 0, 4, 8, 12, np.inf],
+        labels=["aucun tableau", "1-4 colonnes", "5-8 colonnes", "9-12 colonnes", "13+ colonnes"],
+    )
+    results = results.assign(layout=layout, agree=results["agreement"] >= threshold)
+    aggregations = dict(
+        documents=("siren", "size"),
+        agreement=("agreement", "mean"),
+        numeric_agreement=("numeric_agreement", "mean"),
+        same_shape=("same_shape", "mean"),
+        agree=("agree", "mean"),
+    )
+    by_layout = results.groupby("layout", observed=True).agg(**aggregations)
+    overall = results.assign(layout="total").groupby("layout").agg(**aggregations)
+    if overall.empty:
+        overall = pd.DataFrame({"documents": [0]}, index=pd.Index(["total"], name="layout"))
+    summary = pd.concat([by_layout, overall]).assign(failed=0)
+    summary.loc["total", "failed"] = n_failed
+    return summary
+
+
+def save_report(fs: S3FileSystem, results: pd.DataFrame):
+    """
+    Save a comparison report on S3.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        results (pd.DataFrame): Output of `compare_all`.
+    """
+    buffer = io.BytesIO()
+    results.to_parquet(buffer, index=False)
+    with fs.open(COMPARISON_REPORT_PATH, "wb") as f:
+        f.write(buffer.getvalue())
+
+
+def load_report(fs: S3FileSystem) -> Optional[pd.DataFrame]:
+    """
+    Load the comparison report saved on S3.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+
+    Returns:
+        Optional[pd.DataFrame]: Report, None if no comparison was run.
+    """
+    try:
+        with fs.open(COMPARISON_REPORT_PATH, "rb") as f:
+            return pd.read_parquet(f)
+    except FileNotFoundError:
+        return None
+
+
+def main():
+    from utils import get_file_system
+
+    parser = argparse.ArgumentParser(description="Compare the extractions of both engines.")
+    parser.add_argument("--sirens", default=None, help="File with one SIREN per line")
+    parser.add_argument("--year", type=int, action="append", default=None)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--output", default=None, help="Local CSV report")
+    args = parser.parse_args()
+
+    fs = get_file_system()
+    sirens = None
+    if args.sirens is not None:
+        with open(args.sirens) as f:
+            sirens = f.read().split()
+    results = compare_all(fs, sirens, args.year, max_workers=args.workers)
+    save_report(fs, results)
+    if args.output is not None:
+        results.to_csv(args.output, sep=";", index=False)
+    print(summary_report(results).to_string())
+    for row in failed_documents(results).itertuples():
+        print(f"Failed to compare {row.siren}_{row.year}: {row.error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Concurrency utilities: bounded worker pools, rate limiting and retries.
+"""
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple, Type
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import random
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket limiting the number of calls per second.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Constructor.
+
+        Args:
+            rate (float): Maximum number of calls per second.
+            burst (int): Maximum number of calls allowed at once.
+        """
+        if rate <= 0:
+            raise ValueError("Rate must be positive.")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a call is allowed.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(host: str, rate: float, burst: int = 1) -> RateLimiter:
+    """
+    Get the rate limiter shared by every call to a given host.
+
+    The limiter is created on first use, and replaced if the requested
+    rate or burst changes.
+
+    Args:
+        host (str): Host name.
+        rate (float): Maximum number of calls per second.
+        burst (int): Maximum number of calls allowed at once.
+
+    Returns:
+        RateLimiter: Rate limiter for the host.
+    """
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(host)
+        if limiter is None or limiter.rate != rate or limiter.burst != max(1, burst):
+            limiter = RateLimiter(rate, burst)
+            _rate_limiters[host] = limiter
+        return limiter
+
+
+def backoff_delay(attempt: int, backoff: float, max_backoff: float = 30.0) -> float:
+    """
+    Exponential backoff delay with full jitter.
+
+    Args:
+        attempt (int): Attempt number, starting at 0.
+        backoff (float): Base delay in seconds.
+        max_backoff (float): Maximum delay in seconds.
+
+    Returns:
+        float: Delay in seconds.
+    """
+    return random.uniform(0, min(max_backoff, backoff * 2**attempt))
+
+
+def retry_with_backoff(
+    func: Callable,
+    *args,
+    retries: int = 3,
+    backoff: float = 0.5,
+    exceptions: Tuple[Type[BaseException], ...] = (Exception,),
+    rate_limiter: Optional[RateLimiter] = None,
+    **kwargs,
+) -> Any:
+    """
+    Call a function, retrying with exponential backoff on failure.
+
+    Args:
+        func (Callable): Function to call.
+        retries (int): Maximum number of retries.
+        backoff (float): Base backoff delay in seconds.
+        exceptions (Tuple): Exceptions triggering a retry.
+        rate_limiter (Optional[RateLimiter]): Rate limiter acquired before
+            each attempt.
+
+    Returns:
+        Any: Function output.
+    """
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except exceptions:
+            if attempt >= retries:
+                raise
+            time.sleep(backoff_delay(attempt, backoff))
+            attempt += 1
+
+
+def run_concurrently(
+    func: Callable,
+    items: Iterable,
+    max_workers: int = 8,
+    rate_limiter: Optional[RateLimiter] = None,
+    retries: int = 2,
+    backoff: float = 0.5,
+) -> Iterator[Tuple[Any, Any, Optional[BaseException]]]:
+    """
+    Apply a function to items over a bounded thread pool.
+
+    Results are yielded as soon as each call completes, so that callers
+    can stream them to the user.
+
+    Args:
+        func (Callable): Function taking an item as single argument.
+        items (Iterable): Items.
+        max_workers (int): Maximum number of concurrent calls.
+        rate_limiter (Optional[RateLimiter]): Rate limiter shared by calls.
+        retries (int): Maximum number of retries per item.
+        backoff (float): Base backoff delay in seconds.
+
+    Yields:
+        Tuple: Item, result (None on failure) and exception (None on success).
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(
+                retry_with_backoff,
+                func,
+                item,
+                retries=retries,
+                backoff=backoff,
+                rate_limiter=rate_limiter,
+            ): item
+            for item in items
+        }
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                yield item, future.result(), None
+            except Exception as e:
+                yield item, None, e
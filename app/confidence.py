@@ -0,0 +1,161 @@
+"""
+Confidence statistics and heatmap of ExtractTable extractions.
+
+Statistics are computed when tables are stored, so that extractions can be
+sorted by quality from the index. The heatmap maps each cell to one of a
+few precomputed colours, which is much cheaper to render than a gradient
+computed on each display.
+"""
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from constants import LOW_CONFIDENCE_THRESHOLD
+
+
+# "Reds" colour scale, from the most to the least reliable cells, with the
+# text colour readable on each background
+CONFIDENCE_COLORS = [
+    ("#fff5f0", "#000000"),
+    ("#fee0d2", "#000000"),
+    ("#fcbba1", "#000000"),
+    ("#fc9272", "#000000"),
+    ("#fb6a4a", "#000000"),
+    ("#ef3b2c", "#f1f1f1"),
+    ("#cb181d", "#f1f1f1"),
+    ("#a50f15", "#f1f1f1"),
+    ("#67000d", "#f1f1f1"),
+]
+CONFIDENCE_STYLES = np.array(
+    [f"background-color: {background}; color: {text}" for background, text in CONFIDENCE_COLORS]
+    + [""],
+    dtype=object,
+)
+# Level of cells without confidence
+MISSING_LEVEL = len(CONFIDENCE_COLORS)
+
+
+def _confidence_values(confidence) -> np.ndarray:
+    # Confidences as floats, a confidence of 0 meaning no confidence
+    values = np.asarray(confidence, dtype=np.float32)
+    return np.where(values > 0, values, np.nan)
+
+
+def confidence_stats(
+    confidence, threshold: float = LOW_CONFIDENCE_THRESHOLD
+) -> Optional[Dict]:
+    """
+    Aggregate confidence of a table.
+
+    Args:
+        confidence: Confidence of each cell, as a DataFrame or an array.
+        threshold (float): Confidence below which a cell is unreliable.
+
+    Returns:
+        Optional[Dict]: Number of cells with a confidence, mean and minimum
+            confidence, number and proportion of cells below the
+            threshold, None if no cell has a confidence.
+    """
+    values = _confidence_values(confidence)
+    values = values[~np.isnan(values)]
+    if not values.size:
+        return None
+    n_low = int((values < threshold).sum())
+    return {
+        "n_cells": int(values.size),
+        "mean": round(float(values.mean()), 4),
+        "min": round(float(values.min()), 4),
+        "n_low": n_low,
+        "low_ratio": round(n_low / values.size, 4),
+    }
+
+
+def document_confidence(stats: List[Optional[Dict]]) -> Optional[Dict]:
+    """
+    Aggregate confidence of the tables of a document.
+
+    Args:
+        stats (List[Optional[Dict]]): Output of `confidence_stats` for
+            each table.
+
+    Returns:
+        Optional[Dict]: Mean and minimum confidence, and proportion of
+            cells below the threshold, None if no table has a confidence.
+    """
+    stats = [table_stats for table_stats in stats if table_stats is not None]
+    if not stats:
+        return None
+    n_cells = sum(table_stats["n_cells"] for table_stats in stats)
+    return {
+        "mean": round(
+            sum(table_stats["mean"] * table_stats["n_cells"] for table_stats in stats) / n_cells, 4
+        ),
+        "min": min(table_stats["min"] for table_stats in stats),
+        "low_ratio": round(sum(table_stats["n_low"] for table_stats in stats) / n_cells, 4),
+    }
+
+
+def confidence_levels(confidence) -> np.ndarray:
+    """
+    Heatmap level of each cell: the least reliable cells of a table have
+    the highest levels.
+
+    Args:
+        confidence: Confidence of each cell, as a DataFrame or an array.
+
+    Returns:
+        np.ndarray: Levels, MISSING_LEVEL for cells without confidence.
+    """
+    values = _confidence_values(confidence)
+    levels = np.full(values.shape, MISSING_LEVEL, dtype=np.uint8)
+    present = ~np.isnan(values)
+    if not present.any():
+        return levels
+    # Scaled to the range of the table
+    low, high = values[present].min(), values[present].max()
+    scaled = (high - values[present]) / (high - low) if high > low else np.zeros(present.sum())
+    levels[present] = np.minimum(
+        (scaled * len(CONFIDENCE_COLORS)).astype(np.uint8), len(CONFIDENCE_COLORS) - 1
+    )
+    return levels
+
+
+def confidence_styles(levels: np.ndarray) -> np.ndarray:
+    """
+    CSS style of each cell of a heatmap.
+
+    Args:
+        levels (np.ndarray): Output of `confidence_levels`.
+
+    Returns:
+        np.ndarray: Styles, to be applied with `Styler.apply(axis=None)`.
+    """
+    return CONFIDENCE_STYLES[levels]
+
+
+def style_confidence(
+    extraction: pd.DataFrame,
+    confidence: np.ndarray,
+    low_only: bool = False,
+    threshold: float = LOW_CONFIDENCE_THRESHOLD,
+) -> "pd.io.formats.style.Styler":
+    """
+    Colour the cells of a table by confidence.
+
+    Args:
+        extraction (pd.DataFrame): Table.
+        confidence (np.ndarray): Confidence of each cell, aligned with the
+            table.
+        low_only (bool): Only show the rows with at least one unreliable
+            cell, other cells being blanked.
+        threshold (float): Confidence below which a cell is unreliable.
+
+    Returns:
+        Styler: Styled table.
+    """
+    styles = confidence_styles(confidence_levels(confidence))
+    if low_only:
+        low = _confidence_values(confidence) < threshold
+        rows = low.any(axis=1)
+        extraction = extraction.where(low, "")[rows]
+        styles = np.where(low, styles, "")[rows]
+    return extraction.style.apply(lambda _: styles, axis=None)
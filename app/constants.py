@@ -1,9 +1,106 @@
 """
 Constants.
 """
+import os
 
 
 PDF_SAMPLES_PATH = "projet-extraction-tableaux/app_data/pdf_samples"
 TABLE_TRANSFORMER_EXTRACTIONS_PATH = "projet-extraction-tableaux/app_data/table_transformer/extractions"
 EXTRACT_TABLE_EXTRACTIONS_PATH = "projet-extraction-tableaux/app_data/extract_table/extractions"
 EXTRACT_TABLE_CONFIDENCES_PATH = "projet-extraction-tableaux/app_data/extract_table/confidences"
+# Extractions directory and legacy table file extension of each engine
+ENGINES = {
+    "table_transformer": (TABLE_TRANSFORMER_EXTRACTIONS_PATH, "csv"),
+    "extract_table": (EXTRACT_TABLE_EXTRACTIONS_PATH, "xlsx"),
+}
+# Storage format of new extractions: "parquet" or "legacy"
+STORAGE_FORMAT = os.getenv("STORAGE_FORMAT", "parquet")
+
+EXTRACTION_INDEX_PATH = "projet-extraction-tableaux/app_data/extractions_index.json"
+RESULT_CACHE_PATH = "projet-extraction-tableaux/app_data/cache"
+# Normalised tables of all documents, one Parquet file per engine
+CONSOLIDATED_PATH = "projet-extraction-tableaux/app_data/consolidated"
+# Bulk exports of many extractions
+EXPORTS_PATH = "projet-extraction-tableaux/app_data/exports"
+# Agreement report of the extraction engines
+COMPARISON_REPORT_PATH = "projet-extraction-tableaux/app_data/comparison_report.parquet"
+# Routing decisions of the automatic engine selection, one file per document
+ROUTING_DECISIONS_PATH = "projet-extraction-tableaux/app_data/routing"
+
+# Extraction job queue
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "/tmp/extract_table_ui/jobs.sqlite")
+
+# Page selection backend: "remote" (page selection API) or "local"
+# (in-process scoring of the text layer)
+PAGE_SELECTION_BACKEND = os.getenv("PAGE_SELECTION_BACKEND", "remote")
+# Maximum number of selected pages, and minimum score of a selected page
+# relative to the best page
+MAX_SELECTED_PAGES = int(os.getenv("MAX_SELECTED_PAGES", "3"))
+MIN_RELATIVE_PAGE_SCORE = float(os.getenv("MIN_RELATIVE_PAGE_SCORE", "0.5"))
+
+# Pre-filtering of documents sent to extraction engines: "none", "pdf"
+# (drop pages without tables and crop the others) or "image" (same, with
+# pages rendered as images)
+PREFILTER_MODE = os.getenv("PREFILTER_MODE", "none")
+
+# Minimum proportion of agreeing cells for the outputs of two engines to be
+# considered equivalent
+AGREEMENT_THRESHOLD = float(os.getenv("AGREEMENT_THRESHOLD", "0.9"))
+# Maximum number of row pairs scored when aligning unmatched rows of two
+# tables, larger blocks are aligned by position
+MAX_ALIGNMENT_PAIRS = int(os.getenv("MAX_ALIGNMENT_PAIRS", "10000"))
+# ExtractTable confidence below which a cell is considered unreliable
+LOW_CONFIDENCE_THRESHOLD = float(os.getenv("LOW_CONFIDENCE_THRESHOLD", "0.8"))
+# Policy of the automatic engine selection: "economy", "balanced" or
+# "quality"
+ROUTING_POLICY = os.getenv("ROUTING_POLICY", "balanced")
+
+# Engine versions, to be bumped when an engine changes so that cached
+# results are not reused
+PAGE_SELECTION_VERSION = os.getenv("PAGE_SELECTION_VERSION", "1")
+LOCAL_PAGE_SELECTION_VERSION = os.getenv("LOCAL_PAGE_SELECTION_VERSION", "1")
+TABLE_TRANSFORMER_VERSION = os.getenv("TABLE_TRANSFORMER_VERSION", "1")
+EXTRACT_TABLE_VERSION = os.getenv("EXTRACT_TABLE_VERSION", "1")
+
+# Maximum duration in seconds of the ExtractTable jobs of a document, all
+# pages included
+EXTRACT_TABLE_BATCH_TIMEOUT = float(os.getenv("EXTRACT_TABLE_BATCH_TIMEOUT", "900"))
+
+# Multipart upload of large documents to S3 (parts of at least 5 MiB)
+MULTIPART_THRESHOLD = int(os.getenv("MULTIPART_THRESHOLD", str(16 * 2**20)))
+MULTIPART_CHUNK_SIZE = int(os.getenv("MULTIPART_CHUNK_SIZE", str(8 * 2**20)))
+
+# Storage: "s3" (S3 endpoint) or "memory" (in-process stand-in, for
+# benchmarks and offline runs)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "https://minio.lab.sspcloud.fr")
+
+# Remote services
+EXTRACTION_API_URL = os.getenv("EXTRACTION_API_URL", "https://extraction-cs.lab.sspcloud.fr")
+EXTRACT_TABLE_TRIGGER_URL = os.getenv("EXTRACT_TABLE_TRIGGER_URL", "https://trigger.extracttable.com")
+EXTRACT_TABLE_RESULT_URL = os.getenv("EXTRACT_TABLE_RESULT_URL", "https://getresult.extracttable.com")
+EXTRACT_TABLE_VALIDATOR_URL = os.getenv("EXTRACT_TABLE_VALIDATOR_URL", "https://validator.extracttable.com")
+
+# HTTP client settings
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+# Maximum delay in seconds waited on a Retry-After header
+HTTP_MAX_RETRY_AFTER = float(os.getenv("HTTP_MAX_RETRY_AFTER", "60"))
+
+# Instrumentation: number of spans kept in memory for the supervision page,
+# JSON logs of spans on stderr, and port of the Prometheus exporter (0 to
+# disable it, requires prometheus_client)
+MAX_RECORDED_SPANS = int(os.getenv("MAX_RECORDED_SPANS", "10000"))
+SPAN_LOGS = os.getenv("SPAN_LOGS", "true").lower() == "true"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Viewer prefetching: number of following tables downloaded in the
+# background, maximum size of the in-memory object cache, and duration
+# during which cached objects are served without checking their ETag
+PREFETCH_DEPTH = int(os.getenv("PREFETCH_DEPTH", "5"))
+OBJECT_CACHE_MAX_BYTES = int(os.getenv("OBJECT_CACHE_MAX_BYTES", str(256 * 2**20)))
+OBJECT_CACHE_MAX_AGE = float(os.getenv("OBJECT_CACHE_MAX_AGE", "300"))
+
+# Validity duration of the cached ExtractTable credit balance, in seconds
+CREDITS_TTL = float(os.getenv("CREDITS_TTL", "60"))
@@ -0,0 +1,126 @@
+"""
+Local accounting of ExtractTable credits.
+"""
+from typing import Callable, Optional
+import threading
+import time
+
+
+class InsufficientCreditsError(ValueError):
+    """
+    Error raised when not enough ExtractTable credits remain for a job.
+    """
+
+
+class CreditManager:
+    """
+    Thread-safe ExtractTable credit balance.
+
+    The balance returned by the validator is cached for `ttl` seconds.
+    Credits are reserved locally when jobs are submitted and settled when
+    they complete, so that concurrent jobs never exceed the balance and
+    do not each need a validator call. The local balance is reconciled
+    with the validator once the cached balance has expired.
+    """
+
+    def __init__(self, fetch_credits: Callable[[], int], ttl: float = 60):
+        """
+        Constructor.
+
+        Args:
+            fetch_credits (Callable[[], int]): Function returning the
+                remaining credits according to the validator.
+            ttl (float): Validity duration of the fetched balance in
+                seconds.
+        """
+        self.fetch_credits = fetch_credits
+        self.ttl = ttl
+        self._remote: Optional[int] = None
+        self._fetched_at = 0.0
+        # Jobs submitted and not completed yet
+        self._in_flight = 0
+        # Jobs completed since the last reconciliation
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def _reconcile(self, force: bool = False):
+        # Must be called with the lock held
+        if (
+            force
+            or self._remote is None
+            or time.monotonic() - self._fetched_at > self.ttl
+        ):
+            self._remote = self.fetch_credits()
+            self._fetched_at = time.monotonic()
+            self._used = 0
+
+    def refresh(self) -> int:
+        """
+        Fetch the balance from the validator.
+
+        Returns:
+            int: Remaining credits, in-flight jobs excluded.
+        """
+        with self._lock:
+            self._reconcile(force=True)
+            return self._available()
+
+    def _available(self) -> int:
+        return max(0, self._remote - self._used - self._in_flight)
+
+    def remaining(self) -> int:
+        """
+        Remaining credits, in-flight jobs excluded. The validator is only
+        called if the cached balance has expired.
+
+        Returns:
+            int: Remaining credits.
+        """
+        with self._lock:
+            self._reconcile()
+            return self._available()
+
+    def reserve(self, n_jobs: int, partial: bool = False) -> int:
+        """
+        Reserve credits for jobs about to be submitted.
+
+        Args:
+            n_jobs (int): Number of jobs.
+            partial (bool): Whether to reserve as many credits as remain
+                when there are not enough for all jobs, instead of raising.
+
+        Returns:
+            int: Number of reserved credits.
+        """
+        with self._lock:
+            self._reconcile()
+            available = self._available()
+            if available < n_jobs and not partial:
+                raise InsufficientCreditsError(
+                    "Not enough credits to extract tables. "
+                    "Specify a valid token with enough credits."
+                )
+            reserved = min(n_jobs, available)
+            self._in_flight += reserved
+            return reserved
+
+    def settle(self, n_jobs: int = 1):
+        """
+        Record completed jobs, whose credits are now used.
+
+        Args:
+            n_jobs (int): Number of jobs.
+        """
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - n_jobs)
+            self._used += n_jobs
+
+    def release(self, n_jobs: int = 1):
+        """
+        Give back the credits of jobs which failed.
+
+        Args:
+            n_jobs (int): Number of jobs.
+        """
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - n_jobs)
@@ -0,0 +1,380 @@
+"""
+Bulk export of many extractions, generated incrementally with constant
+memory: documents are fetched from S3 in parallel within a bounded window
+and written to the output as soon as they are read.
+
+Usage (from the app directory):
+    python export.py --format zip --output s3://bucket/export.zip \
+        [--engine ENGINE] [--sirens sirens.txt] [--year 2021] [--level normalized]
+"""
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import argparse
+import io
+import zipfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from s3fs import S3FileSystem
+from constants import ENGINES, EXPORTS_PATH, MULTIPART_CHUNK_SIZE
+from extraction_index import filter_index, index_to_frame, read_index
+from normalization import empty_normalized_frame
+from query import DOCUMENT_COLUMNS, read_document_normalized, read_document_raw
+from storage import PARQUET_SCHEMA, TableReference, load_table
+
+
+EXPORT_FORMATS = ["zip", "csv", "parquet"]
+
+
+def select_entries(
+    fs: S3FileSystem,
+    engines: Optional[List[str]] = None,
+    sirens: Optional[List[str]] = None,
+    years: Optional[List[int]] = None,
+) -> List[Dict]:
+    """
+    Index entries of the extractions to export.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        engines (Optional[List[str]]): Extraction engines, all if not
+            specified.
+        sirens (Optional[List[str]]): Firm identifiers, all if not
+            specified.
+        years (Optional[List[int]]): Years, all if not specified.
+
+    Returns:
+        List[Dict]: Index entries.
+    """
+    index = index_to_frame(read_index(fs))
+    return [
+        entry
+        for engine in engines or list(ENGINES)
+        for entry in filter_index(index, engine, sirens, years).to_dict("records")
+    ]
+
+
+def iter_documents(
+    func: Callable[[Dict], Any], entries: List[Dict], max_workers: int = 8
+) -> Iterator[Tuple[Dict, Any, Optional[Exception]]]:
+    """
+    Apply a function to index entries concurrently, yielding results in
+    order. At most twice max_workers results are held in memory.
+
+    Args:
+        func (Callable[[Dict], Any]): Function reading a document.
+        entries (List[Dict]): Index entries.
+        max_workers (int): Maximum number of concurrent reads.
+
+    Yields:
+        Tuple[Dict, Any, Optional[Exception]]: Entry, result (None on
+            failure) and exception (None on success).
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        window = deque()
+        for entry in entries:
+            window.append((entry, executor.submit(func, entry)))
+            if len(window) >= 2 * max_workers:
+                yield _result(*window.popleft())
+        while window:
+            yield _result(*window.popleft())
+
+
+def _result(entry: Dict, future) -> Tuple[Dict, Any, Optional[Exception]]:
+    try:
+        return entry, future.result(), None
+    except Exception as e:
+        return entry, None, e
+
+
+def _error_line(entry: Dict, error: Exception) -> str:
+    # Document which could not be exported, with the reason
+    return f"{entry['engine']}/{entry['siren']}_{entry['year']}: {type(error).__name__}: {error}"
+
+
+def read_document_tables(fs: S3FileSystem, entry: Dict) -> List:
+    """
+    Read all tables and confidences of a document.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        entry (Dict): Index entry of the extraction.
+
+    Returns:
+        List: Tables and confidences.
+    """
+    return [
+        load_table(fs, TableReference(entry["engine"], entry["siren"], int(entry["year"]), table_idx))
+        for table_idx in range(entry["n_tables"])
+    ]
+
+
+class _ChunkStream(io.RawIOBase):
+    """
+    Write-only stream buffering written bytes until they are taken.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(
+    fs: S3FileSystem,
+    entries: List[Dict],
+    max_workers: int = 8,
+    errors: Optional[List[str]] = None,
+) -> Iterator[bytes]:
+    """
+    Stream a ZIP archive of the tables of many extractions, one CSV file
+    per table (and per confidence table). Documents which could not be
+    read are listed in an errors.txt file of the archive.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        entries (List[Dict]): Index entries.
+        max_workers (int): Maximum number of concurrent reads.
+        errors (Optional[List[str]]): List to which the documents which
+            could not be exported are appended.
+
+    Yields:
+        bytes: Archive chunks.
+    """
+    stream = _ChunkStream()
+    errors = [] if errors is None else errors
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for entry, outputs, error in iter_documents(
+            lambda entry: read_document_tables(fs, entry), entries, max_workers
+        ):
+            directory = f"{entry['engine']}/{entry['siren']}_{entry['year']}"
+            if error is not None:
+                errors.append(_error_line(entry, error))
+                continue
+            for table_idx, (df, df_conf) in enumerate(outputs):
+                archive.writestr(
+                    f"{directory}/table_{table_idx}.csv",
+                    df.to_csv(sep=";").encode("utf_8_sig"),
+                )
+                if df_conf is not None:
+                    archive.writestr(
+                        f"{directory}/table_{table_idx}_confidence.csv",
+                        df_conf.to_csv(sep=";").encode("utf_8_sig"),
+                    )
+            yield stream.take()
+        if errors:
+            archive.writestr("errors.txt", "\n".join(errors))
+    yield stream.take()
+
+
+def _read_function(fs: S3FileSystem, level: str) -> Callable[[Dict], pd.DataFrame]:
+    if level == "normalized":
+        return lambda entry: read_document_normalized(fs, entry)
+    elif level == "raw":
+        return lambda entry: read_document_raw(fs, entry)
+    raise ValueError(f"Unknown export level {level}.")
+
+
+def _export_schema(level: str) -> pa.Schema:
+    # Schema of exported rows, common to all documents
+    if level == "normalized":
+        empty = empty_normalized_frame(DOCUMENT_COLUMNS)
+        return pa.Schema.from_pandas(empty, preserve_index=False).remove_metadata()
+    elif level == "raw":
+        document_schema = pa.Schema.from_pandas(
+            pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in DOCUMENT_COLUMNS.items()}),
+            preserve_index=False,
+        )
+        return pa.schema(list(document_schema.remove_metadata()) + list(PARQUET_SCHEMA))
+    raise ValueError(f"Unknown export level {level}.")
+
+
+def stream_csv(
+    fs: S3FileSystem,
+    entries: List[Dict],
+    level: str = "normalized",
+    max_workers: int = 8,
+    errors: Optional[List[str]] = None,
+) -> Iterator[bytes]:
+    """
+    Stream a single CSV file of the rows of many extractions.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        entries (List[Dict]): Index entries.
+        level (str): "normalized" for normalised rows, "raw" for cells.
+        max_workers (int): Maximum number of concurrent reads.
+        errors (Optional[List[str]]): List to which the documents which
+            could not be exported are appended.
+
+    Yields:
+        bytes: CSV chunks.
+    """
+    errors = [] if errors is None else errors
+    header = True
+    for entry, df, error in iter_documents(_read_function(fs, level), entries, max_workers):
+        if error is not None:
+            errors.append(_error_line(entry, error))
+            continue
+        chunk = df.to_csv(sep=";", index=False, header=header)
+        # Byte order mark for Excel, at the start of the file only
+        yield chunk.encode("utf_8_sig" if header else "utf-8")
+        header = False
+
+
+def write_parquet(
+    fs: S3FileSystem,
+    entries: List[Dict],
+    sink,
+    level: str = "normalized",
+    max_workers: int = 8,
+    errors: Optional[List[str]] = None,
+) -> int:
+    """
+    Write the rows of many extractions to a single Parquet file, one row
+    group per document. Rows are converted to the schema of the export
+    level, documents which cannot be converted are reported as errors.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        entries (List[Dict]): Index entries.
+        sink: Writable binary file.
+        level (str): "normalized" for normalised rows, "raw" for cells.
+        max_workers (int): Maximum number of concurrent reads.
+        errors (Optional[List[str]]): List to which the documents which
+            could not be exported are appended.
+
+    Returns:
+        int: Number of exported documents.
+    """
+    errors = [] if errors is None else errors
+    schema = _export_schema(level)
+    n_documents = 0
+    with pq.ParquetWriter(sink, schema) as writer:
+        for entry, df, error in iter_documents(_read_function(fs, level), entries, max_workers):
+            if error is None:
+                try:
+                    table = pa.Table.from_pandas(df, preserve_index=False)
+                    table = table.select(schema.names).cast(schema)
+                except (KeyError, pa.ArrowException) as e:
+                    error = e
+            if error is not None:
+                errors.append(_error_line(entry, error))
+                continue
+            writer.write_table(table)
+            n_documents += 1
+    return n_documents
+
+
+def export_extractions(
+    fs: S3FileSystem,
+    entries: List[Dict],
+    file_format: str,
+    output_path: str,
+    level: str = "normalized",
+    max_workers: int = 8,
+    output_fs=None,
+) -> List[str]:
+    """
+    Export many extractions to a file, written as it is generated.
+    Documents which could not be exported are listed in the errors.txt file
+    of ZIP archives, and in a "<output>.errors.txt" file next to CSV and
+    Parquet files.
+
+    Args:
+        fs (S3FileSystem): S3 file system of the extractions.
+        entries (List[Dict]): Index entries.
+        file_format (str): "zip", "csv" or "parquet".
+        output_path (str): Output path.
+        level (str): "normalized" or "raw", for the csv and parquet
+            formats.
+        max_workers (int): Maximum number of concurrent reads.
+        output_fs: File system of the output, fs if not specified.
+
+    Returns:
+        List[str]: Documents which could not be exported, with the reason.
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {file_format}.")
+    output_fs = output_fs or fs
+    errors = []
+    # Large outputs are uploaded by parts as they are written
+    with output_fs.open(output_path, "wb", block_size=MULTIPART_CHUNK_SIZE) as f:
+        if file_format == "zip":
+            for chunk in stream_zip(fs, entries, max_workers, errors):
+                f.write(chunk)
+        elif file_format == "csv":
+            for chunk in stream_csv(fs, entries, level, max_workers, errors):
+                f.write(chunk)
+        else:
+            write_parquet(fs, entries, f, level, max_workers, errors)
+    if errors and file_format != "zip":
+        output_fs.pipe_file(f"{output_path}.errors.txt", "\n".join(errors).encode("utf-8"))
+    return errors
+
+
+def export_path(file_format: str) -> str:
+    """
+    Timestamped S3 path of an export.
+
+    Args:
+        file_format (str): Export format.
+
+    Returns:
+        str: S3 path.
+    """
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    return f"{EXPORTS_PATH}/extractions_{timestamp}.{file_format}"
+
+
+def main():
+    import fsspec
+    from utils import get_file_system
+
+    parser = argparse.ArgumentParser(description="Export many extractions to a single file.")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="zip")
+    parser.add_argument("--level", choices=["normalized", "raw"], default="normalized")
+    parser.add_argument("--engine", choices=list(ENGINES), action="append", default=None)
+    parser.add_argument("--sirens", default=None, help="File with one SIREN per line")
+    parser.add_argument("--year", type=int, action="append", default=None)
+    parser.add_argument("--output", default=None, help="Local or s3:// path")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    fs = get_file_system()
+    sirens = None
+    if args.sirens is not None:
+        with open(args.sirens) as f:
+            sirens = f.read().split()
+    entries = select_entries(fs, args.engine, sirens, args.year)
+    output_path = args.output or export_path(args.format)
+    if output_path.startswith("s3://"):
+        output_fs, output_path = fs, output_path[len("s3://"):]
+    elif args.output is None:
+        output_fs = fs
+    else:
+        output_fs = fsspec.filesystem("file")
+    print(f"Exporting {len(entries)} extractions to {output_path}.")
+    errors = export_extractions(
+        fs, entries, args.format, output_path, args.level, args.workers, output_fs=output_fs
+    )
+    for error in errors:
+        print(error)
+    if errors:
+        print(f"{len(errors)} extractions could not be exported.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Asynchronous client for the https://extracttable.com/ job API.
+"""
+from typing import Callable, Dict, List, Optional, Union
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from http_client import HttpClient
+from instrumentation import propagate_context, traced
+from constants import EXTRACT_TABLE_TRIGGER_URL, EXTRACT_TABLE_RESULT_URL
+
+
+class ExtractTableJobError(ValueError):
+    """
+    Error raised when an ExtractTable job fails or times out.
+    """
+
+
+class ExtractTableClient:
+    """
+    Thread-backed ExtractTable client.
+
+    Jobs are submitted concurrently on a bounded thread pool and polled
+    with exponentially increasing intervals over a pooled HTTP session.
+    """
+
+    trigger_url = EXTRACT_TABLE_TRIGGER_URL
+    result_url = EXTRACT_TABLE_RESULT_URL
+
+    def __init__(
+        self,
+        token: str,
+        max_workers: int = 4,
+        timeout: float = 300,
+        initial_interval: float = 1.0,
+        max_interval: float = 10.0,
+        backoff_factor: float = 1.5,
+        session: Optional[Union[requests.Session, HttpClient]] = None,
+    ):
+        """
+        Constructor.
+
+        Args:
+            token (str): ExtractTable token.
+            max_workers (int): Maximum number of concurrent jobs.
+            timeout (float): Maximum duration of a job in seconds, from
+                submission to result.
+            initial_interval (float): First polling interval in seconds.
+            max_interval (float): Maximum polling interval in seconds.
+            backoff_factor (float): Growth factor of the polling interval.
+            session (Optional[Union[requests.Session, HttpClient]]): HTTP
+                session, a pooled session is created if not specified.
+        """
+        self.token = token
+        self.timeout = timeout
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=max_workers)
+            session.mount("https://", adapter)
+        self.session = session
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="extract_table"
+        )
+
+    @property
+    def headers(self) -> Dict:
+        """
+        Authentication headers.
+        """
+        return {"x-api-key": self.token}
+
+    @traced("extract_table_trigger")
+    def trigger(self, pdf_bytes: bytes) -> Dict:
+        """
+        Submit a document to ExtractTable.
+
+        Args:
+            pdf_bytes (bytes): PDF document.
+
+        Returns:
+            Dict: Trigger response.
+        """
+        response = self.session.post(
+            self.trigger_url,
+            headers=self.headers,
+            data={"dup_check": "False"},
+            files=[("input", ("document.pdf", pdf_bytes))],
+        )
+        return response.json()
+
+    @traced("extract_table_poll")
+    def get_result(self, job_id: str) -> Dict:
+        """
+        Get the status or result of a job.
+
+        Args:
+            job_id (str): Job ID.
+
+        Returns:
+            Dict: Job response.
+        """
+        response = self.session.get(
+            self.result_url, headers=self.headers, params={"JobId": job_id}
+        )
+        return response.json()
+
+    @traced("extract_table_job")
+    def run_job(self, pdf_bytes: bytes) -> Dict:
+        """
+        Submit a document and poll until the job completes.
+
+        Args:
+            pdf_bytes (bytes): PDF document.
+
+        Returns:
+            Dict: Job result.
+        """
+        deadline = time.monotonic() + self.timeout
+        json_object = self.trigger(pdf_bytes)
+        if "JobId" not in json_object:
+            raise ExtractTableJobError(
+                f"ExtractTable job submission failed: {json_object.get('Message', json_object)}"
+            )
+        job_id = str(json_object["JobId"])
+
+        interval = self.initial_interval
+        while str(json_object.get("JobStatus")) == "Processing":
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ExtractTableJobError(
+                    f"ExtractTable job {job_id} timed out after {self.timeout}s."
+                )
+            time.sleep(min(interval, remaining))
+            interval = min(self.max_interval, interval * self.backoff_factor)
+            json_object = self.get_result(job_id)
+
+        if str(json_object.get("JobStatus")) != "Success":
+            raise ExtractTableJobError(
+                f"ExtractTable job {job_id} failed: {json_object.get('Message', json_object.get('JobStatus'))}"
+            )
+        return json_object
+
+    def submit(
+        self, pdf_bytes: bytes, postprocess: Optional[Callable] = None
+    ) -> Future:
+        """
+        Submit a document without blocking.
+
+        Args:
+            pdf_bytes (bytes): PDF document.
+            postprocess (Optional[Callable]): Function applied to the job
+                result in the worker thread.
+
+        Returns:
+            Future: Future resolving to the (post-processed) job result.
+        """
+        # Spans of the job are attributed to the document of the caller
+        if postprocess is None:
+            return self.executor.submit(propagate_context(self.run_job), pdf_bytes)
+        return self.executor.submit(
+            propagate_context(lambda: postprocess(self.run_job(pdf_bytes)))
+        )
+
+    @staticmethod
+    def wait_all(futures: List[Future], timeout: Optional[float] = None) -> List:
+        """
+        Wait for futures under a global timeout. Jobs not started when the
+        timeout expires are cancelled.
+
+        Args:
+            futures (List[Future]): Futures.
+            timeout (Optional[float]): Global timeout in seconds.
+
+        Returns:
+            List: Results in the same order as futures.
+        """
+        _, not_done = wait(futures, timeout=timeout)
+        if not_done:
+            for future in not_done:
+                future.cancel()
+            raise ExtractTableJobError(
+                f"{len(not_done)} ExtractTable jobs did not complete in {timeout}s."
+            )
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        Release the thread pool and HTTP connections.
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
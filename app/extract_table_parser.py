@@ -0,0 +1,170 @@
+"""
+Conversion of ExtractTable job results to DataFrames.
+"""
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+
+def table_json_to_frame(table_json: Dict[str, Dict[str, object]], dtype=object) -> pd.DataFrame:
+    """
+    Convert a `TableJson` or `TableConfidence` object, mapping row keys to
+    mappings of column keys to cells, to a DataFrame in a single pass.
+
+    Rows are sorted and indexed by their integer key, and columns sorted by
+    integer key and labelled by their key, which is the result of
+    `pd.DataFrame.from_dict(orient="index")` followed by a sort of both
+    axes on their integer keys. Missing cells are null.
+
+    Args:
+        table_json (Dict[str, Dict[str, object]]): Table object.
+        dtype: Data type of the cells, object for text and np.float32 for
+            confidences.
+
+    Returns:
+        pd.DataFrame: Table.
+    """
+    rows = list(table_json.values())
+    row_keys = np.fromiter(map(int, table_json), dtype=np.int64, count=len(rows))
+    row_order = np.argsort(row_keys, kind="stable")
+    fill = None if dtype is object else np.nan
+
+    first_keys = list(rows[0]) if rows else []
+    if all(list(row) == first_keys for row in rows):
+        # Common case: every row has the same cells in the same order
+        col_keys = np.array([int(col) for col in first_keys], dtype=np.int64)
+        col_order = np.argsort(col_keys, kind="stable")
+        col_labels = col_keys[col_order]
+        array = np.array([list(row.values()) for row in rows], dtype=dtype)
+        array = array.reshape(len(rows), len(first_keys))[row_order][:, col_order]
+    else:
+        n_cells = [len(row) for row in rows]
+        col_keys = np.fromiter(
+            (int(col) for row in rows for col in row), dtype=np.int64, count=sum(n_cells)
+        )
+        col_labels, col_positions = np.unique(col_keys, return_inverse=True)
+        array = np.full((len(rows), len(col_labels)), fill, dtype=dtype)
+        values = [cell for row in rows for cell in row.values()]
+        if values:
+            row_positions = np.repeat(row_order.argsort(), n_cells)
+            array[row_positions, col_positions] = values
+    return pd.DataFrame(
+        array,
+        index=pd.Index(row_keys[row_order]),
+        columns=pd.Index([str(label) for label in col_labels], dtype=object),
+    )
+
+
+def parse_extract_table_response(
+    json_object: Dict,
+) -> List[Tuple[pd.DataFrame, Optional[pd.DataFrame]]]:
+    """
+    Process an ExtractTable job result into DataFrames.
+
+    Args:
+        json_object (Dict): Job result.
+
+    Returns:
+        List[Tuple[pd.DataFrame, Optional[pd.DataFrame]]]: Extracted
+            tables and float32 confidences, None if not returned.
+    """
+    outputs = []
+    for table in json_object["Tables"]:
+        df = table_json_to_frame(table["TableJson"])
+        if "TableConfidence" in table:
+            df_conf = table_json_to_frame(table["TableConfidence"], dtype=np.float32)
+        else:
+            df_conf = None
+        outputs.append((df, df_conf))
+    return outputs
+
+
+def _strip(values) -> pd.Series:
+    # Flattened cells as stripped strings
+    return (
+        pd.Series(np.asarray(values, dtype=object).ravel(), dtype=object)
+        .astype("string")
+        .str.strip()
+    )
+
+
+# Multipliers of the unit suffixes, e.g. "K€"
+NUMBER_MULTIPLIERS = {"k": 1e3, "K": 1e3, "M": 1e6, "Md": 1e9, "Mds": 1e9}
+
+
+def parse_french_numbers(values) -> np.ndarray:
+    """
+    Parse numbers written the French way ("1 234,56", "1.234,56",
+    "(12 000)", "45 %", "-3,5 K€") in a vectorised way.
+
+    Args:
+        values: Array-like of cells.
+
+    Returns:
+        np.ndarray: Numbers, NaN for cells which are not numbers.
+    """
+    text = _strip(values)
+    # Accounting notation for negative numbers
+    negative = text.str.match(r"^\(.*\)$", na=False)
+    text = text.str.replace("[\\s\u00a0\u202f]|€|%|^\\(|\\)$", "", regex=True)
+    suffix = text.str.extract(r"\d(Mds?|[kKM])$", expand=False)
+    text = text.mask(suffix.notna(), text.str.replace(r"(Mds?|[kKM])$", "", regex=True))
+    # Dots are thousands separators before a decimal comma, or when they
+    # separate several groups of three digits
+    thousands = text.str.contains(",", regex=False, na=False) | text.str.fullmatch(
+        "[-+\u2013\u2212]?\\d{1,3}(\\.\\d{3}){2,}", na=False
+    )
+    text = (
+        text.mask(thousands, text.str.replace(".", "", regex=False))
+        .str.replace(",", ".", regex=False)
+        .str.replace("^[\u2013\u2212]", "-", regex=True)
+    )
+    numbers = pd.to_numeric(text, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    numbers[negative.to_numpy()] *= -1
+    multipliers = suffix.map(NUMBER_MULTIPLIERS).to_numpy(dtype=np.float64, na_value=1.0)
+    return (numbers * multipliers).reshape(np.shape(values))
+
+
+def numeric_columns(df: pd.DataFrame, min_ratio: float = 0.8) -> List:
+    """
+    Columns whose non-empty cells are mostly numbers.
+
+    Args:
+        df (pd.DataFrame): Table.
+        min_ratio (float): Minimum proportion of numbers among non-empty
+            cells.
+
+    Returns:
+        List: Column labels.
+    """
+    cells = df.to_numpy(dtype=object)
+    numbers = parse_french_numbers(cells)
+    non_empty = _strip(cells).fillna("").ne("").to_numpy().reshape(cells.shape)
+    n_numbers = (~np.isnan(numbers) & non_empty).sum(axis=0)
+    n_non_empty = non_empty.sum(axis=0)
+    return [
+        column
+        for column, n_num, n_cells in zip(df.columns, n_numbers, n_non_empty)
+        if n_cells and n_num / n_cells >= min_ratio
+    ]
+
+
+def to_numeric_frame(df: pd.DataFrame, min_ratio: float = 0.8) -> pd.DataFrame:
+    """
+    Convert the numeric columns of a table to floats, cells which are not
+    numbers (e.g. headers) becoming NaN.
+
+    Args:
+        df (pd.DataFrame): Table.
+        min_ratio (float): Minimum proportion of numbers among the
+            non-empty cells of a numeric column.
+
+    Returns:
+        pd.DataFrame: Typed table.
+    """
+    columns = numeric_columns(df, min_ratio)
+    if not columns:
+        return df.copy()
+    typed = df.copy()
+    typed[columns] = parse_french_numbers(df[columns].to_numpy(dtype=object))
+    return typed.astype({column: np.float64 for column in columns})
@@ -1,19 +1,129 @@
 """
 Functions implementing table extraction.
 """
-import requests
-import json
-import time
 import pandas as pd
-from typing import List
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
 import fitz
 import streamlit as st
-from utils import get_extract_table_credits
+from utils import (
+    document_to_bytes,
+    get_credit_manager,
+    get_http_client,
+    get_result_cache,
+)
+from credit_manager import InsufficientCreditsError
+from extract_table_client import ExtractTableClient
+from extract_table_parser import parse_extract_table_response
+from instrumentation import propagate_context, span, traced
+from page_selection import rank_pages, score_pages
+from prefilter import prefilter_document
+from result_cache import (
+    serialize_tables,
+    deserialize_tables,
+    serialize_tables_with_confidences,
+    deserialize_tables_with_confidences,
+)
+from constants import (
+    EXTRACTION_API_URL,
+    PAGE_SELECTION_BACKEND,
+    PREFILTER_MODE,
+    PAGE_SELECTION_VERSION,
+    LOCAL_PAGE_SELECTION_VERSION,
+    TABLE_TRANSFORMER_VERSION,
+    EXTRACT_TABLE_VERSION,
+    EXTRACT_TABLE_BATCH_TIMEOUT,
+)
 
 
+@traced("page_selection")
+def select_pages(
+    document: fitz.Document, top_k: int = 1, backend: str = PAGE_SELECTION_BACKEND
+) -> List[Tuple[int, float]]:
+    """
+    Select the pages most likely to contain the subsidiaries table.
+
+    Args:
+        document (fitz.Document): Document.
+        top_k (int): Number of candidate pages.
+        backend (str): "remote" to use the page selection API, which
+            returns a single page, or "local" to score pages in-process.
+
+    Returns:
+        List[Tuple[int, float]]: Page numbers and scores, best first.
+    """
+    pdf_bytes = document_to_bytes(document)
+
+    if backend == "local":
+        # All page scores are cached so that any number of pages can be
+        # selected from them
+        scores = get_result_cache().get_or_compute(
+            pdf_bytes,
+            "select_page_local",
+            LOCAL_PAGE_SELECTION_VERSION,
+            lambda: score_pages(pdf_bytes),
+        )
+        if any(score > 0 for score in scores):
+            return rank_pages(scores, top_k)
+        # No keyword found, e.g. in scanned documents without text layer:
+        # the page selection API is used instead, and the fallback recorded
+        with span("page_selection_fallback"):
+            return select_pages(document, top_k, backend="remote")
+    elif backend == "remote":
+
+        def compute() -> int:
+            page_selection_url = f"{EXTRACTION_API_URL}/select_page"
+            files = {"pdf_file": pdf_bytes}
+            response = get_http_client().post(url=page_selection_url, files=files)
+            # TODO: handle errors using result field
+            return response.json()["page_number"]
+
+        page_number = get_result_cache().get_or_compute(
+            pdf_bytes, "select_page", PAGE_SELECTION_VERSION, compute
+        )
+        return [(page_number, 1.0)]
+    raise ValueError(f"Unknown page selection backend {backend}.")
+
+
+def select_page(document: fitz.Document) -> int:
+    """
+    Select the page containing the subsidiaries table.
+
+    Args:
+        document (fitz.Document): Document.
+
+    Returns:
+        int: Page number.
+    """
+    ((page_number, _),) = select_pages(document, top_k=1)
+    return page_number
+
+
+@traced("prefilter")
+def prepare_document(
+    document: fitz.Document, mode: str = PREFILTER_MODE
+) -> Tuple[fitz.Document, List[int]]:
+    """
+    Pre-filter a document before it is sent to an extraction engine.
+
+    Args:
+        document (fitz.Document): Document.
+        mode (str): "none", "pdf" or "image", see `prefilter_document`.
+
+    Returns:
+        Tuple[fitz.Document, List[int]]: Document to send and page numbers
+            of its pages in the input document.
+    """
+    if mode == "none":
+        return document, list(range(document.page_count))
+    return prefilter_document(document, mode=mode)
+
+
+@traced("table_transformer_extraction")
 def extract_tables_transformer(document: fitz.Document) -> List:
     """
-    Extract tables using Table Transformer.
+    Extract tables using Table Transformer. The document is sent as is,
+    see `prepare_document` to pre-filter it.
 
     Args:
         document (fitz.Document): Document.
@@ -21,81 +131,181 @@ def extract_tables_transformer(document: fitz.Document) -> List:
     Returns:
         List: List of extracted tables
     """
-    extraction_url = "https://extraction-cs.lab.sspcloud.fr/extract"
-    files = {"pdf_page": document.tobytes()}
-    response = requests.post(
-        url=extraction_url, files=files
+    pdf_bytes = document_to_bytes(document)
+
+    def compute() -> List:
+        extraction_url = f"{EXTRACTION_API_URL}/extract"
+        files = {"pdf_page": pdf_bytes}
+        response = get_http_client().post(url=extraction_url, files=files)
+        # TODO: handle errors using result field
+        tables = response.json()["tables"]
+        return [pd.DataFrame.from_dict(table) for table in tables]
+
+    return get_result_cache().get_or_compute(
+        pdf_bytes,
+        "table_transformer",
+        TABLE_TRANSFORMER_VERSION,
+        compute,
+        serialize=serialize_tables,
+        deserialize=deserialize_tables,
     )
-    # TODO: handle errors using result field
-    tables = response.json()["tables"]
-    return [pd.DataFrame.from_dict(table) for table in tables]
 
 
-def extract_tables(document: fitz.Document) -> List:
+@st.cache_resource
+def get_extract_table_client(token: str) -> ExtractTableClient:
+    """
+    Get ExtractTable client for a given token.
+
+    Args:
+        token (str): ExtractTable token.
+
+    Returns:
+        ExtractTableClient: ExtractTable client.
+    """
+    return ExtractTableClient(token, session=get_http_client())
+
+
+def extract_tables_async(
+    documents: List[fitz.Document], token: Optional[str] = None
+) -> List[Future]:
+    """
+    Extract tables of several documents concurrently using
+    https://extracttable.com/. Documents are sent as is, see
+    `prepare_document` to pre-filter them.
+
+    Args:
+        documents (List[fitz.Document]): Documents.
+        token (Optional[str]): ExtractTable token, defaults to the token
+            of the Streamlit session.
+
+    Returns:
+        List[Future]: Futures resolving to lists of extracted tables and
+            confidences, in the same order as documents.
+    """
+    if token is None:
+        token = st.session_state.auth_token
+    cache = get_result_cache()
+
+    # Cached results are returned as completed futures and do not use credits
+    futures = []
+    missing = []
+    for document in documents:
+        pdf_bytes = document_to_bytes(document)
+        key = cache.key(pdf_bytes, "extract_table", EXTRACT_TABLE_VERSION)
+        value = cache.get(key)
+        future = Future()
+        if value is not None:
+            future.set_result(deserialize_tables_with_confidences(value))
+        else:
+            missing.append((len(futures), key, pdf_bytes))
+        futures.append(future)
+    if not missing:
+        return futures
+
+    # Credits are reserved locally for the whole batch: documents beyond
+    # the remaining credits are not submitted
+    credit_manager = get_credit_manager(token)
+    n_reserved = credit_manager.reserve(len(missing), partial=True)
+    for idx, _, _ in missing[n_reserved:]:
+        futures[idx].set_exception(
+            InsufficientCreditsError(
+                "Not enough credits to extract tables. "
+                "Specify a valid token with enough credits."
+            )
+        )
+    client = get_extract_table_client(token)
+
+    def settle_credits(future: Future):
+        # Cancelled jobs were never submitted and failed jobs use no
+        # credits: their reservations are released
+        if future.cancelled() or future.exception() is not None:
+            credit_manager.release()
+        else:
+            credit_manager.settle()
+
+    for idx, key, pdf_bytes in missing[:n_reserved]:
+
+        def postprocess(json_object: Dict, key: str = key) -> List:
+            outputs = parse_extract_table_response(json_object)
+            cache.put(key, serialize_tables_with_confidences(outputs))
+            return outputs
+
+        futures[idx] = client.submit(pdf_bytes, postprocess=postprocess)
+        futures[idx].add_done_callback(settle_credits)
+    return futures
+
+
+@traced("extract_table_extraction")
+def extract_tables(document: fitz.Document, token: Optional[str] = None) -> List:
     """
-    Extract tables using https://extracttable.com/.
+    Extract tables using https://extracttable.com/, after pre-filtering
+    the document.
 
     Args:
         document (fitz.Document): Document.
+        token (Optional[str]): ExtractTable token, defaults to the token
+            of the Streamlit session.
 
     Returns:
         List: List of extracted tables and confidences.
     """
-    token = st.session_state.auth_token
-    remaining_credits = get_extract_table_credits(token)
-    if remaining_credits < 1:
-        raise ValueError(
-            "Not enough credits to extract tables."
-            "Specify a valid token with enough credits.")
-
-    # Post request to extract tables
-    url = "https://trigger.extracttable.com"
-    # Call extracttable API to get an extraction
-    headers = {"x-api-key": token}
-    payload = {
-        "dup_check": "False",
-    }
-    files = [
-        (
-            "input",
-            (
-                "document.pdf",
-                document.tobytes(),
-            ),
-        )
-    ]
+    prepared, _ = prepare_document(document)
+    (future,) = extract_tables_async([prepared], token)
+    return future.result()
 
-    response = requests.request("POST", url, headers=headers, data=payload, files=files)
-    url = "https://getresult.extracttable.com/?JobId=" + str(
-        json.loads(response.text)["JobId"]
-    )
-    payload = {}
-    response = requests.request("GET", url, headers=headers, data=payload)
-    while str(json.loads(response.text)["JobStatus"]) == "Processing":
-        time.sleep(1)
-        response = requests.request("GET", url, headers=headers, data=payload)
-
-    json_object = json.loads(response.text)
-
-    # Process extraction
-    outputs = []
-    for extracted_table in range(len(json_object["Tables"])):
-        # Process extracted table
-        df = pd.DataFrame.from_dict(
-            json_object["Tables"][extracted_table]["TableJson"], orient="index"
-        )
-        df.index = df.index.map(int)
-        df = df.sort_index(axis=0)
 
-        try:
-            # Process confidence indices
-            df_conf = pd.DataFrame.from_dict(
-                json_object["Tables"][extracted_table]["TableConfidence"], orient="index"
-            )
-            df_conf.index = df_conf.index.map(int)
-            df_conf = df_conf.sort_index(axis=0)
-            outputs.append((df, df_conf))
-        except KeyError:
-            # No confidence index, return None
-            outputs.append((df, None))
-    return outputs
+def split_pages(document: fitz.Document) -> List[fitz.Document]:
+    """
+    Split a document into single-page documents.
+
+    Args:
+        document (fitz.Document): Document.
+
+    Returns:
+        List[fitz.Document]: One document per page.
+    """
+    pages = []
+    for page_number in range(document.page_count):
+        page = fitz.open()
+        page.insert_pdf(document, from_page=page_number, to_page=page_number)
+        pages.append(page)
+    return pages
+
+
+@traced("extract_pages")
+def extract_pages(
+    engine: str, document: fitz.Document, token: Optional[str] = None, max_workers: int = 4
+) -> List[List]:
+    """
+    Extract the tables of each page of a document concurrently. The whole
+    document is pre-filtered first, so that pages without tables are not
+    sent, then split into pages.
+
+    Args:
+        engine (str): "table_transformer" or "extract_table".
+        document (fitz.Document): Document.
+        token (Optional[str]): ExtractTable token, defaults to the token
+            of the Streamlit session.
+        max_workers (int): Maximum number of concurrent Table Transformer
+            requests.
+
+    Returns:
+        List[List]: Extracted tables and confidences (None for Table
+            Transformer) of each page, none for pages dropped by the
+            pre-filter.
+    """
+    if engine not in ("table_transformer", "extract_table"):
+        raise ValueError(f"Unknown extraction engine {engine}.")
+    prepared, page_numbers = prepare_document(document)
+    pages = split_pages(prepared)
+    if engine == "table_transformer":
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pages)))) as executor:
+            outputs = executor.map(propagate_context(extract_tables_transformer), pages)
+            outputs = [[(df, None) for df in tables] for tables in outputs]
+    else:
+        futures = extract_tables_async(pages, token)
+        outputs = ExtractTableClient.wait_all(futures, timeout=EXTRACT_TABLE_BATCH_TIMEOUT)
+    page_outputs = [[] for _ in range(document.page_count)]
+    for page_number, output in zip(page_numbers, outputs):
+        page_outputs[page_number] = output
+    return page_outputs
@@ -0,0 +1,338 @@
+"""
+Index of available extractions, stored as a JSON manifest on S3 and
+maintained on write.
+"""
+from typing import Dict, List, Optional, Set, Tuple
+from datetime import datetime, timezone
+from pathlib import Path
+import json
+import re
+import threading
+import pandas as pd
+import streamlit as st
+from s3fs import S3FileSystem
+from confidence import document_confidence
+from storage import (
+    MANIFEST_FILE_NAME,
+    PARQUET_FILE_NAME,
+    TableReference,
+    confidence_path,
+    read_parquet_metadata,
+)
+from constants import (
+    ENGINES,
+    EXTRACTION_INDEX_PATH,
+)
+
+
+INDEX_COLUMNS = [
+    "siren",
+    "year",
+    "engine",
+    "n_tables",
+    "has_confidence",
+    "storage_format",
+    "mean_confidence",
+    "low_confidence_ratio",
+    "created_at",
+    "updated_at",
+]
+
+_index_lock = threading.Lock()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def read_index(fs: S3FileSystem) -> List[Dict]:
+    """
+    Read index entries from S3.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+
+    Returns:
+        List[Dict]: Index entries.
+    """
+    try:
+        with fs.open(EXTRACTION_INDEX_PATH, "rb") as f:
+            return json.load(f)["extractions"]
+    except FileNotFoundError:
+        return []
+
+
+def write_index(fs: S3FileSystem, entries: List[Dict]):
+    """
+    Write index entries to S3.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        entries (List[Dict]): Index entries.
+    """
+    entries = sorted(entries, key=lambda entry: (entry["engine"], entry["siren"], entry["year"]))
+    with fs.open(EXTRACTION_INDEX_PATH, "wb") as f:
+        f.write(
+            json.dumps({"updated_at": _now(), "extractions": entries}).encode("utf-8")
+        )
+
+
+def record_extraction(
+    fs: S3FileSystem,
+    siren: str,
+    year: int,
+    engine: str,
+    n_tables: int,
+    has_confidence: bool = False,
+    storage_format: str = "legacy",
+    confidence: Optional[Dict] = None,
+):
+    """
+    Add or update the index entry of an extraction.
+
+    Concurrent writers from different processes may overwrite each other's
+    updates: `refresh_index`, run whenever the app reads the index again,
+    restores missing entries.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        siren (str): Firm identifier.
+        year (int): Year.
+        engine (str): Extraction engine.
+        n_tables (int): Number of extracted tables.
+        has_confidence (bool): Whether confidences are available.
+        storage_format (str): "parquet" or "legacy".
+        confidence (Optional[Dict]): Aggregate confidence of the tables,
+            output of `document_confidence`.
+    """
+    with _index_lock:
+        entries = read_index(fs)
+        now = _now()
+        for entry in entries:
+            if (entry["siren"], entry["year"], entry["engine"]) == (siren, int(year), engine):
+                entry.update(
+                    n_tables=n_tables,
+                    has_confidence=has_confidence,
+                    storage_format=storage_format,
+                    **_confidence_fields(confidence),
+                    updated_at=now,
+                )
+                break
+        else:
+            entries.append(
+                {
+                    "siren": siren,
+                    "year": int(year),
+                    "engine": engine,
+                    "n_tables": n_tables,
+                    "has_confidence": has_confidence,
+                    "storage_format": storage_format,
+                    **_confidence_fields(confidence),
+                    "created_at": now,
+                    "updated_at": now,
+                }
+            )
+        write_index(fs, entries)
+
+
+def _confidence_fields(confidence: Optional[Dict]) -> Dict:
+    # Index fields of the aggregate confidence of an extraction
+    if confidence is None:
+        return {"mean_confidence": None, "low_confidence_ratio": None}
+    return {
+        "mean_confidence": confidence["mean"],
+        "low_confidence_ratio": confidence["low_ratio"],
+    }
+
+
+def _scan_extraction(
+    fs: S3FileSystem, engine: str, directory: str, legacy: bool = False
+) -> Optional[Dict]:
+    """
+    Build the index entry of an extraction directory, None if it is not
+    committed by a manifest, unless legacy extractions are scanned.
+    """
+    match = re.fullmatch(r"(\d+)_(\d{4})", Path(directory).name)
+    if match is None:
+        return None
+    siren, year = match.groups()
+    file_names = [Path(file_path).name for file_path in fs.ls(directory, detail=False)]
+    if MANIFEST_FILE_NAME in file_names:
+        with fs.open(f"{directory}/{MANIFEST_FILE_NAME}", "rb") as f:
+            manifest = json.load(f)
+        storage_format = manifest["storage_format"]
+        n_tables = manifest["n_tables"]
+        has_confidence = manifest["has_confidence"]
+        confidence = manifest.get("confidence")
+    elif not legacy:
+        return None
+    elif PARQUET_FILE_NAME in file_names:
+        # Extractions written before manifests were introduced
+        storage_format = "parquet"
+        tables_metadata = read_parquet_metadata(
+            fs, f"{directory}/{PARQUET_FILE_NAME}"
+        )["tables"]
+        n_tables = len(tables_metadata)
+        has_confidence = any(table["has_confidence"] for table in tables_metadata)
+        confidence = document_confidence(
+            [table.get("confidence_stats") for table in tables_metadata]
+        )
+    else:
+        storage_format = "legacy"
+        n_tables = len(
+            [
+                file_name
+                for file_name in file_names
+                if re.fullmatch(r"table_\d+\.\w+", file_name)
+            ]
+        )
+        has_confidence = engine == "extract_table" and fs.exists(
+            confidence_path(siren, year)
+        )
+        confidence = None
+    now = _now()
+    return {
+        "siren": siren,
+        "year": int(year),
+        "engine": engine,
+        "n_tables": n_tables,
+        "has_confidence": has_confidence,
+        "storage_format": storage_format,
+        **_confidence_fields(confidence),
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def scan_extractions(
+    fs: S3FileSystem, known: Optional[Set[Tuple[str, str]]] = None, legacy: bool = False
+) -> List[Dict]:
+    """
+    Build the index entries of the stored extractions.
+
+    Only the top-level extraction directories are listed, and only
+    extractions committed by a manifest are scanned, unless legacy
+    extractions are requested.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        known (Optional[Set[Tuple[str, str]]]): Engines and directory names
+            of the extractions to skip.
+        legacy (bool): Also scan extractions saved without a manifest, for
+            their migration.
+
+    Returns:
+        List[Dict]: Index entries.
+    """
+    known = known or set()
+    entries = []
+    for engine, (s3_path, _) in ENGINES.items():
+        fs.invalidate_cache(s3_path)
+        if not fs.exists(s3_path):
+            continue
+        for directory in fs.ls(s3_path, detail=False):
+            if (engine, Path(directory).name) in known:
+                continue
+            entry = _scan_extraction(fs, engine, directory, legacy)
+            if entry is not None and entry["n_tables"] > 0:
+                entries.append(entry)
+    return entries
+
+
+def refresh_index(fs: S3FileSystem, full: bool = False) -> int:
+    """
+    Add to the index the committed extractions which are missing from it.
+
+    Only new directories are scanned, unless a full rebuild is requested.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        full (bool): Rebuild the index from scratch.
+
+    Returns:
+        int: Number of added entries.
+    """
+    with _index_lock:
+        entries = [] if full else read_index(fs)
+        known = {(entry["engine"], f"{entry['siren']}_{entry['year']}") for entry in entries}
+        new_entries = scan_extractions(fs, known)
+        entries += new_entries
+        if new_entries or full:
+            write_index(fs, entries)
+        return len(new_entries)
+
+
+def index_to_frame(entries: List[Dict]) -> pd.DataFrame:
+    """
+    Convert index entries to a DataFrame.
+
+    Args:
+        entries (List[Dict]): Index entries.
+
+    Returns:
+        pd.DataFrame: Index.
+    """
+    return pd.DataFrame(entries, columns=INDEX_COLUMNS)
+
+
+def filter_index(
+    index: pd.DataFrame,
+    engine: Optional[str] = None,
+    sirens: Optional[List[str]] = None,
+    years: Optional[List[int]] = None,
+) -> pd.DataFrame:
+    """
+    Filter index by engine, SIREN and year.
+
+    Args:
+        index (pd.DataFrame): Index.
+        engine (Optional[str]): Extraction engine.
+        sirens (Optional[List[str]]): Firm identifiers.
+        years (Optional[List[int]]): Years.
+
+    Returns:
+        pd.DataFrame: Filtered index.
+    """
+    mask = pd.Series(True, index=index.index)
+    if engine:
+        mask &= index["engine"] == engine
+    if sirens:
+        mask &= index["siren"].isin(sirens)
+    if years:
+        mask &= index["year"].isin([int(year) for year in years])
+    return index[mask]
+
+
+def index_table_references(index: pd.DataFrame, engine: str) -> List[TableReference]:
+    """
+    References of the tables of the indexed extractions of an engine.
+
+    Args:
+        index (pd.DataFrame): Index.
+        engine (str): Extraction engine.
+
+    Returns:
+        List[TableReference]: Table references.
+    """
+    return [
+        TableReference(engine, row.siren, row.year, table_idx)
+        for row in filter_index(index, engine=engine).itertuples()
+        for table_idx in range(row.n_tables)
+    ]
+
+
+@st.cache_data(ttl=60)
+def get_extraction_index(_fs: S3FileSystem) -> pd.DataFrame:
+    """
+    Get index of available extractions, built on first use. Committed
+    extractions missing from the index, whose entries were lost by
+    concurrent writers, are added each time the cached index expires.
+
+    Args:
+        _fs (S3FileSystem): S3 file system.
+
+    Returns:
+        pd.DataFrame: Index of extractions.
+    """
+    refresh_index(_fs)
+    return index_to_frame(read_index(_fs))
@@ -0,0 +1,171 @@
+"""
+Pooled HTTP client shared by all remote calls.
+"""
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlsplit
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from concurrency import backoff_delay
+from instrumentation import span
+
+
+# Methods which can safely be retried on any transient error
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Status codes triggering a retry
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Status codes triggering a retry of non-idempotent requests: the request
+# has been rejected before being processed
+RETRY_STATUSES_NON_IDEMPOTENT = {429, 503}
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    """
+    Parse a Retry-After header, given in seconds or as an HTTP date.
+
+    Args:
+        value (str): Header value.
+
+    Returns:
+        Optional[float]: Delay in seconds, None if the value can't be parsed.
+    """
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date is None:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class HttpClient:
+    """
+    HTTP client with keep-alive connection pools per host, timeouts and
+    retries with jitter. Each attempt is recorded as an "http <method>
+    <host><path>" span.
+
+    The client exposes the same `request`, `get` and `post` methods as
+    `requests.Session`.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 120.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        pool_connections: int = 8,
+        pool_maxsize: int = 16,
+        max_retry_after: float = 60.0,
+    ):
+        """
+        Constructor.
+
+        Args:
+            connect_timeout (float): Connection timeout in seconds.
+            read_timeout (float): Read timeout in seconds.
+            retries (int): Maximum number of retries.
+            backoff (float): Base backoff delay in seconds.
+            pool_connections (int): Number of hosts with a connection pool.
+            pool_maxsize (int): Maximum number of connections per host.
+            max_retry_after (float): Maximum delay in seconds waited on a
+                Retry-After header.
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(
+        self, method: str, url: str, retries: Optional[int] = None, **kwargs
+    ) -> requests.Response:
+        """
+        Send a request, retrying on connection errors and on 5xx/429
+        responses. A Retry-After header is honoured up to
+        `max_retry_after` seconds, backoff is used when it is missing or
+        can't be parsed.
+
+        Args:
+            method (str): HTTP method.
+            url (str): URL.
+            retries (Optional[int]): Maximum number of retries, defaults to
+                the client setting.
+            **kwargs: Arguments passed to `requests.Session.request`.
+
+        Returns:
+            requests.Response: Response.
+        """
+        method = method.upper()
+        retries = self.retries if retries is None else retries
+        kwargs.setdefault("timeout", self.timeout)
+        split_url = urlsplit(url)
+        stage = f"http {method} {split_url.netloc}{split_url.path or '/'}"
+        idempotent = method in IDEMPOTENT_METHODS
+        retry_statuses = RETRY_STATUSES if idempotent else RETRY_STATUSES_NON_IDEMPOTENT
+
+        attempt = 0
+        while True:
+            try:
+                with span(stage) as current:
+                    response = self.session.request(method, url, **kwargs)
+                    if response.status_code >= 400:
+                        current.outcome = "error"
+                        current.error = f"HTTP {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout):
+                if not (attempt < retries and idempotent):
+                    raise
+            else:
+                if not (attempt < retries and response.status_code in retry_statuses):
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After", ""))
+                # Release the connection to the pool before waiting
+                response.close()
+                if retry_after is not None:
+                    time.sleep(min(retry_after, self.max_retry_after))
+                    attempt += 1
+                    continue
+            time.sleep(backoff_delay(attempt, self.backoff))
+            attempt += 1
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        Send a GET request.
+
+        Args:
+            url (str): URL.
+
+        Returns:
+            requests.Response: Response.
+        """
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """
+        Send a POST request.
+
+        Args:
+            url (str): URL.
+
+        Returns:
+            requests.Response: Response.
+        """
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        """
+        Close pooled connections.
+        """
+        self.session.close()
@@ -0,0 +1,288 @@
+"""
+Instrumentation of the pipeline stages.
+
+Each call to an I/O function is recorded as a span (stage, SIREN, year,
+bytes, duration and outcome). Spans are logged as JSON lines, kept in
+memory for the supervision page and, when `prometheus_client` is installed
+and METRICS_PORT is set, exported as Prometheus metrics.
+"""
+from typing import Any, Callable, Dict, Iterator, Optional
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+import functools
+import inspect
+import json
+import logging
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+from constants import MAX_RECORDED_SPANS, METRICS_PORT, SPAN_LOGS
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+SPAN_LOGGER = logging.getLogger("extraction.spans")
+if SPAN_LOGS and not SPAN_LOGGER.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    SPAN_LOGGER.addHandler(_handler)
+    SPAN_LOGGER.setLevel(logging.INFO)
+    SPAN_LOGGER.propagate = False
+
+# SIREN and year of the document being processed, inherited by nested spans
+_document_context: ContextVar[Dict[str, Any]] = ContextVar("document_context", default={})
+
+
+@dataclass
+class Span:
+    """
+    Timed call to a pipeline stage.
+    """
+
+    stage: str
+    started_at: str
+    siren: Optional[str] = None
+    year: Optional[int] = None
+    n_bytes: Optional[int] = None
+    duration: float = 0.0
+    # "ok" or "error"
+    outcome: str = "ok"
+    error: Optional[str] = None
+
+
+class SpanRecorder:
+    """
+    Thread-safe bounded store of the latest spans.
+    """
+
+    def __init__(self, max_spans: int = 10_000):
+        """
+        Constructor.
+
+        Args:
+            max_spans (int): Maximum number of kept spans.
+        """
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def record(self, span: Span):
+        """
+        Record a finished span.
+
+        Args:
+            span (Span): Span.
+        """
+        with self._lock:
+            self._spans.append(span)
+
+    def clear(self):
+        """
+        Remove all spans.
+        """
+        with self._lock:
+            self._spans.clear()
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Recorded spans as a DataFrame.
+
+        Returns:
+            pd.DataFrame: One row per span.
+        """
+        with self._lock:
+            spans = list(self._spans)
+        return pd.DataFrame(
+            [asdict(span) for span in spans], columns=list(Span.__dataclass_fields__)
+        )
+
+    def stage_stats(self) -> pd.DataFrame:
+        """
+        Latency percentiles, error counts and volumes per stage.
+
+        Returns:
+            pd.DataFrame: One row per stage.
+        """
+        spans = self.to_frame()
+        if spans.empty:
+            return pd.DataFrame(
+                columns=["stage", "count", "errors", "p50", "p95", "max", "total_bytes"]
+            )
+        return (
+            spans.groupby("stage")
+            .agg(
+                count=("duration", "size"),
+                errors=("outcome", lambda outcome: int((outcome == "error").sum())),
+                p50=("duration", lambda duration: np.percentile(duration, 50)),
+                p95=("duration", lambda duration: np.percentile(duration, 95)),
+                max=("duration", "max"),
+                total_bytes=("n_bytes", "sum"),
+            )
+            .reset_index()
+            .sort_values("p95", ascending=False)
+        )
+
+
+RECORDER = SpanRecorder(MAX_RECORDED_SPANS)
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def _get_metrics() -> Optional[Dict]:
+    # Prometheus metrics, created and exported on first use
+    global _metrics
+    if prometheus_client is None or not METRICS_PORT:
+        return None
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = {
+                "duration": prometheus_client.Histogram(
+                    "extraction_stage_duration_seconds",
+                    "Duration of pipeline stages.",
+                    ["stage", "outcome"],
+                    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+                ),
+                "bytes": prometheus_client.Counter(
+                    "extraction_stage_bytes_total",
+                    "Bytes transferred by pipeline stages.",
+                    ["stage"],
+                ),
+            }
+            try:
+                prometheus_client.start_http_server(METRICS_PORT)
+            except OSError:
+                # Port already used by another process, e.g. another worker
+                SPAN_LOGGER.warning(json.dumps({"metrics_port_unavailable": METRICS_PORT}))
+        return _metrics
+
+
+def _finish(span: Span):
+    RECORDER.record(span)
+    SPAN_LOGGER.info(json.dumps(asdict(span)))
+    metrics = _get_metrics()
+    if metrics is not None:
+        metrics["duration"].labels(span.stage, span.outcome).observe(span.duration)
+        if span.n_bytes:
+            metrics["bytes"].labels(span.stage).inc(span.n_bytes)
+
+
+@contextmanager
+def span(
+    stage: str,
+    siren: Optional[str] = None,
+    year: Optional[int] = None,
+    n_bytes: Optional[int] = None,
+) -> Iterator[Span]:
+    """
+    Record the duration and outcome of a block. The SIREN and year default
+    to those of the enclosing document span, and are inherited by nested
+    spans. The number of bytes can be set on the yielded span.
+
+    Args:
+        stage (str): Stage name.
+        siren (Optional[str]): Firm identifier.
+        year (Optional[int]): Year.
+        n_bytes (Optional[int]): Number of transferred bytes.
+
+    Yields:
+        Span: Span.
+    """
+    context = _document_context.get()
+    siren = context.get("siren") if siren is None else siren
+    year = context.get("year") if year is None else int(year)
+    current = Span(
+        stage=stage,
+        started_at=datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        siren=siren,
+        year=year,
+        n_bytes=n_bytes,
+    )
+    token = _document_context.set({"siren": siren, "year": year})
+    start = time.perf_counter()
+    try:
+        yield current
+    except Exception as e:
+        current.outcome = "error"
+        current.error = f"{type(e).__name__}: {e}"[:500]
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _document_context.reset(token)
+        _finish(current)
+
+
+def _payload_size(result: Any) -> Optional[int]:
+    # Size of the bytes returned by a function, if any
+    if isinstance(result, (bytes, bytearray, memoryview)):
+        return len(result)
+    if isinstance(result, tuple):
+        sizes = [_payload_size(item) for item in result]
+        sizes = [size for size in sizes if size is not None]
+        return sum(sizes) if sizes else None
+    return None
+
+
+def traced(stage: str, size: Callable[[Any], Optional[int]] = _payload_size) -> Callable:
+    """
+    Decorator recording each call to a function as a span. The SIREN and
+    year are read from the "company_id" (or "siren") and "year" arguments
+    when the function has them.
+
+    Args:
+        stage (str): Stage name.
+        size (Callable[[Any], Optional[int]]): Function computing the
+            number of transferred bytes from the function output.
+
+    Returns:
+        Callable: Decorator.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            siren = arguments.get("company_id", arguments.get("siren"))
+            year = arguments.get("year")
+            with span(stage, siren=siren, year=year) as current:
+                result = func(*args, **kwargs)
+                current.n_bytes = size(result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def propagate_context(func: Callable) -> Callable:
+    """
+    Wrap a function run on another thread so that its spans inherit the
+    document of the calling thread.
+
+    Args:
+        func (Callable): Function.
+
+    Returns:
+        Callable: Wrapped function.
+    """
+    context = _document_context.get()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _document_context.set(context)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _document_context.reset(token)
+
+    return wrapper
+
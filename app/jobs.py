@@ -0,0 +1,300 @@
+"""
+Persistent extraction job queue backed by SQLite.
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+import json
+import sqlite3
+
+
+JOB_STATUSES = ["queued", "running", "done", "failed"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    siren TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    engines TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    stage TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    token TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+)
+"""
+
+# At most one queued or running job per SIREN, year and engines
+ACTIVE_JOB_INDEX = """
+CREATE UNIQUE INDEX IF NOT EXISTS active_jobs ON jobs (siren, year, engines)
+WHERE status IN ('queued', 'running')
+"""
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class JobQueue:
+    """
+    Extraction job queue shared by the Streamlit app and worker processes.
+
+    Identical jobs (same SIREN, year and engines) are deduplicated while
+    queued or running: once done or failed, the same job can be queued
+    again, e.g. to retry a failure or to extract a deleted extraction.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Constructor.
+
+        Args:
+            db_path (str): Path of the SQLite database.
+        """
+        self.db_path = db_path
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(SCHEMA)
+            self._drop_unique_constraint(connection)
+            self._add_token_column(connection)
+            connection.execute(ACTIVE_JOB_INDEX)
+
+    @staticmethod
+    def _drop_unique_constraint(connection: sqlite3.Connection):
+        # Queues created when all identical jobs were deduplicated have a
+        # unique constraint, which SQLite can only drop by copying the table
+        connection.execute("BEGIN IMMEDIATE")
+        table_sql = connection.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'jobs'"
+        ).fetchone()[0]
+        if "UNIQUE" in table_sql:
+            columns = ", ".join(
+                row["name"] for row in connection.execute("PRAGMA table_info(jobs)")
+            )
+            connection.execute("ALTER TABLE jobs RENAME TO jobs_unique")
+            connection.execute(SCHEMA)
+            connection.execute(
+                f"INSERT INTO jobs ({columns}) SELECT {columns} FROM jobs_unique"
+            )
+            connection.execute("DROP TABLE jobs_unique")
+        connection.execute("COMMIT")
+
+    @staticmethod
+    def _add_token_column(connection: sqlite3.Connection):
+        # Queues created before jobs carried the ExtractTable token
+        connection.execute("BEGIN IMMEDIATE")
+        columns = [row["name"] for row in connection.execute("PRAGMA table_info(jobs)")]
+        if "token" not in columns:
+            connection.execute("ALTER TABLE jobs ADD COLUMN token TEXT")
+        connection.execute("COMMIT")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Autocommit mode: transactions are explicit, and rolled back when
+        # the connection is closed on error
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        # Jobs without engine only select the pages of the document
+        job["engines"] = job["engines"].split(",") if job["engines"] else []
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def enqueue(
+        self, siren: str, year: int, engines: List[str], token: Optional[str] = None
+    ) -> Tuple[int, bool]:
+        """
+        Add a job to the queue, unless an identical job is queued or
+        running.
+
+        Args:
+            siren (str): Firm identifier.
+            year (int): Year.
+            engines (List[str]): Extraction engines, none to only select
+                the pages of the document.
+            token (Optional[str]): ExtractTable token of the user, the
+                token of the workers if not specified. It is erased once
+                the job is done or failed.
+
+        Returns:
+            Tuple[int, bool]: Job ID, and whether the job was added, False
+                if an identical job is already queued or running.
+        """
+        engines_key = ",".join(sorted(engines))
+        now = _now()
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT id FROM jobs WHERE siren = ? AND year = ? AND engines = ? "
+                "AND status IN ('queued', 'running')",
+                (siren, int(year), engines_key),
+            ).fetchone()
+            if row is None:
+                cursor = connection.execute(
+                    "INSERT INTO jobs (siren, year, engines, token, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (siren, int(year), engines_key, token, now, now),
+                )
+                job_id, queued = cursor.lastrowid, True
+            else:
+                job_id, queued = row["id"], False
+            connection.execute("COMMIT")
+        return job_id, queued
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        """
+        Claim the oldest queued job.
+
+        Args:
+            worker (str): Worker identifier.
+
+        Returns:
+            Optional[Dict]: Job, None if the queue is empty.
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?",
+                (worker, _now(), row["id"]),
+            )
+            connection.execute("COMMIT")
+        job = self._to_dict(row)
+        job.update(status="running", worker=worker, attempts=job["attempts"] + 1)
+        return job
+
+    def update_stage(self, job_id: int, stage: str):
+        """
+        Record the current stage of a running job.
+
+        Args:
+            job_id (int): Job ID.
+            stage (str): Stage.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET stage = ?, updated_at = ? WHERE id = ?",
+                (stage, _now(), job_id),
+            )
+
+    def complete(self, job_id: int, result: Dict):
+        """
+        Mark a job as done.
+
+        Args:
+            job_id (int): Job ID.
+            result (Dict): Job result.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = 'done', stage = NULL, result = ?, token = NULL, "
+                "updated_at = ? WHERE id = ?",
+                (json.dumps(result), _now(), job_id),
+            )
+
+    def fail(self, job_id: int, error: str):
+        """
+        Mark a job as failed.
+
+        Args:
+            job_id (int): Job ID.
+            error (str): Error message.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, token = NULL, updated_at = ? "
+                "WHERE id = ?",
+                (error, _now(), job_id),
+            )
+
+    def requeue_stale(self, max_age_seconds: float) -> int:
+        """
+        Re-queue running jobs which have not been updated for a while, e.g.
+        because their worker crashed.
+
+        Args:
+            max_age_seconds (float): Maximum age of the last update.
+
+        Returns:
+            int: Number of re-queued jobs.
+        """
+        threshold = datetime.fromtimestamp(
+            datetime.now(timezone.utc).timestamp() - max_age_seconds, timezone.utc
+        ).isoformat(timespec="seconds")
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, updated_at = ? "
+                "WHERE status = 'running' AND updated_at < ?",
+                (_now(), threshold),
+            )
+            return cursor.rowcount
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        """
+        Get a job.
+
+        Args:
+            job_id (int): Job ID.
+
+        Returns:
+            Optional[Dict]: Job.
+        """
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else self._to_dict(row)
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 500) -> List[Dict]:
+        """
+        List the most recent jobs.
+
+        Args:
+            status (Optional[str]): Status filter.
+            limit (int): Maximum number of jobs.
+
+        Returns:
+            List[Dict]: Jobs.
+        """
+        query = "SELECT * FROM jobs"
+        parameters = []
+        if status is not None:
+            query += " WHERE status = ?"
+            parameters.append(status)
+        query += " ORDER BY id DESC LIMIT ?"
+        parameters.append(limit)
+        with self._connect() as connection:
+            rows = connection.execute(query, parameters).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def count_by_status(self) -> Dict[str, int]:
+        """
+        Count jobs per status.
+
+        Returns:
+            Dict[str, int]: Number of jobs per status.
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"
+            ).fetchall()
+        counts = {status: 0 for status in JOB_STATUSES}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
@@ -0,0 +1,203 @@
+"""
+One-shot migration of legacy extractions (one CSV/XLSX file per table) to
+the Parquet storage format, and of extractions saved without a manifest.
+
+Usage:
+    python migrate_storage.py [--engine ENGINE] [--workers N] [--dry-run] [--delete-legacy]
+    python migrate_storage.py --manifests [--engine ENGINE] [--workers N] [--dry-run]
+"""
+from typing import Dict, List
+import argparse
+from s3fs import S3FileSystem
+from concurrency import run_concurrently
+from extraction_index import refresh_index, scan_extractions
+from normalization import normalize_tables
+from constants import ENGINES
+from storage import (
+    commit_extraction,
+    confidence_path,
+    extraction_path,
+    normalized_path,
+    parquet_path,
+    read_legacy_table,
+    read_manifest,
+    save_extraction,
+)
+from utils import get_file_system
+
+
+def migrate_extraction(fs: S3FileSystem, entry: Dict, delete_legacy: bool = False):
+    """
+    Migrate the extraction of a document to the Parquet format.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        entry (Dict): Index entry of the extraction.
+        delete_legacy (bool): Whether to delete the legacy files.
+    """
+    engine, siren, year = entry["engine"], entry["siren"], entry["year"]
+    tables = []
+    confidences = []
+    for table_idx in range(entry["n_tables"]):
+        df, df_conf = read_legacy_table(fs, engine, siren, year, table_idx)
+        tables.append(df)
+        confidences.append(df_conf)
+    save_extraction(
+        fs,
+        engine,
+        siren,
+        year,
+        tables=tables,
+        confidences=confidences,
+        storage_format="parquet",
+        normalized=normalize_tables(tables),
+    )
+    if delete_legacy:
+        extension = "csv" if engine == "table_transformer" else "xlsx"
+        legacy_files = [
+            f"{extraction_path(engine, siren, year)}/table_{table_idx}.{extension}"
+            for table_idx in range(entry["n_tables"])
+        ]
+        if engine == "extract_table":
+            legacy_files += [
+                f"{confidence_path(siren, year)}/table_{table_idx}.xlsx"
+                for table_idx in range(entry["n_tables"])
+            ]
+        fs.rm([file_path for file_path in legacy_files if fs.exists(file_path)])
+
+
+def write_manifest(fs: S3FileSystem, entry: Dict) -> bool:
+    """
+    Write the manifest of an extraction saved before manifests were
+    introduced, so that it is not extracted again.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        entry (Dict): Index entry of the extraction.
+
+    Returns:
+        bool: False if the extraction already had a manifest.
+    """
+    engine, siren, year = entry["engine"], entry["siren"], entry["year"]
+    if read_manifest(fs, engine, siren, year) is not None:
+        return False
+    storage_format = entry.get("storage_format", "legacy")
+    if storage_format == "parquet":
+        table_paths = [parquet_path(engine, siren, year)]
+    else:
+        extension = ENGINES[engine][1]
+        table_paths = [
+            f"{extraction_path(engine, siren, year)}/table_{table_idx}.{extension}"
+            for table_idx in range(entry["n_tables"])
+        ]
+    optional_paths = [normalized_path(engine, siren, year)]
+    if storage_format == "legacy" and entry.get("has_confidence"):
+        optional_paths += [
+            f"{confidence_path(siren, year)}/table_{table_idx}.xlsx"
+            for table_idx in range(entry["n_tables"])
+        ]
+    files = {}
+    for s3_path in table_paths + optional_paths:
+        try:
+            files[s3_path] = fs.cat_file(s3_path)
+        except FileNotFoundError:
+            if s3_path in table_paths:
+                raise ValueError(f"Incomplete extraction, missing file {s3_path}.")
+    commit_extraction(
+        fs,
+        engine,
+        siren,
+        year,
+        files,
+        storage_format=storage_format,
+        n_tables=entry["n_tables"],
+        has_confidence=entry.get("has_confidence", False),
+        created_at=entry.get("created_at"),
+    )
+    return True
+
+
+def write_manifests(fs: S3FileSystem, entries: List[Dict], max_workers: int):
+    """
+    Write the missing manifests of extractions.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        entries (List[Dict]): Index entries of the extractions.
+        max_workers (int): Number of concurrent extractions.
+    """
+    n_written = 0
+    n_failed = 0
+    outputs = run_concurrently(
+        lambda entry: write_manifest(fs, entry), entries, max_workers=max_workers
+    )
+    for entry, written, error in outputs:
+        if error is not None:
+            n_failed += 1
+            print(f"Failed to commit {entry['siren']}_{entry['year']} ({entry['engine']}): {error}")
+        elif written:
+            n_written += 1
+    print(f"{n_written} manifests written, {n_failed} failures.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Migrate legacy extractions to the Parquet storage format."
+    )
+    parser.add_argument(
+        "--engine", choices=["table_transformer", "extract_table"], default=None
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--delete-legacy", action="store_true")
+    parser.add_argument(
+        "--manifests",
+        action="store_true",
+        help="Only write the manifests of extractions saved without one.",
+    )
+    args = parser.parse_args()
+
+    fs = get_file_system()
+    # Extractions saved without a manifest are not indexed, all the stored
+    # extractions are scanned
+    scanned = scan_extractions(fs, legacy=True)
+    if args.manifests:
+        entries = [
+            entry
+            for entry in scanned
+            if args.engine is None or entry["engine"] == args.engine
+        ]
+        print(f"{len(entries)} extractions to check.")
+        if not args.dry_run:
+            write_manifests(fs, entries, args.workers)
+            refresh_index(fs)
+        return
+    entries = [
+        entry
+        for entry in scanned
+        if entry.get("storage_format", "legacy") == "legacy"
+        and (args.engine is None or entry["engine"] == args.engine)
+    ]
+    print(f"{len(entries)} extractions to migrate.")
+    if args.dry_run:
+        for entry in entries:
+            print(f"{entry['engine']}: {entry['siren']}_{entry['year']}")
+        return
+
+    n_failed = 0
+    outputs = run_concurrently(
+        lambda entry: migrate_extraction(fs, entry, args.delete_legacy),
+        entries,
+        max_workers=args.workers,
+    )
+    for entry, _, error in outputs:
+        if error is not None:
+            n_failed += 1
+            print(f"Failed to migrate {entry['siren']}_{entry['year']} ({entry['engine']}): {error}")
+    # Rebuild the index so that migrated extractions are read from Parquet
+    refresh_index(fs, full=True)
+    print(f"{len(entries) - n_failed} extractions migrated, {n_failed} failures.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Normalisation of extracted subsidiaries tables ("tableau des filiales et
+participations") to a typed schema.
+"""
+from typing import Dict, List, NamedTuple, Optional
+import re
+import numpy as np
+import pandas as pd
+from extract_table_parser import parse_french_numbers
+from page_selection import normalize_text
+
+
+class Field(NamedTuple):
+    """
+    Column of the normalised schema.
+    """
+
+    name: str
+    dtype: str
+    # Pattern matched against the normalized column header
+    pattern: str
+
+
+# Fields in matching order: more specific patterns come first
+NORMALIZED_SCHEMA = [
+    Field("siren", "string", r"siren|siret|identifiant|n[°o] d'identification"),
+    Field("quote_part", "float32", r"quote.?part|% du capital|pourcentage|%"),
+    Field("capitaux_propres", "float64", r"capitaux propres|autres que (le )?capital|reserves"),
+    Field("capital", "float64", r"capital"),
+    Field("valeur_nette", "float64", r"nette"),
+    Field("valeur_brute", "float64", r"brute|valeur comptable|valeur d'inventaire"),
+    Field("prets_avances", "float64", r"prets|avances"),
+    Field("cautions_avals", "float64", r"cautions|avals"),
+    Field("chiffre_affaires", "float64", r"chiffre d'affaires|\bca\b"),
+    Field("resultat", "float64", r"resultat|benefice|perte"),
+    Field("dividendes", "float64", r"dividendes"),
+    Field("filiale", "string", r"filiales?|societes?|denomination|raison sociale|\bnom\b"),
+]
+# Columns of normalised tables, in display order
+NORMALIZED_COLUMNS = [
+    "table",
+    "filiale",
+    "siren",
+    "capital",
+    "capitaux_propres",
+    "quote_part",
+    "valeur_brute",
+    "valeur_nette",
+    "prets_avances",
+    "cautions_avals",
+    "chiffre_affaires",
+    "resultat",
+    "dividendes",
+]
+# Data type of each normalised column
+NORMALIZED_DTYPES = dict(
+    {"table": "int16"}, **{field.name: field.dtype for field in NORMALIZED_SCHEMA}
+)
+NORMALIZED_DTYPES = {column: NORMALIZED_DTYPES[column] for column in NORMALIZED_COLUMNS}
+
+# Maximum number of header rows of a table
+MAX_HEADER_ROWS = 3
+
+
+def _is_default_label(label, position: int) -> bool:
+    # Column labelled by its position rather than by a header
+    return str(label) == str(position)
+
+
+def header_row_count(df: pd.DataFrame, min_numeric_ratio: float = 0.3) -> int:
+    """
+    Number of leading header rows of a table: rows before the first row
+    with enough numeric cells.
+
+    Args:
+        df (pd.DataFrame): Table.
+        min_numeric_ratio (float): Minimum proportion of numeric cells of
+            a data row.
+
+    Returns:
+        int: Number of header rows.
+    """
+    head = df.iloc[:MAX_HEADER_ROWS].to_numpy(dtype=object)
+    numeric = ~np.isnan(parse_french_numbers(head))
+    for row_idx, row in enumerate(numeric):
+        if row.mean() >= min_numeric_ratio:
+            return row_idx
+    # No data row among the first rows: only longer tables are assumed to
+    # start with header rows
+    return MAX_HEADER_ROWS if len(df) > MAX_HEADER_ROWS else 0
+
+
+def column_headers(df: pd.DataFrame, n_header_rows: int) -> List[str]:
+    """
+    Normalized header of each column, from its label and header rows.
+
+    Args:
+        df (pd.DataFrame): Table.
+        n_header_rows (int): Number of header rows.
+
+    Returns:
+        List[str]: Headers.
+    """
+    headers = []
+    for position, label in enumerate(df.columns):
+        parts = [] if _is_default_label(label, position) else [str(label)]
+        parts += [
+            str(cell) for cell in df.iloc[:n_header_rows, position] if not pd.isna(cell)
+        ]
+        headers.append(normalize_text(" ".join(parts)).strip())
+    return headers
+
+
+def map_columns(headers: List[str]) -> Dict[int, str]:
+    """
+    Map column positions to schema fields. Each field is mapped to at most
+    one column, the first one matching it.
+
+    Args:
+        headers (List[str]): Normalized column headers.
+
+    Returns:
+        Dict[int, str]: Field name of each mapped column position.
+    """
+    mapping = {}
+    for field in NORMALIZED_SCHEMA:
+        pattern = re.compile(field.pattern)
+        for position, header in enumerate(headers):
+            if position not in mapping and header and pattern.search(header):
+                mapping[position] = field.name
+                break
+    return mapping
+
+
+def parse_sirens(values) -> pd.Series:
+    """
+    Extract 9-digit SIRENs (or the SIREN part of SIRETs) from cells.
+
+    Args:
+        values: Cells.
+
+    Returns:
+        pd.Series: SIRENs, missing when no identifier is found.
+    """
+    digits = (
+        pd.Series(np.asarray(values, dtype=object), dtype=object)
+        .astype("string")
+        .str.replace(r"[\s.\-]", "", regex=True)
+        .str.extract(r"(?:^|\D)(\d{9})(?:\d{5})?(?:\D|$)", expand=False)
+    )
+    return digits.astype("string")
+
+
+def normalize_table(df: pd.DataFrame, table_idx: int = 0) -> pd.DataFrame:
+    """
+    Normalise an extracted table: header rows are dropped, columns mapped
+    to the schema and values converted to their schema type. Unmapped
+    columns are dropped, missing fields are null.
+
+    Args:
+        df (pd.DataFrame): Raw extracted table.
+        table_idx (int): Index of the table in the document.
+
+    Returns:
+        pd.DataFrame: Normalised table with the NORMALIZED_COLUMNS columns.
+    """
+    n_header_rows = header_row_count(df)
+    mapping = map_columns(column_headers(df, n_header_rows))
+    body = df.iloc[n_header_rows:]
+
+    columns = {"table": np.full(len(body), table_idx, dtype=np.int16)}
+    for field in NORMALIZED_SCHEMA:
+        position = next((pos for pos, name in mapping.items() if name == field.name), None)
+        if position is None:
+            cells = np.full(len(body), None, dtype=object)
+        else:
+            cells = body.iloc[:, position].to_numpy(dtype=object)
+        if field.name == "siren":
+            columns[field.name] = parse_sirens(cells).array
+        elif field.dtype == "string":
+            columns[field.name] = (
+                pd.Series(cells, dtype=object).astype("string").str.strip().replace("", pd.NA).array
+            )
+        else:
+            columns[field.name] = parse_french_numbers(cells).astype(field.dtype)
+    normalized = pd.DataFrame(columns)[NORMALIZED_COLUMNS]
+
+    # Drop empty rows, e.g. blank separator lines or totals without values
+    values = normalized.drop(columns="table")
+    return normalized[values.notna().any(axis=1).to_numpy()].reset_index(drop=True)
+
+
+def normalize_tables(tables: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Normalise all the extracted tables of a document.
+
+    Args:
+        tables (List[pd.DataFrame]): Raw extracted tables.
+
+    Returns:
+        pd.DataFrame: Normalised rows of all tables.
+    """
+    normalized = [normalize_table(df, table_idx) for table_idx, df in enumerate(tables)]
+    if not normalized:
+        return empty_normalized_frame()
+    return pd.concat(normalized, ignore_index=True).astype(NORMALIZED_DTYPES)
+
+
+def empty_normalized_frame(extra_columns: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """
+    Empty normalised table.
+
+    Args:
+        extra_columns (Optional[Dict[str, str]]): Additional columns and
+            their data types, placed first.
+
+    Returns:
+        pd.DataFrame: Empty table.
+    """
+    dtypes = dict(extra_columns or {}, **NORMALIZED_DTYPES)
+    return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in dtypes.items()})
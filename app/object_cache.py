@@ -0,0 +1,198 @@
+"""
+In-memory cache of S3 objects with background prefetching, so that the
+next extractions of the viewer are already downloaded when selected.
+"""
+from typing import Dict, Iterable, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import io
+import threading
+import time
+from s3fs import S3FileSystem
+from instrumentation import span
+
+
+class ObjectCache:
+    """
+    Read-through cache of S3 objects, bounded in bytes and evicting the
+    least recently used objects first.
+
+    Cached objects are served without any request for `max_age` seconds,
+    then revalidated against their ETag and downloaded again if they
+    changed. The cache implements the read methods of the file system it
+    wraps (`cat_file`, `open` in read mode and `exists`) and delegates the
+    other ones, so that it can be passed to reading functions in its place.
+    """
+
+    def __init__(
+        self,
+        fs: S3FileSystem,
+        max_bytes: int = 256 * 2**20,
+        max_age: float = 300.0,
+        max_workers: int = 4,
+    ):
+        """
+        Constructor.
+
+        Args:
+            fs (S3FileSystem): S3 file system.
+            max_bytes (int): Maximum total size of cached objects.
+            max_age (float): Duration in seconds during which a cached
+                object is served without checking its ETag.
+            max_workers (int): Number of prefetching threads.
+        """
+        self.fs = fs
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # Content, version and fetch time of each object, least recently
+        # used first
+        self._items: OrderedDict[str, Tuple[bytes, str, float]] = OrderedDict()
+        self._size = 0
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="prefetch"
+        )
+
+    def __getattr__(self, name: str):
+        if name == "fs":
+            raise AttributeError(name)
+        return getattr(self.fs, name)
+
+    def _version(self, s3_path: str) -> str:
+        # ETag of an object, or size and modification date on file systems
+        # without ETags
+        info = self.fs.info(s3_path)
+        if info.get("ETag"):
+            return str(info["ETag"])
+        return f"{info.get('size')}-{info.get('LastModified', info.get('created'))}"
+
+    def _store(self, s3_path: str, content: bytes, version: str):
+        with self._lock:
+            if s3_path in self._items:
+                self._size -= len(self._items.pop(s3_path)[0])
+            if len(content) > self.max_bytes:
+                return
+            self._items[s3_path] = (content, version, time.monotonic())
+            self._size += len(content)
+            while self._size > self.max_bytes:
+                _, (evicted, _, _) = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _fetch(self, s3_path: str) -> bytes:
+        # The version is read first: if the object changes in between, the
+        # next revalidation downloads it again
+        version = self._version(s3_path)
+        with span("s3_read_cached") as current:
+            content = self.fs.cat_file(s3_path)
+            current.n_bytes = len(content)
+        self._store(s3_path, content, version)
+        return content
+
+    def _get(self, s3_path: str) -> bytes:
+        with self._lock:
+            item = self._items.get(s3_path)
+            if item is not None:
+                self._items.move_to_end(s3_path)
+            pending = self._pending.get(s3_path)
+        if item is not None:
+            content, version, fetched_at = item
+            if time.monotonic() - fetched_at <= self.max_age:
+                return content
+            if self._version(s3_path) == version:
+                self._store(s3_path, content, version)
+                return content
+        elif pending is not None:
+            try:
+                return pending.result()
+            except Exception:
+                # Downloaded again, so that the error is raised in the
+                # calling thread
+                pass
+        return self._fetch(s3_path)
+
+    def cat_file(
+        self, path: str, start: Optional[int] = None, end: Optional[int] = None, **kwargs
+    ) -> bytes:
+        """
+        Get the content of an object, from the cache if up to date.
+
+        Args:
+            path (str): S3 path.
+            start (Optional[int]): Start of the byte range.
+            end (Optional[int]): End of the byte range.
+
+        Returns:
+            bytes: Content.
+        """
+        content = self._get(path)
+        if start is None and end is None:
+            return content
+        return content[start:end]
+
+    def open(self, path: str, mode: str = "rb", **kwargs):
+        """
+        Open an object. Objects opened for reading are read from the cache.
+
+        Args:
+            path (str): S3 path.
+            mode (str): Mode.
+
+        Returns:
+            File object.
+        """
+        if mode != "rb":
+            return self.fs.open(path, mode, **kwargs)
+        return io.BytesIO(self._get(path))
+
+    def exists(self, path: str, **kwargs) -> bool:
+        """
+        Check if an object exists, without request if it was cached less
+        than `max_age` seconds ago.
+
+        Args:
+            path (str): S3 path.
+
+        Returns:
+            bool: True if the object exists.
+        """
+        with self._lock:
+            item = self._items.get(path)
+        if item is not None and time.monotonic() - item[2] <= self.max_age:
+            return True
+        if self.fs.exists(path, **kwargs):
+            return True
+        # Deleted objects are no longer served
+        with self._lock:
+            if path in self._items:
+                self._size -= len(self._items.pop(path)[0])
+        return False
+
+    def _prefetch(self, s3_path: str) -> bytes:
+        try:
+            return self._fetch(s3_path)
+        finally:
+            with self._lock:
+                self._pending.pop(s3_path, None)
+
+    def prefetch(self, s3_paths: Iterable[str]):
+        """
+        Download objects in background threads, unless already cached or
+        being downloaded. Failures are ignored.
+
+        Args:
+            s3_paths (Iterable[str]): S3 paths.
+        """
+        with self._lock:
+            for s3_path in s3_paths:
+                if s3_path in self._items or s3_path in self._pending:
+                    continue
+                self._pending[s3_path] = self.executor.submit(self._prefetch, s3_path)
+
+    def clear(self):
+        """
+        Remove all cached objects.
+        """
+        with self._lock:
+            self._items.clear()
+            self._size = 0
@@ -0,0 +1,204 @@
+"""
+In-process selection of the pages containing the subsidiaries table
+("tableau des filiales et participations"), based on the text layer of
+the document.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import math
+import multiprocessing
+import os
+import re
+import unicodedata
+import fitz
+
+
+# Scored phrases with their weights, in normalized form (lowercase, no
+# accents)
+PAGE_SELECTION_KEYWORDS = {
+    "filiales et participations": 10.0,
+    "renseignements detailles": 4.0,
+    "filiales": 3.0,
+    "participations": 2.0,
+    "quote-part du capital": 4.0,
+    "quote part du capital": 4.0,
+    "capitaux propres": 1.5,
+    "valeur comptable des titres": 3.0,
+    "prets et avances": 2.0,
+    "cautions et avals": 2.0,
+    "dividendes encaisses": 2.0,
+    "chiffre d'affaires": 1.0,
+    "resultat": 0.5,
+}
+
+# Below this number of pages, texts are extracted in the calling process
+MIN_PAGES_PER_WORKER = 16
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercase a text and remove its accents and repeated whitespace.
+
+    Args:
+        text (str): Text.
+
+    Returns:
+        str: Normalized text.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"\s+", " ", text.replace("’", "'"))
+
+
+def _page_texts(pdf_bytes: bytes, start: int, stop: int) -> List[str]:
+    # Module-level function so that it can be sent to worker processes
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
+        return [normalize_text(document[idx].get_text()) for idx in range(start, stop)]
+
+
+def extract_page_texts(pdf_bytes: bytes, max_workers: Optional[int] = None) -> List[str]:
+    """
+    Extract the normalized text of each page of a document, in parallel
+    across processes for long documents.
+
+    Args:
+        pdf_bytes (bytes): PDF document.
+        max_workers (Optional[int]): Maximum number of processes, defaults
+            to the number of CPUs.
+
+    Returns:
+        List[str]: Text of each page.
+    """
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
+        n_pages = document.page_count
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    n_workers = min(max_workers, n_pages // MIN_PAGES_PER_WORKER)
+    if n_workers <= 1:
+        return _page_texts(pdf_bytes, 0, n_pages)
+
+    chunk_size = math.ceil(n_pages / n_workers)
+    bounds = [(start, min(start + chunk_size, n_pages)) for start in range(0, n_pages, chunk_size)]
+    # Worker processes are spawned rather than forked, since the calling
+    # process (e.g. the Streamlit server) runs other threads
+    with ProcessPoolExecutor(
+        max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        chunks = executor.map(
+            _page_texts,
+            [pdf_bytes] * len(bounds),
+            [start for start, _ in bounds],
+            [stop for _, stop in bounds],
+        )
+        return [text for chunk in chunks for text in chunk]
+
+
+class KeywordScorer:
+    """
+    TF-IDF score of weighted phrases: phrases frequent in a page and rare
+    in the rest of the document contribute the most.
+    """
+
+    def __init__(self, keywords: Optional[Dict[str, float]] = None):
+        """
+        Constructor.
+
+        Args:
+            keywords (Optional[Dict[str, float]]): Phrases and weights,
+                defaults to PAGE_SELECTION_KEYWORDS.
+        """
+        if keywords is None:
+            keywords = PAGE_SELECTION_KEYWORDS
+        self.keywords = {normalize_text(phrase): weight for phrase, weight in keywords.items()}
+
+    def __call__(self, texts: List[str]) -> List[float]:
+        """
+        Score pages.
+
+        Args:
+            texts (List[str]): Normalized text of each page.
+
+        Returns:
+            List[float]: Score of each page.
+        """
+        counts = [
+            {phrase: text.count(phrase) for phrase in self.keywords} for text in texts
+        ]
+        n_pages = len(texts)
+        scores = [0.0] * n_pages
+        for phrase, weight in self.keywords.items():
+            document_frequency = sum(1 for page_counts in counts if page_counts[phrase])
+            if not document_frequency:
+                continue
+            idf = math.log((1 + n_pages) / (1 + document_frequency)) + 1
+            for idx, page_counts in enumerate(counts):
+                if page_counts[phrase]:
+                    scores[idx] += weight * (1 + math.log(page_counts[phrase])) * idf
+        return scores
+
+
+def rank_pages(scores: List[float], top_k: int = 1) -> List[Tuple[int, float]]:
+    """
+    Best pages according to their scores.
+
+    Args:
+        scores (List[float]): Score of each page.
+        top_k (int): Number of pages.
+
+    Returns:
+        List[Tuple[int, float]]: Page numbers and scores, best first.
+    """
+    ranking = sorted(range(len(scores)), key=lambda idx: (-scores[idx], idx))
+    return [(idx, scores[idx]) for idx in ranking[:top_k]]
+
+
+def filter_candidates(
+    ranking: List[Tuple[int, float]], min_relative_score: float = 0.5
+) -> List[int]:
+    """
+    Keep the candidate pages scoring close enough to the best page.
+
+    Args:
+        ranking (List[Tuple[int, float]]): Page numbers and scores, best
+            first.
+        min_relative_score (float): Minimum score of a page, relative to
+            the best score.
+
+    Returns:
+        List[int]: Page numbers, in document order.
+    """
+    if not ranking:
+        return []
+    best_score = ranking[0][1]
+    return sorted(
+        page_number
+        for rank, (page_number, score) in enumerate(ranking)
+        if rank == 0 or (best_score > 0 and score >= min_relative_score * best_score)
+    )
+
+
+def score_pages(
+    pdf_bytes: bytes,
+    scorer: Optional[Callable[[List[str]], List[float]]] = None,
+    max_workers: Optional[int] = None,
+) -> List[float]:
+    """
+    Score each page of a document on its likelihood to contain the
+    subsidiaries table.
+
+    Args:
+        pdf_bytes (bytes): PDF document.
+        scorer (Optional[Callable[[List[str]], List[float]]]): Function
+            scoring pages from their normalized texts, e.g. a classifier,
+            defaults to a KeywordScorer.
+        max_workers (Optional[int]): Maximum number of processes used to
+            extract texts.
+
+    Returns:
+        List[float]: Score of each page, all 0 for documents without
+            text layer.
+    """
+    if scorer is None:
+        scorer = KeywordScorer()
+    texts = extract_page_texts(pdf_bytes, max_workers=max_workers)
+    return scorer(texts)
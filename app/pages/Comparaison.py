@@ -0,0 +1,112 @@
+"""
+Page comparing the extractions of both engines.
+"""
+
+import streamlit as st
+from comparison import (
+    COMPARED_ENGINES,
+    DIFFERENT,
+    MISSING_LEFT,
+    MISSING_RIGHT,
+    compare_all,
+    document_pairs,
+    failed_documents,
+    load_document_tables,
+    load_report,
+    pair_tables,
+    save_report,
+    summary_report,
+)
+from constants import AGREEMENT_THRESHOLD
+from extraction_index import get_extraction_index
+from pipeline import ENGINE_NAMES
+from router import read_decisions
+from utils import get_file_system
+
+
+# Background colour of each cell status
+STATUS_COLORS = {
+    DIFFERENT: "background-color: #f8b4b4",
+    MISSING_LEFT: "background-color: #fde68a",
+    MISSING_RIGHT: "background-color: #fde68a",
+}
+
+st.set_page_config(layout="wide", page_title="Comparaison des moteurs", page_icon="⚖️")
+
+st.markdown("# Comparaison des moteurs d'extraction")
+st.sidebar.header("Comparaison des moteurs")
+st.write(
+    f"""
+    Comparaison cellule par cellule des tableaux extraits d'un même document
+    par les moteurs {ENGINE_NAMES[COMPARED_ENGINES[0]]} et
+    {ENGINE_NAMES[COMPARED_ENGINES[1]]}. Les cellules différentes sont en
+    rouge, les cellules présentes dans un seul tableau en jaune.
+    """
+)
+
+fs = get_file_system()
+
+if st.sidebar.button("Comparer toutes les extractions"):
+    with st.spinner("Comparaison en cours..."):
+        save_report(fs, compare_all(fs))
+
+report = load_report(fs)
+if report is not None and not report.empty:
+    st.markdown("## Rapport")
+    st.write(
+        f"Les moteurs sont considérés en accord lorsqu'au moins {AGREEMENT_THRESHOLD:.0%} "
+        "des cellules concordent."
+    )
+    st.dataframe(summary_report(report), use_container_width=True)
+    failed = failed_documents(report)
+    if not failed.empty:
+        st.warning(f"{len(failed)} document(s) n'ont pas pu être comparés.")
+        with st.expander("Documents non comparés"):
+            st.dataframe(failed, hide_index=True, use_container_width=True)
+    with st.expander("Détail par document"):
+        st.dataframe(
+            report.sort_values("agreement"), hide_index=True, use_container_width=True
+        )
+
+decisions = read_decisions(fs)
+if not decisions.empty:
+    st.markdown("## Décisions de routage")
+    col1, col2 = st.columns(2)
+    col1.metric("Documents routés", len(decisions))
+    col2.metric("Part transmise à ExtractTable", f"{decisions['escalated'].mean():.1%}")
+    with st.expander("Détail des décisions"):
+        st.dataframe(decisions, hide_index=True, use_container_width=True)
+
+st.markdown("## Comparaison d'un document")
+pairs = document_pairs(get_extraction_index(fs))
+selected_pair = st.selectbox(
+    label="Documents",
+    options=pairs,
+    format_func=lambda pair: f"{pair[0]['siren']}_{pair[0]['year']}",
+)
+
+if selected_pair:
+    tables_left = load_document_tables(fs, selected_pair[0])
+    tables_right = load_document_tables(fs, selected_pair[1])
+    comparisons = pair_tables(tables_left, tables_right)
+    if not comparisons:
+        st.write("Aucun tableau à comparer.")
+    for i, j, comparison in comparisons:
+        st.markdown(f"### Tableaux {i} et {j}")
+        col1, col2 = st.columns(2)
+        col1.metric("Concordance des cellules", f"{comparison.agreement:.1%}")
+        col2.metric("Concordance des nombres", f"{comparison.numeric_agreement:.1%}")
+
+        left, right, status = comparison.to_frames()
+        styles = status.replace(STATUS_COLORS).where(status.isin(list(STATUS_COLORS)), "")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.write(ENGINE_NAMES[COMPARED_ENGINES[0]])
+            st.dataframe(
+                left.style.apply(lambda _: styles, axis=None), use_container_width=True
+            )
+        with col2:
+            st.write(ENGINE_NAMES[COMPARED_ENGINES[1]])
+            st.dataframe(
+                right.style.apply(lambda _: styles, axis=None), use_container_width=True
+            )
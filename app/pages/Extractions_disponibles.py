@@ -1,19 +1,21 @@
 import streamlit as st
-import numpy as np
-from constants import (
-    TABLE_TRANSFORMER_EXTRACTIONS_PATH,
-    PDF_SAMPLES_PATH,
-    EXTRACT_TABLE_CONFIDENCES_PATH,
-    EXTRACT_TABLE_EXTRACTIONS_PATH,
+from confidence import style_confidence
+from constants import LOW_CONFIDENCE_THRESHOLD, PDF_SAMPLES_PATH
+from utils import get_file_system, get_object_cache
+from extraction_index import (
+    filter_index,
+    index_table_references,
+    refresh_index,
+    get_extraction_index,
 )
-import pandas as pd
-from utils import (
-    list_files,
-    get_file_system,
-    read_excel_from_s3,
-    format_extraction_name,
+from storage import format_table_reference, load_table
+from streamlit_utils import (
+    disable_button,
+    display_pdf,
+    get_confidence_table,
+    normalized_table_content,
+    prefetch_tables,
 )
-from streamlit_utils import disable_button, display_pdf
 from pathlib import Path
 
 
@@ -28,37 +30,91 @@ st.write(
 )
 
 fs = get_file_system()
+# Tables, normalised versions and documents are read through an in-memory
+# cache, filled in the background with the following tables of the lists
+cached_fs = get_object_cache()
+
+# Filter extractions using the index
+if st.sidebar.button("Rafraîchir la liste des extractions"):
+    refresh_index(fs)
+    get_extraction_index.clear()
+extraction_index = get_extraction_index(fs)
+siren_filter = st.sidebar.text_input("Filtrer par Siren (séparés d'un espace)")
+year_filter = st.sidebar.multiselect(
+    "Filtrer par année", options=sorted(extraction_index["year"].unique().tolist())
+)
+# PDF display settings
+pdf_display_mode = st.sidebar.radio(
+    "Affichage du document",
+    options=["image", "embed"],
+    format_func={"image": "Image de la page", "embed": "PDF intégral"}.get,
+)
+pdf_dpi = st.sidebar.slider(
+    "Résolution de l'image (dpi)", min_value=72, max_value=200, value=120, step=8
+)
+extraction_index = filter_index(
+    extraction_index, sirens=siren_filter.split(), years=year_filter
+)
+storage_formats = {
+    (row.siren, row.year): row.storage_format for row in extraction_index.itertuples()
+}
+# Tables and normalised versions are read again when their extraction is
+# updated
+extraction_versions = {
+    (row.engine, row.siren, row.year): row.updated_at
+    for row in extraction_index.itertuples()
+}
+# Page images are rendered again when an extraction of the document is updated
+pdf_versions = extraction_index.groupby(["siren", "year"])["updated_at"].max().to_dict()
+
 table_transformer_tab, extract_table_tab = st.tabs(
     ["Table transformer", "Site ExtractTable"]
 )
 
 with table_transformer_tab:
-    file_paths = list_files(fs=fs, s3_path=TABLE_TRANSFORMER_EXTRACTIONS_PATH)
+    table_references = index_table_references(
+        extraction_index, engine="table_transformer"
+    )
     selected_transformed_table = st.selectbox(
         label="Documents",
-        options=file_paths,
-        format_func=format_extraction_name,
+        options=table_references,
+        format_func=format_table_reference,
         on_change=disable_button,
     )
     if selected_transformed_table:
-        # Load pandas DataFrames from xlsx files stored in S3
-        pdf_sample_path = (
-            str(Path(PDF_SAMPLES_PATH) / selected_transformed_table.split("/")[-2])
-            + ".pdf"
+        # Load pandas DataFrame stored in S3
+        pdf_sample_path = str(
+            Path(PDF_SAMPLES_PATH)
+            / f"{selected_transformed_table.siren}_{selected_transformed_table.year}.pdf"
+        )
+        extraction, _ = load_table(
+            cached_fs,
+            selected_transformed_table,
+            storage_formats.get(
+                (selected_transformed_table.siren, selected_transformed_table.year)
+            ),
+            with_confidence=False,
         )
-        with fs.open(selected_transformed_table, "rb") as f:
-            extraction = pd.read_csv(f)
 
         # Export button
         st.download_button(
             label="Exporter l'extraction en .csv",
             data=extraction.to_csv(sep=";").encode("utf_8_sig"),
-            file_name=Path(format_extraction_name(selected_transformed_table))
-            .with_suffix(".csv")
-            .name,
+            file_name=f"{format_table_reference(selected_transformed_table)}.csv",
             mime="text/csv",
             key="table_transformer_export_button",
         )
+        normalized_table_content(
+            cached_fs,
+            selected_transformed_table,
+            extraction_versions.get(
+                (
+                    "table_transformer",
+                    selected_transformed_table.siren,
+                    selected_transformed_table.year,
+                )
+            ),
+        )
 
         col1, col2 = st.columns(2)
         with col1:
@@ -68,56 +124,90 @@ with table_transformer_tab:
             )
         with col2:
             # Display PDF
-            display_pdf(fs=fs, s3_path=pdf_sample_path)
+            display_pdf(
+                fs=cached_fs,
+                s3_path=pdf_sample_path,
+                mode=pdf_display_mode,
+                dpi=pdf_dpi,
+                version=pdf_versions.get(
+                    (selected_transformed_table.siren, selected_transformed_table.year)
+                ),
+            )
+        prefetch_tables(
+            cached_fs, table_references, selected_transformed_table, storage_formats
+        )
 
 
 with extract_table_tab:
-    # List available table transformer extractions
-    extract_table_files = list_files(fs=fs, s3_path=EXTRACT_TABLE_EXTRACTIONS_PATH)
+    # List available ExtractTable extractions, optionally least reliable
+    # first
+    extract_table_index = filter_index(extraction_index, engine="extract_table")
+    if st.checkbox("Trier par confiance croissante"):
+        extract_table_index = extract_table_index.sort_values(
+            "mean_confidence", na_position="last"
+        )
+    extract_table_references = index_table_references(
+        extract_table_index, engine="extract_table"
+    )
+    # Tables are read again when their extraction is updated
+    versions = {
+        (row.siren, row.year): row.updated_at for row in extract_table_index.itertuples()
+    }
     selected_extracted_table = st.selectbox(
         label="Tableaux",
-        options=extract_table_files,
-        format_func=format_extraction_name,
+        options=extract_table_references,
+        format_func=format_table_reference,
         on_change=disable_button,
     )
 
     if selected_extracted_table:
-        # Load pandas DataFrames from xlsx files stored in S3
-        path_suffix = "/".join((selected_extracted_table.split("/"))[-2:])
-        confidence_path = str(Path(EXTRACT_TABLE_CONFIDENCES_PATH) / path_suffix)
-        pdf_sample_path = (
-            str(Path(PDF_SAMPLES_PATH) / selected_extracted_table.split("/")[-2])
-            + ".pdf"
+        # Load pandas DataFrames stored in S3
+        pdf_sample_path = str(
+            Path(PDF_SAMPLES_PATH)
+            / f"{selected_extracted_table.siren}_{selected_extracted_table.year}.pdf"
         )
 
-        extraction = read_excel_from_s3(fs, selected_extracted_table)
-        extraction.fillna("", inplace=True)
-        extraction = extraction.values.tolist()
-        extraction = pd.DataFrame(extraction)
-        if not fs.exists(confidence_path):
+        extraction, confidence, stats = get_confidence_table(
+            cached_fs,
+            selected_extracted_table,
+            versions.get((selected_extracted_table.siren, selected_extracted_table.year)),
+            storage_formats.get(
+                (selected_extracted_table.siren, selected_extracted_table.year)
+            ),
+        )
+        if confidence is None:
             styled_extraction = extraction
             st.write("No confidence available for this table.")
         else:
-            confidence = read_excel_from_s3(fs, confidence_path)
-            confidence = confidence.values.tolist()
-            confidence = pd.DataFrame(confidence).replace(0.0, np.nan)
-            styled_extraction = extraction.style.background_gradient(
-                axis=None, gmap=confidence, cmap="Reds"
-            )
-            st.write(
-                f"Valeurs de confiance = [{confidence.min(axis=None)} - {confidence.max(axis=None)}]"
-            )
+            col1, col2, col3 = st.columns(3)
+            if stats is None:
+                # No cell of the table has a usable confidence
+                col1.metric("Confiance moyenne", "-")
+                col2.metric("Confiance minimale", "-")
+                col3.metric(f"Cellules de confiance < {LOW_CONFIDENCE_THRESHOLD}", "-")
+            else:
+                col1.metric("Confiance moyenne", f"{stats['mean']:.3f}")
+                col2.metric("Confiance minimale", f"{stats['min']:.3f}")
+                col3.metric(
+                    f"Cellules de confiance < {LOW_CONFIDENCE_THRESHOLD}",
+                    f"{stats['n_low']} ({stats['low_ratio']:.1%})",
+                )
+            low_only = st.toggle("Cellules peu fiables uniquement")
+            styled_extraction = style_confidence(extraction, confidence, low_only=low_only)
 
         # Export button
         st.download_button(
             label="Exporter l'extraction en .csv",
             data=extraction.to_csv(sep=";").encode("utf_8_sig"),
-            file_name=Path(format_extraction_name(selected_transformed_table))
-            .with_suffix(".csv")
-            .name,
+            file_name=f"{format_table_reference(selected_extracted_table)}.csv",
             mime="text/csv",
             key="extract_table_export_button",
         )
+        normalized_table_content(
+            cached_fs,
+            selected_extracted_table,
+            versions.get((selected_extracted_table.siren, selected_extracted_table.year)),
+        )
 
         col1, col2 = st.columns(2)
         with col1:
@@ -130,4 +220,18 @@ with extract_table_tab:
             )
         with col2:
             # Display PDF
-            display_pdf(fs=fs, s3_path=pdf_sample_path)
+            display_pdf(
+                fs=cached_fs,
+                s3_path=pdf_sample_path,
+                mode=pdf_display_mode,
+                dpi=pdf_dpi,
+                version=pdf_versions.get(
+                    (selected_extracted_table.siren, selected_extracted_table.year)
+                ),
+            )
+        prefetch_tables(
+            cached_fs,
+            extract_table_references,
+            selected_extracted_table,
+            storage_formats,
+        )
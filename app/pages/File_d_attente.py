@@ -0,0 +1,81 @@
+"""
+Page for queued extractions, executed by worker processes.
+"""
+
+import streamlit as st
+import pandas as pd
+from utils import check_siren_length, get_job_queue
+from pipeline import AUTO_ENGINE, ENGINE_NAMES
+
+
+st.set_page_config(layout="wide", page_title="File d'attente", page_icon="⏳")
+
+st.markdown("# File d'attente des extractions")
+st.sidebar.header("File d'attente")
+st.write(
+    """
+    Les extractions mises en file d'attente sont exécutées en arrière-plan
+    par les workers (`python worker.py`), indépendamment de cette page, avec
+    le jeton ExtractTable saisi sur la page "Nouvelle extraction" ou, à
+    défaut, celui des workers.
+    """
+)
+
+job_queue = get_job_queue()
+
+with st.form("enqueue_form"):
+    year = st.text_input("Année", value="2021", max_chars=4)
+    company_ids = st.text_area("Numéros Siren (séparés d'un espace)").split()
+    engines = st.multiselect(
+        "Moteurs d'extraction",
+        options=list(ENGINE_NAMES) + [AUTO_ENGINE],
+        default=["table_transformer"],
+        format_func=dict(ENGINE_NAMES, **{AUTO_ENGINE: "Automatique"}).get,
+    )
+    submitted = st.form_submit_button("Mettre en file d'attente")
+
+if submitted:
+    invalid_ids = [
+        company_id for company_id in company_ids if not check_siren_length(company_id)
+    ]
+    if not year.isdigit():
+        st.error("Année non valide.")
+    elif invalid_ids:
+        st.error(f"Numéros Siren ne contenant pas 9 caractères: {', '.join(invalid_ids)}.")
+    elif not engines:
+        st.error("Sélectionnez au moins un moteur d'extraction.")
+    else:
+        # Jobs identical to a queued or running job are skipped
+        n_queued = sum(
+            job_queue.enqueue(
+                company_id, int(year), engines, token=st.session_state.get("auth_token")
+            )[1]
+            for company_id in company_ids
+        )
+        n_skipped = len(company_ids) - n_queued
+        st.success(
+            f"{n_queued} extractions mises en file d'attente."
+            + (f" {n_skipped} extractions déjà en cours ignorées." if n_skipped else "")
+        )
+
+
+@st.fragment(run_every=5)
+def job_status():
+    """
+    Display job status, refreshed periodically.
+    """
+    counts = job_queue.count_by_status()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("En attente", counts["queued"])
+    col2.metric("En cours", counts["running"])
+    col3.metric("Terminées", counts["done"])
+    col4.metric("Échecs", counts["failed"])
+
+    jobs = pd.DataFrame(
+        job_queue.list_jobs(),
+        columns=["id", "siren", "year", "engines", "status", "stage", "error", "attempts", "updated_at"],
+    )
+    st.dataframe(jobs, hide_index=True, use_container_width=True)
+
+
+job_status()
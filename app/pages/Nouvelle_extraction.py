@@ -2,27 +2,21 @@
 Page for new extractions.
 """
 
+from typing import Dict
 import streamlit as st
-import os
+import pandas as pd
 from utils import (
     check_siren_length,
     check_availability,
     download_pdf,
-    get_file_system,
-    read_pdf_from_s3,
-    upload_pdf_to_s3,
+    fetch_availability,
+    get_job_queue,
     get_querier,
 )
-from extraction import extract_tables, extract_tables_transformer
-from streamlit_utils import sidebar_content
-import requests
-from constants import (
-    PDF_SAMPLES_PATH,
-    TABLE_TRANSFORMER_EXTRACTIONS_PATH,
-    EXTRACT_TABLE_EXTRACTIONS_PATH,
-    EXTRACT_TABLE_CONFIDENCES_PATH,
-)
-import fitz
+from extraction_index import get_extraction_index
+from pipeline import AUTO_ENGINE
+from streamlit_utils import sidebar_content, http_stats_content
+from concurrency import run_concurrently, get_rate_limiter
 
 
 st.set_page_config(layout="wide", page_title="Nouvelle extraction", page_icon="📊")
@@ -30,16 +24,102 @@ st.set_page_config(layout="wide", page_title="Nouvelle extraction", page_icon="
 st.markdown("# Nouvelle extraction")
 st.sidebar.header("Nouvelle extraction")
 sidebar_content()
+http_stats_content()
 st.write(
     """
-    Page de lancement d'une nouvelle extraction.
+    Page de lancement d'une nouvelle extraction. Les extractions sont
+    exécutées en arrière-plan par les workers de la file d'attente
+    (`python worker.py`), avec le jeton ExtractTable saisi dans la barre
+    latérale ou, à défaut, celui de la variable `EXTRACT_TABLE_TOKEN` des
+    workers.
     """
 )
 
 # Initialize cached resources
-fs = get_file_system()
 # Document querier - requires user name and password
 document_querier = get_querier()
+job_queue = get_job_queue()
+
+# Engine of each extraction tab
+EXTRACTION_TAB_ENGINES = ["table_transformer", "extract_table", AUTO_ENGINE]
+
+
+def extraction_result(job: Dict, engine: str):
+    """
+    Display the result of a finished extraction job.
+
+    Args:
+        job (Dict): Job.
+        engine (str): Extraction engine of the tab.
+    """
+    if job["status"] == "failed":
+        st.error(f"Échec de l'extraction: {job['error']}")
+        return
+    result = job["result"]
+    if engine == AUTO_ENGINE:
+        decision = result["routing"]
+        if decision["escalated"]:
+            st.write(
+                "Qualité insuffisante de l'extraction Table transformer "
+                f"({', '.join(decision['reasons'])}): extraction "
+                "effectuée avec ExtractTable."
+            )
+        else:
+            st.write(
+                "Extraction effectuée avec Table transformer: "
+                "accédez-y grâce à l'onglet 'Extractions disponibles'."
+            )
+        return
+    n_tables = result["n_tables"][engine]
+    if n_tables is None:
+        st.write(
+            "L'extraction existe déjà: "
+            "accédez-y grâce à l'onglet 'Extractions disponibles'."
+        )
+    else:
+        st.write(
+            f"Extraction de {n_tables} tableaux effectuée: "
+            f"accédez-y grâce à l'onglet 'Extractions disponibles'."
+        )
+
+
+def page_selection_result(job: Dict):
+    """
+    Display the pages selected by a finished page selection job.
+
+    Args:
+        job (Dict): Job.
+    """
+    # Documents persisted without their page numbers have none
+    page_numbers = job["result"].get("page_numbers")
+    if page_numbers is None:
+        return
+    pages = ", ".join(str(page_number + 1) for page_number in page_numbers)
+    st.write(
+        f"Un tableau filiales et participations a été repéré à la page {pages}."
+        if len(page_numbers) == 1
+        else f"Un tableau filiales et participations a été repéré aux pages {pages}."
+    )
+
+
+@st.fragment(run_every=2)
+def job_status(job_id: int, label: str):
+    """
+    Display the status of a queued or running job, refreshed until the job
+    ends.
+
+    Args:
+        job_id (int): Job ID.
+        label (str): Name of the task, such as "Extraction".
+    """
+    job = job_queue.get(job_id)
+    if job["status"] in ("done", "failed"):
+        get_extraction_index.clear()
+        st.rerun()
+    elif job["status"] == "queued":
+        st.write(f"{label} en attente d'un worker...")
+    else:
+        st.write(f"{label} en cours ({job['stage'] or 'démarrage'})...")
 
 # Allow users to input year
 year = st.text_area(
@@ -54,6 +134,27 @@ company_ids = st.text_area("Entrez les numéros Siren (séparés d'un espace):")
 # Split the user input into a list of document IDs
 company_ids = company_ids.split()
 
+# Batch mode: availability checks run concurrently, documents are only
+# downloaded when requested
+batch_mode = st.checkbox("Traitement par lot (requêtes parallèles)", value=False)
+if batch_mode:
+    with st.expander("Paramètres du traitement par lot"):
+        max_workers = st.number_input(
+            "Nombre de requêtes simultanées", min_value=1, max_value=32, value=8
+        )
+        rate_limit = st.number_input(
+            "Nombre maximal de requêtes par seconde vers l'API INPI",
+            min_value=0.5,
+            max_value=50.0,
+            value=5.0,
+        )
+        retries = st.number_input(
+            "Nombre de nouvelles tentatives en cas d'échec",
+            min_value=0,
+            max_value=10,
+            value=2,
+        )
+
 # Add a button to check availability for all specified documents
 dispo_button = st.button("Vérifier la disponibilité")
 if not st.session_state.get("button"):
@@ -65,6 +166,65 @@ if st.session_state["button"]:
     except ValueError:
         st.error("Année non valide.")
 
+    if isinstance(year, int) and batch_mode:
+        valid_company_ids = [
+            company_id for company_id in company_ids if check_siren_length(company_id)
+        ]
+        batch_key = (year, tuple(valid_company_ids))
+        if st.session_state.get("batch_key") != batch_key:
+            batch_results = {}
+            batch_summary = []
+            progress_bar = st.progress(0.0)
+            summary_placeholder = st.empty()
+            inpi_rate_limiter = get_rate_limiter("inpi", rate=rate_limit)
+            batch_outputs = run_concurrently(
+                lambda company_id: fetch_availability(
+                    document_querier, company_id, year, rate_limiter=inpi_rate_limiter
+                ),
+                valid_company_ids,
+                max_workers=int(max_workers),
+                retries=int(retries),
+            )
+            for n_done, (company_id, result, error) in enumerate(batch_outputs, 1):
+                if error is not None:
+                    status = "échec"
+                elif result[0]:
+                    status = "disponible"
+                else:
+                    status = "indisponible"
+                batch_results[company_id] = result
+                batch_summary.append(
+                    {
+                        "Siren": company_id,
+                        "Statut": status,
+                        "Erreur": "" if error is None else str(error),
+                    }
+                )
+                # Stream results as they complete
+                progress_bar.progress(
+                    n_done / len(valid_company_ids),
+                    text=f"{n_done}/{len(valid_company_ids)} documents traités",
+                )
+                summary_placeholder.dataframe(
+                    pd.DataFrame(batch_summary), use_container_width=True
+                )
+            progress_bar.empty()
+            summary_placeholder.empty()
+            st.session_state["batch_key"] = batch_key
+            st.session_state["batch_results"] = batch_results
+            st.session_state["batch_summary"] = batch_summary
+
+        # Summary of the batch
+        batch_summary = pd.DataFrame(
+            st.session_state["batch_summary"], columns=["Siren", "Statut", "Erreur"]
+        )
+        status_counts = batch_summary["Statut"].value_counts()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Disponibles", int(status_counts.get("disponible", 0)))
+        col2.metric("Indisponibles", int(status_counts.get("indisponible", 0)))
+        col3.metric("Échecs", int(status_counts.get("échec", 0)))
+        st.dataframe(batch_summary, use_container_width=True)
+
     if isinstance(year, int):
         for company_id in company_ids:
             if not check_siren_length(company_id):
@@ -72,178 +232,80 @@ if st.session_state["button"]:
                     f"Le numéro Siren {company_id} ne contient " f"pas 9 caractères."
                 )
             else:
-                availability, document_id = check_availability(
-                    document_querier, company_id, year
-                )
+                if batch_mode:
+                    batch_result = st.session_state["batch_results"].get(company_id)
+                    if batch_result is None:
+                        st.error(
+                            f"Échec de la récupération du document pour le "
+                            f"Siren {company_id}."
+                        )
+                        continue
+                    availability, document_id = batch_result
+                else:
+                    availability, document_id = check_availability(
+                        document_querier, company_id, year
+                    )
 
                 if availability:
                     file_name = f"CA_{company_id}_{year}.pdf"
                     # Display the availability status for each document
                     st.write(f"Document disponible pour le " f"Siren {company_id}.")
 
-                    PDFbyte = download_pdf(document_querier, document_id)
+                    # Downloaded when requested, not kept in the session
                     st.download_button(
                         label="Comptes annuels",
-                        data=PDFbyte,
+                        data=lambda document_id=document_id: download_pdf(
+                            document_querier, document_id
+                        ),
                         file_name=file_name,
                         mime="application/octet-stream",
+                        on_click="ignore",
+                        key=f"pdf_btn_{company_id}_{year}",
                     )
 
-                    selection_button = st.button(
+                    # Page selection and extractions are executed by the
+                    # workers of the job queue, the page polls their status
+                    selection_key = f"page_selection_job_{company_id}_{year}"
+                    if st.button(
                         "Identification de la page d'intérêt",
                         key=f"page_selection_btn_{company_id}_{year}",
-                    )
-                    if not st.session_state.get(
-                        f"selection_button_{company_id}_{year}"
                     ):
-                        st.session_state[f"selection_button_{company_id}_{year}"] = (
-                            selection_button
+                        st.session_state[selection_key], _ = job_queue.enqueue(
+                            company_id, year, []
                         )
-                    if st.session_state[f"selection_button_{company_id}_{year}"]:
-                        try:
-                            s3_path = os.path.join(
-                                PDF_SAMPLES_PATH, f"{company_id}_{year}.pdf"
-                            )
-                            # Check if selected page file is already persisted
-                            if fs.exists(s3_path):
-                                document = read_pdf_from_s3(fs, s3_path)
-                            # Else run page selection and persist the selected page
-                            else:
-                                document = fitz.open(stream=PDFbyte, filetype="pdf")
-                                # TODO: There can be multiple pages sometimes
-                                # TODO: implement this possibility
-                                page_selection_url = (
-                                    "https://extraction-cs.lab.sspcloud.fr/select_page"
-                                )
-                                files = {"pdf_file": document.tobytes()}
-                                response = requests.post(
-                                    url=page_selection_url, files=files
-                                )
-                                # TODO: handle errors using result field
-                                page_number = response.json()["page_number"]
-                                st.write(
-                                    f"Un tableau filiales et participations a été "
-                                    f"repéré à la page {page_number + 1}."
-                                )
-                                document.select([page_number])
-                                # Save to persistent storage
-                                upload_pdf_to_s3(
-                                    document=document, fs=fs, s3_path=s3_path
-                                )
-
-                            table_transformer_tab, extract_table_tab = st.tabs(
-                                ["Table transformer", "Site ExtractTable"]
-                            )
+                    if selection_key not in st.session_state:
+                        continue
+                    selection_job = job_queue.get(st.session_state[selection_key])
+                    if selection_job["status"] == "failed":
+                        st.error(
+                            f"Échec de l'identification de la page: {selection_job['error']}"
+                        )
+                        continue
+                    if selection_job["status"] != "done":
+                        job_status(selection_job["id"], "Identification de la page")
+                        continue
+                    page_selection_result(selection_job)
 
-                            # Extraction
-                            with table_transformer_tab:
-                                extraction_button = st.button(
-                                    "Extraction des tableaux",
-                                    key=f"extraction_btn_{company_id}_{year}",
-                                )
-                                text_placeholder = st.empty()
-                                if not st.session_state.get(
-                                    f"extraction_btn_{company_id}_{year}_state"
-                                ):
-                                    st.session_state[
-                                        f"extraction_btn_{company_id}_{year}_state"
-                                    ] = extraction_button
-                                if st.session_state[
-                                    f"extraction_btn_{company_id}_{year}_state"
-                                ]:
-                                    extraction_s3_path = os.path.join(
-                                        TABLE_TRANSFORMER_EXTRACTIONS_PATH,
-                                        f"{company_id}_{year}",
-                                    )
-                                    if fs.exists(extraction_s3_path):
-                                        text_placeholder.write(
-                                            "L'extraction existe déjà: "
-                                            "accédez-y grâce à l'onglet 'Extractions disponibles'."
-                                        )
-                                    else:
-                                        text_placeholder.write("Extraction en cours...")
-                                        # Table extraction
-                                        table_transformer_output = (
-                                            extract_tables_transformer(document)
-                                        )
-                                        for table_idx, df in enumerate(
-                                            table_transformer_output
-                                        ):
-                                            # Save to persistent storage
-                                            with fs.open(
-                                                os.path.join(
-                                                    extraction_s3_path,
-                                                    f"table_{table_idx}.csv",
-                                                ),
-                                                "wb",
-                                            ) as f:
-                                                df.to_csv(f)
-                                        text_placeholder.write(
-                                            f"Extraction de {len(table_transformer_output)} effectuée: "
-                                            f"accédez-y grâce à l'onglet 'Extractions disponibles'."
-                                        )
-
-                            with extract_table_tab:
-                                # ExtractTable extraction
-                                extract_table_button = st.button(
-                                    "Extraction des tableaux",
-                                    key=f"extract_table_btn_{company_id}_{year}",
+                    tabs = st.tabs(["Table transformer", "Site ExtractTable", "Automatique"])
+                    for tab, engine in zip(tabs, EXTRACTION_TAB_ENGINES):
+                        with tab:
+                            job_key = f"extraction_job_{engine}_{company_id}_{year}"
+                            if st.button(
+                                "Extraction des tableaux",
+                                key=f"{engine}_btn_{company_id}_{year}",
+                            ):
+                                st.session_state[job_key], _ = job_queue.enqueue(
+                                    company_id,
+                                    year,
+                                    [engine],
+                                    token=st.session_state.auth_token,
                                 )
-                                text_placeholder = st.empty()
-                                if not st.session_state.get(
-                                    f"extract_table_btn_{company_id}_{year}_state"
-                                ):
-                                    st.session_state[
-                                        f"extract_table_btn_{company_id}_{year}_state"
-                                    ] = extract_table_button
-                                if st.session_state[
-                                    f"extract_table_btn_{company_id}_{year}_state"
-                                ]:
-                                    extract_table_s3_path = os.path.join(
-                                        EXTRACT_TABLE_EXTRACTIONS_PATH,
-                                        f"{company_id}_{year}",
-                                    )
-                                    extract_table_confidence_s3_path = os.path.join(
-                                        EXTRACT_TABLE_CONFIDENCES_PATH,
-                                        f"{company_id}_{year}",
-                                    )
-                                    if fs.exists(extract_table_s3_path):
-                                        text_placeholder.write(
-                                            "L'extraction existe déjà: "
-                                            "accédez-y grâce à l'onglet 'Extractions disponibles'."
-                                        )
-                                    else:
-                                        text_placeholder.write("Extraction en cours...")
-                                        outputs = extract_tables(document)
-                                        for table_idx, (df, df_conf) in enumerate(
-                                            outputs
-                                        ):
-                                            # Save as excel file
-                                            with fs.open(
-                                                os.path.join(
-                                                    extract_table_s3_path,
-                                                    f"table_{table_idx}.xlsx",
-                                                ),
-                                                "wb",
-                                            ) as f:
-                                                df.to_excel(f)
-                                            # Save confidences
-                                            if df_conf is not None:
-                                                with fs.open(
-                                                    os.path.join(
-                                                        extract_table_confidence_s3_path,
-                                                        f"table_{table_idx}.xlsx",
-                                                    ),
-                                                    "wb",
-                                                ) as f:
-                                                    df_conf.to_excel(f)
-                                        text_placeholder.write(
-                                            f"Extraction de {len(outputs)} tableaux effectuée: "
-                                            f"accédez-y grâce à l'onglet 'Extractions disponibles'."
-                                        )
-                        except ValueError as e:
-                            # Print error message.
-                            st.write(str(e))
+                            if job_key in st.session_state:
+                                job = job_queue.get(st.session_state[job_key])
+                                if job["status"] in ("done", "failed"):
+                                    extraction_result(job, engine)
+                                else:
+                                    job_status(job["id"], "Extraction")
 
                 else: 
                     st.write(f"Aucun document disponible pour le Siren {company_id}.")
@@ -0,0 +1,140 @@
+"""
+Page for queries across all stored extractions.
+"""
+
+import streamlit as st
+from botocore.exceptions import BotoCoreError, ClientError
+from export import EXPORT_FORMATS, export_extractions, export_path, select_entries
+from extraction_index import get_extraction_index
+from pipeline import ENGINE_NAMES
+from query import consolidate, export_frame, query_normalized, query_raw
+from utils import check_siren_length, get_file_system
+
+
+# Maximum number of displayed rows, all rows are exported
+MAX_DISPLAYED_ROWS = 10_000
+
+st.set_page_config(layout="wide", page_title="Requêtes", page_icon="🔎")
+
+st.markdown("# Requêtes sur les extractions")
+st.sidebar.header("Requêtes")
+st.write(
+    """
+    Interrogation de l'ensemble des extractions disponibles, par Siren,
+    année et moteur d'extraction, avec export en .csv ou .parquet.
+    """
+)
+
+fs = get_file_system()
+extraction_index = get_extraction_index(fs)
+
+if st.sidebar.button("Consolider les extractions"):
+    with st.spinner("Consolidation en cours..."):
+        n_documents = sum(consolidate(fs, engine) for engine in ENGINE_NAMES)
+    st.sidebar.write(f"{n_documents} documents consolidés.")
+
+with st.form("query_form"):
+    engines = st.multiselect(
+        "Moteurs d'extraction",
+        options=list(ENGINE_NAMES),
+        default=list(ENGINE_NAMES),
+        format_func=ENGINE_NAMES.get,
+    )
+    sirens = st.text_area("Numéros Siren (séparés d'un espace, tous si vide)").split()
+    sirens_file = st.file_uploader("Ou fichier de numéros Siren (un par ligne)", type=["txt", "csv"])
+    years = st.multiselect(
+        "Années (toutes si vide)",
+        options=sorted(extraction_index["year"].unique().tolist()),
+    )
+    level = st.radio(
+        "Données",
+        options=["normalized", "raw"],
+        format_func={"normalized": "Tableaux normalisés", "raw": "Cellules brutes"}.get,
+        horizontal=True,
+    )
+    submitted = st.form_submit_button("Lancer la requête")
+
+if submitted:
+    if sirens_file is not None:
+        sirens += sirens_file.getvalue().decode("utf-8").split()
+    invalid_sirens = [siren for siren in sirens if not check_siren_length(siren)]
+    if invalid_sirens:
+        st.error(f"Numéros Siren ne contenant pas 9 caractères: {', '.join(invalid_sirens[:20])}.")
+    elif not engines:
+        st.error("Sélectionnez au moins un moteur d'extraction.")
+    else:
+        st.session_state["query_filters"] = dict(
+            engines=engines, sirens=sirens or None, years=years or None, level=level
+        )
+        query_function = query_normalized if level == "normalized" else query_raw
+        with st.spinner("Requête en cours..."):
+            (
+                st.session_state["query_results"],
+                st.session_state["query_failures"],
+            ) = query_function(fs, engines=engines, sirens=sirens or None, years=years or None)
+
+results = st.session_state.get("query_results")
+if results is not None:
+    failures = st.session_state["query_failures"]
+    if failures:
+        st.warning(
+            f"{len(failures)} extractions n'ont pas pu être lues et sont absentes "
+            "des résultats."
+        )
+        with st.expander("Extractions non lues"):
+            st.dataframe(failures, hide_index=True, use_container_width=True)
+    col1, col2 = st.columns(2)
+    col1.metric("Lignes", len(results))
+    col2.metric(
+        "Documents",
+        results[["engine", "siren_declarant", "year"]].drop_duplicates().shape[0],
+    )
+    if len(results) > MAX_DISPLAYED_ROWS:
+        st.write(f"Affichage des {MAX_DISPLAYED_ROWS} premières lignes.")
+    st.dataframe(results.head(MAX_DISPLAYED_ROWS), hide_index=True, use_container_width=True)
+
+    # Files are only serialized when a download is requested
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="Exporter en .csv",
+            data=lambda: export_frame(results, "csv"),
+            file_name="extractions.csv",
+            mime="text/csv",
+            on_click="ignore",
+        )
+    with col2:
+        st.download_button(
+            label="Exporter en .parquet",
+            data=lambda: export_frame(results, "parquet"),
+            file_name="extractions.parquet",
+            mime="application/octet-stream",
+            on_click="ignore",
+        )
+
+filters = st.session_state.get("query_filters")
+if filters is not None:
+    st.markdown("## Export groupé")
+    st.write(
+        """
+        Export de l'ensemble des extractions de la requête dans un seul
+        fichier, écrit au fil de l'eau sur S3: une archive .zip des tableaux
+        bruts, ou un fichier .csv ou .parquet unique.
+        """
+    )
+    file_format = st.radio("Format", options=EXPORT_FORMATS, horizontal=True)
+    if st.button("Lancer l'export groupé"):
+        entries = select_entries(fs, filters["engines"], filters["sirens"], filters["years"])
+        path = export_path(file_format)
+        with st.spinner(f"Export de {len(entries)} extractions en cours..."):
+            errors = export_extractions(fs, entries, file_format, path, level=filters["level"])
+        if errors:
+            st.warning(
+                f"{len(errors)} extraction(s) n'ont pas pu être exportées, "
+                "voir le fichier errors.txt de l'export."
+            )
+        try:
+            st.markdown(f"[Télécharger l'export]({fs.url(path, expires=3600)})")
+        except (AttributeError, NotImplementedError, BotoCoreError, ClientError):
+            # File system without presigned links, or missing credentials
+            st.write(f"Export disponible sur S3: {path}")
@@ -0,0 +1,52 @@
+"""
+Page showing the latency of each pipeline stage.
+"""
+
+import streamlit as st
+from instrumentation import RECORDER
+
+
+st.set_page_config(layout="wide", page_title="Supervision", page_icon="⏱️")
+
+st.markdown("# Supervision")
+st.sidebar.header("Supervision")
+st.write(
+    """
+    Durée des étapes du pipeline (téléchargement INPI, accès S3, sélection
+    de page, extraction, interrogation d'ExtractTable...) exécutées par
+    l'application depuis son démarrage. Les workers et le script
+    d'extraction en masse journalisent leurs étapes au format JSON.
+    """
+)
+
+if st.sidebar.button("Réinitialiser les mesures"):
+    RECORDER.clear()
+
+stats = RECORDER.stage_stats()
+if stats.empty:
+    st.write("Aucune mesure disponible.")
+else:
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Étapes mesurées", int(stats["count"].sum()))
+    col2.metric("Échecs", int(stats["errors"].sum()))
+    col3.metric("Volume transféré (Mo)", f"{stats['total_bytes'].sum() / 2**20:.1f}")
+
+    st.markdown("## Latence par étape (secondes)")
+    st.bar_chart(stats.set_index("stage")[["p50", "p95"]], stack=False)
+    st.dataframe(
+        stats.style.format({"p50": "{:.3f}", "p95": "{:.3f}", "max": "{:.3f}"}),
+        hide_index=True,
+        use_container_width=True,
+    )
+
+    spans = RECORDER.to_frame()
+    errors = spans[spans["outcome"] == "error"]
+    if not errors.empty:
+        st.markdown("## Derniers échecs")
+        st.dataframe(errors.iloc[::-1].head(100), hide_index=True, use_container_width=True)
+
+    with st.expander("Dernières étapes"):
+        siren_filter = st.text_input("Filtrer par Siren")
+        if siren_filter:
+            spans = spans[spans["siren"] == siren_filter]
+        st.dataframe(spans.iloc[::-1].head(1000), hide_index=True, use_container_width=True)
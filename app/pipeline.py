@@ -0,0 +1,376 @@
+"""
+Extraction pipeline of a document: retrieval, page selection, table
+extraction and storage.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+import os
+import time
+import fitz
+from s3fs import S3FileSystem
+from ca_query.querier import DocumentQuerier
+from concurrency import RateLimiter, retry_with_backoff
+from constants import (
+    MAX_SELECTED_PAGES,
+    MIN_RELATIVE_PAGE_SCORE,
+    PDF_SAMPLES_PATH,
+    ROUTING_POLICY,
+)
+from extraction import extract_pages, select_pages
+from extraction_index import record_extraction
+from instrumentation import traced
+from normalization import normalize_tables
+from page_selection import filter_candidates
+from router import document_quality, get_policy, needs_escalation, read_decision, save_decision
+from storage import TableReference, load_table, read_manifest, save_extraction
+from table_merging import merge_continuation_tables
+from utils import exists_on_s3, fetch_document, read_pdf_from_s3, upload_pdf_to_s3
+
+
+# Prefix of the metadata keywords of a sample listing its pages
+SAMPLE_PAGES_PREFIX = "pages:"
+
+ENGINE_NAMES = {
+    "table_transformer": "Table transformer",
+    "extract_table": "Site ExtractTable",
+}
+# Automatic choice of the engine of each document
+AUTO_ENGINE = "auto"
+
+
+def page_sample_path(company_id: str, year: int) -> str:
+    """
+    S3 path of the selected page of a document.
+
+    Args:
+        company_id (str): Company identifier.
+        year (int): Year.
+
+    Returns:
+        str: S3 path.
+    """
+    return os.path.join(PDF_SAMPLES_PATH, f"{company_id}_{year}.pdf")
+
+
+def sample_page_numbers(document: fitz.Document) -> Optional[List[int]]:
+    """
+    Page numbers in the full document of the pages of a sample, stored in
+    the sample metadata.
+
+    Args:
+        document (fitz.Document): Sample.
+
+    Returns:
+        Optional[List[int]]: Page numbers, None for samples persisted
+            without them.
+    """
+    keywords = (document.metadata or {}).get("keywords", "")
+    if not keywords.startswith(SAMPLE_PAGES_PREFIX):
+        return None
+    return [int(page_number) for page_number in keywords[len(SAMPLE_PAGES_PREFIX):].split(",")]
+
+
+@traced("select_page_sample")
+def select_page_sample(
+    fs: S3FileSystem, company_id: str, year: int, pdf_bytes: bytes
+) -> Tuple[fitz.Document, List[int]]:
+    """
+    Run page selection on a document and persist the selected pages.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        company_id (str): Company identifier.
+        year (int): Year.
+        pdf_bytes (bytes): Full document.
+
+    Returns:
+        Tuple[fitz.Document, List[int]]: Selected pages and their page
+            numbers in the full document.
+    """
+    document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    # The subsidiaries table can span several pages
+    page_numbers = filter_candidates(
+        select_pages(document, top_k=MAX_SELECTED_PAGES), MIN_RELATIVE_PAGE_SCORE
+    )
+    document.select(page_numbers)
+    document.set_metadata(
+        dict(
+            document.metadata or {},
+            keywords=SAMPLE_PAGES_PREFIX + ",".join(map(str, page_numbers)),
+        )
+    )
+    # Save to persistent storage
+    upload_pdf_to_s3(document=document, fs=fs, s3_path=page_sample_path(company_id, year))
+    return document, page_numbers
+
+
+def extract_document(
+    engine: str, document: fitz.Document, token: Optional[str] = None
+) -> List[Tuple]:
+    """
+    Extract tables of a document with an engine.
+
+    Args:
+        engine (str): "table_transformer" or "extract_table".
+        document (fitz.Document): Selected pages.
+        token (Optional[str]): ExtractTable token, defaults to the token
+            of the Streamlit session.
+
+    Returns:
+        List[Tuple]: Tables, confidences and pages of each table.
+    """
+    # Pages are extracted separately, then tables continued from one page
+    # to the next are merged
+    page_outputs = extract_pages(engine, document, token)
+    page_numbers = sample_page_numbers(document) or list(range(document.page_count))
+    return merge_continuation_tables(list(zip(page_numbers, page_outputs)))
+
+
+@traced("storage")
+def store_extraction(
+    fs: S3FileSystem, engine: str, company_id: str, year: int, merged: List[Tuple]
+) -> int:
+    """
+    Store and index the tables extracted from a document.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        engine (str): "table_transformer" or "extract_table".
+        company_id (str): Company identifier.
+        year (int): Year.
+        merged (List[Tuple]): Output of `extract_document`.
+
+    Returns:
+        int: Number of tables.
+    """
+    tables = [df for df, _, _ in merged]
+    confidences = [df_conf for _, df_conf, _ in merged] if engine == "extract_table" else None
+    pages = [table_pages for _, _, table_pages in merged]
+
+    manifest = save_extraction(
+        fs,
+        engine,
+        company_id,
+        year,
+        tables,
+        confidences,
+        pages=pages,
+        normalized=normalize_tables(tables),
+    )
+    record_extraction(
+        fs,
+        company_id,
+        year,
+        engine=engine,
+        n_tables=manifest["n_tables"],
+        has_confidence=manifest["has_confidence"],
+        storage_format=manifest["storage_format"],
+        confidence=manifest["confidence"],
+    )
+    return len(tables)
+
+
+@traced("page_sample")
+def get_page_sample(
+    fs: S3FileSystem, company_id: str, year: int, pdf_bytes: bytes
+) -> Tuple[fitz.Document, Optional[List[int]]]:
+    """
+    Get the pages of a document containing the subsidiaries table, running
+    page selection and persisting the selected pages if not already done.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        company_id (str): Company identifier.
+        year (int): Year.
+        pdf_bytes (bytes): Full document.
+
+    Returns:
+        Tuple[fitz.Document, Optional[List[int]]]: Selected pages and their
+            page numbers in the full document, None for samples persisted
+            without them.
+    """
+    s3_path = page_sample_path(company_id, year)
+    # Check if the selected pages are already persisted
+    if exists_on_s3(fs, s3_path):
+        document = read_pdf_from_s3(fs, s3_path)
+        return document, sample_page_numbers(document)
+    # Else run page selection and persist the selected pages
+    return select_page_sample(fs, company_id, year, pdf_bytes)
+
+
+@traced("run_extraction")
+def run_extraction(
+    fs: S3FileSystem,
+    engine: str,
+    company_id: str,
+    year: int,
+    document: fitz.Document,
+    token: Optional[str] = None,
+) -> Optional[int]:
+    """
+    Extract tables of a document with an engine, then store and index
+    them, unless the extraction already exists, as recorded by its
+    manifest.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        engine (str): "table_transformer" or "extract_table".
+        company_id (str): Company identifier.
+        year (int): Year.
+        document (fitz.Document): Selected pages.
+        token (Optional[str]): ExtractTable token, defaults to the token
+            of the Streamlit session.
+
+    Returns:
+        Optional[int]: Number of extracted tables, None if the extraction
+            already exists.
+    """
+    if read_manifest(fs, engine, company_id, year) is not None:
+        return None
+    merged = extract_document(engine, document, token)
+    return store_extraction(fs, engine, company_id, year, merged)
+
+
+def _stored_tables(fs: S3FileSystem, manifest: Dict) -> List:
+    # Tables of an existing extraction, found through its manifest
+    return [
+        load_table(
+            fs,
+            TableReference(manifest["engine"], manifest["siren"], manifest["year"], table_idx),
+            storage_format=manifest["storage_format"],
+            with_confidence=False,
+        )[0]
+        for table_idx in range(manifest["n_tables"])
+    ]
+
+
+@traced("run_routed_extraction")
+def run_routed_extraction(
+    fs: S3FileSystem,
+    company_id: str,
+    year: int,
+    document: fitz.Document,
+    token: Optional[str] = None,
+    policy: str = ROUTING_POLICY,
+) -> Dict:
+    """
+    Extract tables of a document with Table Transformer, and escalate to
+    ExtractTable only if their quality is below the policy thresholds. The
+    decision is recorded, and returned as is if the document was already
+    routed with the same policy.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        company_id (str): Company identifier.
+        year (int): Year.
+        document (fitz.Document): Selected pages.
+        token (Optional[str]): ExtractTable token, defaults to the token
+            of the Streamlit session.
+        policy (str): Routing policy.
+
+    Returns:
+        Dict: Routing decision.
+    """
+    routing_policy = get_policy(policy)
+    decision = read_decision(fs, company_id, year)
+    if decision is not None and decision["policy"] == policy:
+        return decision
+    decision = {"siren": company_id, "year": int(year), "policy": policy, "n_tables": {}}
+
+    start = time.perf_counter()
+    manifest = read_manifest(fs, "table_transformer", company_id, year)
+    if manifest is not None:
+        tables = _stored_tables(fs, manifest)
+    else:
+        merged = extract_document("table_transformer", document, token)
+        store_extraction(fs, "table_transformer", company_id, year, merged)
+        tables = [df for df, _, _ in merged]
+    decision["n_tables"]["table_transformer"] = len(tables)
+    decision["latency"] = {"table_transformer": time.perf_counter() - start}
+
+    quality = document_quality(tables)
+    escalate, reasons = needs_escalation(quality, routing_policy)
+    decision.update(quality=quality, escalated=escalate, reasons=reasons)
+    if escalate:
+        start = time.perf_counter()
+        manifest = read_manifest(fs, "extract_table", company_id, year)
+        if manifest is not None:
+            n_tables = manifest["n_tables"]
+        else:
+            merged = extract_document("extract_table", document, token)
+            n_tables = store_extraction(fs, "extract_table", company_id, year, merged)
+        decision["n_tables"]["extract_table"] = n_tables
+        decision["latency"]["extract_table"] = time.perf_counter() - start
+    decision["engine"] = "extract_table" if escalate else "table_transformer"
+    save_decision(fs, decision)
+    return decision
+
+
+@traced("pipeline")
+def process_document(
+    fs: S3FileSystem,
+    document_querier: DocumentQuerier,
+    company_id: str,
+    year: int,
+    engines: List[str],
+    token: Optional[str] = None,
+    progress_callback: Optional[Callable[[str], None]] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    download_retries: int = 0,
+) -> Dict:
+    """
+    Run the whole pipeline for a company and a year.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        document_querier (DocumentQuerier): Document querier.
+        company_id (str): Company identifier.
+        year (int): Year.
+        engines (List[str]): Extraction engines, "auto" to choose the
+            engine with the routing policy.
+        token (Optional[str]): ExtractTable token.
+        progress_callback (Optional[Callable[[str], None]]): Function
+            called with the name of each stage.
+        rate_limiter (Optional[RateLimiter]): Rate limiter acquired before
+            each call to the INPI API.
+        download_retries (int): Maximum number of retries of the download,
+            the only stage which is always safe to repeat: extraction
+            stages are not retried, so that a failure after an ExtractTable
+            job never submits a new paid job.
+
+    Returns:
+        Dict: Summary of the pipeline run.
+    """
+    def progress(stage: str):
+        if progress_callback is not None:
+            progress_callback(stage)
+
+    s3_path = page_sample_path(company_id, year)
+    if exists_on_s3(fs, s3_path):
+        # The full document is only downloaded if no page was selected yet
+        progress("page_selection")
+        document = read_pdf_from_s3(fs, s3_path)
+        page_numbers = sample_page_numbers(document)
+    else:
+        progress("download")
+        availability, document_id, pdf_bytes = retry_with_backoff(
+            lambda: fetch_document(
+                document_querier, company_id, year, rate_limiter=rate_limiter
+            ),
+            retries=download_retries,
+        )
+        if not availability:
+            return {"available": False}
+        progress("page_selection")
+        document, page_numbers = select_page_sample(fs, company_id, year, pdf_bytes)
+
+    summary = {"available": True, "page_numbers": page_numbers, "n_tables": {}}
+    for engine in engines:
+        progress(f"extraction_{engine}")
+        if engine == AUTO_ENGINE:
+            summary["routing"] = run_routed_extraction(fs, company_id, year, document, token)
+            summary["n_tables"].update(summary["routing"]["n_tables"])
+        else:
+            summary["n_tables"][engine] = run_extraction(
+                fs, engine, company_id, year, document, token
+            )
+    return summary
@@ -0,0 +1,168 @@
+"""
+Pre-filtering of documents before they are sent to remote extraction
+engines: pages without tables are dropped and the table region of the
+remaining pages is cropped.
+"""
+from typing import List, Optional, Tuple
+from dataclasses import dataclass
+import re
+import fitz
+
+
+NUMERIC_TOKEN = re.compile(r"^[(\-+]?\d[\d\s.,]*%?\)?$")
+
+
+@dataclass
+class PageFeatures:
+    """
+    Layout features of a page.
+    """
+
+    n_words: int
+    numeric_ratio: float
+    n_rules: int
+    # Region of numeric lines and ruling lines, None if there is none
+    table_rect: Optional[fitz.Rect]
+
+
+def _is_rule(rect: fitz.Rect, max_thickness: float = 2.0) -> bool:
+    # Horizontal or vertical line, or thin filled rectangle
+    return (rect.height <= max_thickness < rect.width) or (
+        rect.width <= max_thickness < rect.height
+    )
+
+
+def page_features(page: fitz.Page, min_line_numeric_ratio: float = 0.5) -> PageFeatures:
+    """
+    Compute the layout features of a page.
+
+    Args:
+        page (fitz.Page): Page.
+        min_line_numeric_ratio (float): Minimum proportion of numeric
+            tokens for a text line to belong to the table region.
+
+    Returns:
+        PageFeatures: Features.
+    """
+    words = page.get_text("words")
+    lines = {}
+    for x0, y0, x1, y1, text, block_no, line_no, _ in words:
+        line = lines.setdefault((block_no, line_no), [fitz.Rect(x0, y0, x1, y1), 0, 0])
+        line[0] |= fitz.Rect(x0, y0, x1, y1)
+        line[1] += 1
+        line[2] += bool(NUMERIC_TOKEN.match(text))
+    n_numeric = sum(n for _, _, n in lines.values())
+
+    table_rect = fitz.Rect()
+    for rect, n_line_words, n_line_numeric in lines.values():
+        if n_line_numeric / n_line_words >= min_line_numeric_ratio:
+            table_rect |= rect
+    n_rules = 0
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == "l":
+                rect = fitz.Rect(item[1], item[2]).normalize()
+            elif item[0] == "re":
+                rect = fitz.Rect(item[1])
+            else:
+                continue
+            if _is_rule(rect):
+                n_rules += 1
+                table_rect |= rect
+
+    return PageFeatures(
+        n_words=len(words),
+        numeric_ratio=n_numeric / len(words) if words else 0.0,
+        n_rules=n_rules,
+        table_rect=None if table_rect.is_empty else table_rect,
+    )
+
+
+def is_table_page(
+    features: PageFeatures, min_numeric_ratio: float = 0.15, min_rules: int = 4
+) -> bool:
+    """
+    Whether a page is likely to contain a table: it either has enough
+    numeric tokens or enough ruling lines. Pages without a text layer
+    (scans) are kept.
+
+    Args:
+        features (PageFeatures): Page features.
+        min_numeric_ratio (float): Minimum proportion of numeric tokens.
+        min_rules (int): Minimum number of ruling lines.
+
+    Returns:
+        bool: Whether the page is kept.
+    """
+    if features.n_words == 0:
+        return True
+    return features.numeric_ratio >= min_numeric_ratio or features.n_rules >= min_rules
+
+
+def crop_rect(page: fitz.Page, features: PageFeatures, header_margin: float = 80.0) -> fitz.Rect:
+    """
+    Region of a page sent for extraction: full width, from slightly above
+    the table region, so that column headers are kept, to its bottom.
+
+    Args:
+        page (fitz.Page): Page.
+        features (PageFeatures): Page features.
+        header_margin (float): Height kept above the table region, in
+            points.
+
+    Returns:
+        fitz.Rect: Region, the whole page if no table region was found.
+    """
+    if features.table_rect is None:
+        return page.rect
+    rect = fitz.Rect(
+        page.rect.x0,
+        features.table_rect.y0 - header_margin,
+        page.rect.x1,
+        features.table_rect.y1 + 10,
+    )
+    return rect & page.rect
+
+
+def prefilter_document(
+    document: fitz.Document, mode: str = "pdf", crop: bool = True, dpi: int = 150
+) -> Tuple[fitz.Document, List[int]]:
+    """
+    Drop the pages of a document without tables and crop the others.
+
+    Args:
+        document (fitz.Document): Document.
+        mode (str): "pdf" to keep cropped vector pages, or "image" to send
+            cropped pages rendered as JPEG images, which are smaller for
+            pages with heavy content.
+        crop (bool): Whether to crop pages to their table region.
+        dpi (int): Resolution of rendered pages in "image" mode.
+
+    Returns:
+        Tuple[fitz.Document, List[int]]: Filtered document and page
+            numbers of its pages in the input document.
+    """
+    if mode not in ("pdf", "image"):
+        raise ValueError(f"Unknown pre-filter mode {mode}.")
+    features = [page_features(page) for page in document]
+    page_numbers = [idx for idx, page_feature in enumerate(features) if is_table_page(page_feature)]
+    # Never return an empty document: the engines decide
+    if not page_numbers:
+        page_numbers = list(range(document.page_count))
+
+    filtered = fitz.open()
+    for idx in page_numbers:
+        page = document[idx]
+        # Rotated pages are not cropped
+        clip = crop_rect(page, features[idx]) if crop and not page.rotation else page.rect
+        if mode == "pdf":
+            filtered.insert_pdf(document, from_page=idx, to_page=idx)
+            if clip != page.rect:
+                # The crop box is expressed relative to the media box
+                offset = filtered[-1].cropbox.tl
+                filtered[-1].set_cropbox(clip + (offset.x, offset.y, offset.x, offset.y))
+        else:
+            pixmap = page.get_pixmap(dpi=dpi, clip=clip)
+            new_page = filtered.new_page(width=clip.width, height=clip.height)
+            new_page.insert_image(new_page.rect, stream=pixmap.tobytes("jpeg"))
+    return filtered, page_numbers
@@ -0,0 +1,330 @@
+"""
+Queries across all stored extractions.
+
+Normalised tables of all documents are consolidated into one Parquet
+dataset per engine, read with filters pushed down to Parquet. Extractions
+not consolidated yet are read in parallel from their own files.
+"""
+from typing import Dict, List, Optional, Tuple
+import io
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from s3fs import S3FileSystem
+from concurrency import run_concurrently
+from constants import CONSOLIDATED_PATH, ENGINES
+from extraction_index import filter_index, index_to_frame, read_index
+from normalization import NORMALIZED_DTYPES, empty_normalized_frame, normalize_tables
+from storage import (
+    PARQUET_SCHEMA,
+    TableReference,
+    load_normalized,
+    load_table,
+    normalized_path,
+    parquet_path,
+    tables_to_arrow,
+)
+
+
+# Columns identifying the document of a normalised row
+DOCUMENT_COLUMNS = {"engine": "string", "siren_declarant": "string", "year": "int16"}
+
+
+def consolidated_path(engine: str) -> str:
+    """
+    Path of the consolidated dataset of an engine.
+
+    Args:
+        engine (str): Extraction engine.
+
+    Returns:
+        str: S3 path.
+    """
+    return f"{CONSOLIDATED_PATH}/{engine}.parquet"
+
+
+def read_document_normalized(fs: S3FileSystem, entry: Dict) -> pd.DataFrame:
+    """
+    Read the normalised tables of a document, normalising the raw tables of
+    extractions saved without them.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        entry (Dict): Index entry of the extraction.
+
+    Returns:
+        pd.DataFrame: Normalised rows, with the document columns.
+    """
+    engine, siren, year = entry["engine"], entry["siren"], int(entry["year"])
+    if fs.exists(normalized_path(engine, siren, year)):
+        df = load_normalized(fs, engine, siren, year)
+    else:
+        tables = [
+            load_table(fs, TableReference(engine, siren, year, table_idx), with_confidence=False)[0]
+            for table_idx in range(entry["n_tables"])
+        ]
+        df = normalize_tables(tables)
+    df.insert(0, "engine", engine)
+    df.insert(1, "siren_declarant", siren)
+    df.insert(2, "year", year)
+    return df.astype(DOCUMENT_COLUMNS)
+
+
+def _document_key(entry: Dict) -> str:
+    return f"{entry['siren']}_{entry['year']}"
+
+
+def _failure(entry: Dict, error: BaseException) -> Dict:
+    # Document which could not be read, with the reason
+    return {
+        "engine": entry["engine"],
+        "siren": entry["siren"],
+        "year": int(entry["year"]),
+        "error": f"{type(error).__name__}: {error}",
+    }
+
+
+def _read_documents(
+    fs: S3FileSystem, entries: List[Dict], max_workers: int
+) -> Tuple[pd.DataFrame, List[Dict], List[Dict]]:
+    # Normalised rows of documents read in parallel, the entries which
+    # could be read and the documents which could not
+    frames = []
+    read_entries = []
+    failures = []
+    for entry, df, error in run_concurrently(
+        lambda entry: read_document_normalized(fs, entry), entries, max_workers=max_workers
+    ):
+        if error is None:
+            frames.append(df)
+            read_entries.append(entry)
+        else:
+            failures.append(_failure(entry, error))
+    if not frames:
+        return empty_normalized_frame(DOCUMENT_COLUMNS), read_entries, failures
+    return pd.concat(frames, ignore_index=True), read_entries, failures
+
+
+def _split_stale(
+    consolidated: pd.DataFrame, documents: Dict[str, str], entries: List[Dict]
+) -> Tuple[pd.DataFrame, List[Dict]]:
+    # Consolidated rows still up to date, and entries missing from the
+    # consolidated dataset or updated since
+    stale = [
+        entry for entry in entries if documents.get(_document_key(entry)) != entry.get("updated_at")
+    ]
+    stale_keys = {_document_key(entry) for entry in stale}
+    document_keys = (
+        consolidated["siren_declarant"].astype(str) + "_" + consolidated["year"].astype(str)
+    )
+    return consolidated[~document_keys.isin(stale_keys)], stale
+
+
+def read_consolidated(
+    fs: S3FileSystem,
+    engine: str,
+    sirens: Optional[List[str]] = None,
+    years: Optional[List[int]] = None,
+) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """
+    Read the consolidated dataset of an engine.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        engine (str): Extraction engine.
+        sirens (Optional[List[str]]): Filter on the declaring firms.
+        years (Optional[List[int]]): Filter on years.
+
+    Returns:
+        Tuple[pd.DataFrame, Dict[str, str]]: Rows, and update time of each
+            consolidated document, keyed by "siren_year".
+    """
+    filters = []
+    if sirens:
+        filters.append(("siren_declarant", "in", list(sirens)))
+    if years:
+        filters.append(("year", "in", [int(year) for year in years]))
+    try:
+        with fs.open(consolidated_path(engine), "rb") as f:
+            parquet_file = pq.ParquetFile(f)
+            documents = json.loads(parquet_file.schema_arrow.metadata[b"documents"])
+            f.seek(0)
+            df = pq.read_table(f, filters=filters or None).to_pandas()
+    except FileNotFoundError:
+        return empty_normalized_frame(DOCUMENT_COLUMNS), {}
+    return df.astype(DOCUMENT_COLUMNS | NORMALIZED_DTYPES), documents
+
+
+def consolidate(fs: S3FileSystem, engine: str, full: bool = False, max_workers: int = 16) -> int:
+    """
+    Add the extractions not consolidated yet, or updated since, to the
+    consolidated dataset of an engine.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        engine (str): Extraction engine.
+        full (bool): Whether to rebuild the dataset from scratch.
+        max_workers (int): Maximum number of documents read concurrently.
+
+    Returns:
+        int: Number of consolidated documents.
+    """
+    entries = [entry for entry in read_index(fs) if entry["engine"] == engine]
+    if full:
+        consolidated, documents = empty_normalized_frame(DOCUMENT_COLUMNS), {}
+    else:
+        consolidated, documents = read_consolidated(fs, engine)
+    consolidated, stale = _split_stale(consolidated, documents, entries)
+    if not stale and not full:
+        return 0
+
+    new_rows, read_entries, _ = _read_documents(fs, stale, max_workers)
+    consolidated = pd.concat([consolidated, new_rows], ignore_index=True).astype(
+        DOCUMENT_COLUMNS | NORMALIZED_DTYPES
+    )
+    # Documents which could not be read are retried on the next run
+    documents.update({_document_key(entry): entry.get("updated_at") for entry in read_entries})
+
+    # Sorted by declaring firm so that row group statistics allow skipping
+    # row groups when filtering
+    consolidated = consolidated.sort_values(["siren_declarant", "year"], kind="stable")
+    table = pa.Table.from_pandas(consolidated, preserve_index=False)
+    table = table.replace_schema_metadata(
+        dict(table.schema.metadata or {}, documents=json.dumps(documents))
+    )
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, row_group_size=50_000)
+    with fs.open(consolidated_path(engine), "wb") as f:
+        f.write(buffer.getvalue())
+    return len(read_entries)
+
+
+def query_normalized(
+    fs: S3FileSystem,
+    engines: Optional[List[str]] = None,
+    sirens: Optional[List[str]] = None,
+    years: Optional[List[int]] = None,
+    max_workers: int = 16,
+) -> Tuple[pd.DataFrame, List[Dict]]:
+    """
+    Normalised subsidiaries rows of the matching extractions.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        engines (Optional[List[str]]): Extraction engines, all if not
+            specified.
+        sirens (Optional[List[str]]): Declaring firms, all if not
+            specified.
+        years (Optional[List[int]]): Years, all if not specified.
+        max_workers (int): Maximum number of documents read concurrently.
+
+    Returns:
+        Tuple[pd.DataFrame, List[Dict]]: Rows, and the documents which
+            could not be read with the reason.
+    """
+    index = index_to_frame(read_index(fs))
+    frames = []
+    failures = []
+    for engine in engines or list(ENGINES):
+        consolidated, documents = read_consolidated(fs, engine, sirens, years)
+        entries = filter_index(index, engine, sirens, years).to_dict("records")
+        consolidated, stale = _split_stale(consolidated, documents, entries)
+        new_rows, _, engine_failures = _read_documents(fs, stale, max_workers)
+        frames += [consolidated, new_rows]
+        failures += engine_failures
+    df = pd.concat(frames, ignore_index=True).astype(DOCUMENT_COLUMNS | NORMALIZED_DTYPES)
+    return df, failures
+
+
+def read_document_raw(fs: S3FileSystem, entry: Dict) -> pd.DataFrame:
+    """
+    Read the raw tables of a document in long format.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        entry (Dict): Index entry of the extraction.
+
+    Returns:
+        pd.DataFrame: One row per cell.
+    """
+    engine, siren, year = entry["engine"], entry["siren"], int(entry["year"])
+    if entry.get("storage_format") == "parquet":
+        with fs.open(parquet_path(engine, siren, year), "rb") as f:
+            df = pq.read_table(f, columns=PARQUET_SCHEMA.names).to_pandas()
+    else:
+        outputs = [
+            load_table(fs, TableReference(engine, siren, year, table_idx))
+            for table_idx in range(entry["n_tables"])
+        ]
+        arrow_tables, _ = tables_to_arrow(
+            [df for df, _ in outputs], [df_conf for _, df_conf in outputs]
+        )
+        df = pa.concat_tables([PARQUET_SCHEMA.empty_table()] + arrow_tables).to_pandas()
+    df.insert(0, "engine", engine)
+    df.insert(1, "siren_declarant", siren)
+    df.insert(2, "year", year)
+    return df
+
+
+def query_raw(
+    fs: S3FileSystem,
+    engines: Optional[List[str]] = None,
+    sirens: Optional[List[str]] = None,
+    years: Optional[List[int]] = None,
+    max_workers: int = 16,
+) -> Tuple[pd.DataFrame, List[Dict]]:
+    """
+    Raw cells of the matching extractions, read in parallel.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        engines (Optional[List[str]]): Extraction engines, all if not
+            specified.
+        sirens (Optional[List[str]]): Declaring firms, all if not
+            specified.
+        years (Optional[List[int]]): Years, all if not specified.
+        max_workers (int): Maximum number of documents read concurrently.
+
+    Returns:
+        Tuple[pd.DataFrame, List[Dict]]: One row per cell, and the
+            documents which could not be read with the reason.
+    """
+    index = index_to_frame(read_index(fs))
+    entries = [
+        entry
+        for engine in engines or list(ENGINES)
+        for entry in filter_index(index, engine, sirens, years).to_dict("records")
+    ]
+    frames = []
+    failures = []
+    for entry, df, error in run_concurrently(
+        lambda entry: read_document_raw(fs, entry), entries, max_workers=max_workers
+    ):
+        if error is None:
+            frames.append(df)
+        else:
+            failures.append(_failure(entry, error))
+    if not frames:
+        return pd.DataFrame(columns=list(DOCUMENT_COLUMNS) + PARQUET_SCHEMA.names), failures
+    return pd.concat(frames, ignore_index=True), failures
+
+
+def export_frame(df: pd.DataFrame, file_format: str) -> bytes:
+    """
+    Serialize query results.
+
+    Args:
+        df (pd.DataFrame): Query results.
+        file_format (str): "csv" or "parquet".
+
+    Returns:
+        bytes: File content.
+    """
+    if file_format == "csv":
+        return df.to_csv(sep=";", index=False).encode("utf_8_sig")
+    elif file_format == "parquet":
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    raise ValueError(f"Unknown export format {file_format}.")
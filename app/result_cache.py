@@ -0,0 +1,226 @@
+"""
+Content-addressed cache of page selection and table extraction results.
+"""
+from typing import Any, Callable, Dict, List, Optional
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import pandas as pd
+from s3fs import S3FileSystem
+
+
+def dataframe_to_dict(df: Optional[pd.DataFrame]) -> Optional[Dict]:
+    """
+    Convert a DataFrame to a JSON serializable dictionary.
+
+    Args:
+        df (Optional[pd.DataFrame]): DataFrame.
+
+    Returns:
+        Optional[Dict]: Dictionary.
+    """
+    if df is None:
+        return None
+    return {
+        "columns": df.columns.tolist(),
+        "index": df.index.tolist(),
+        "data": df.astype(object).where(df.notna(), None).values.tolist(),
+    }
+
+
+def dataframe_from_dict(data: Optional[Dict]) -> Optional[pd.DataFrame]:
+    """
+    Convert a dictionary produced by `dataframe_to_dict` to a DataFrame.
+
+    Args:
+        data (Optional[Dict]): Dictionary.
+
+    Returns:
+        Optional[pd.DataFrame]: DataFrame.
+    """
+    if data is None:
+        return None
+    return pd.DataFrame(data["data"], index=data["index"], columns=data["columns"])
+
+
+class ResultCache:
+    """
+    Two-tier cache keyed by content hash and engine name/version: an
+    in-process LRU tier and a persistent tier on S3.
+    """
+
+    def __init__(
+        self,
+        fs: Optional[S3FileSystem] = None,
+        s3_path: Optional[str] = None,
+        max_items: int = 256,
+    ):
+        """
+        Constructor.
+
+        Args:
+            fs (Optional[S3FileSystem]): S3 file system, no persistent tier
+                if not specified.
+            s3_path (Optional[str]): Directory of the persistent tier.
+            max_items (int): Maximum number of items of the in-process tier.
+        """
+        self.fs = fs
+        self.s3_path = s3_path
+        self.max_items = max_items
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(content: bytes, engine: str, version: str) -> str:
+        """
+        Cache key of a content for a given engine.
+
+        Args:
+            content (bytes): Content.
+            engine (str): Engine name.
+            version (str): Engine version.
+
+        Returns:
+            str: Key.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        return f"{engine}/{version}/{digest}"
+
+    def _s3_object_path(self, key: str) -> str:
+        return f"{self.s3_path}/{key}.json"
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a cached JSON serializable value.
+
+        Args:
+            key (str): Key.
+
+        Returns:
+            Optional[Any]: Value, None if not cached.
+        """
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        if self.fs is None or self.s3_path is None:
+            return None
+        try:
+            with self.fs.open(self._s3_object_path(key), "rb") as f:
+                value = json.load(f)
+        except FileNotFoundError:
+            return None
+        self._put_memory(key, value)
+        return value
+
+    def _put_memory(self, key: str, value: Any):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def put(self, key: str, value: Any):
+        """
+        Cache a JSON serializable value.
+
+        Args:
+            key (str): Key.
+            value (Any): Value.
+        """
+        self._put_memory(key, value)
+        if self.fs is None or self.s3_path is None:
+            return
+        with self.fs.open(self._s3_object_path(key), "wb") as f:
+            f.write(json.dumps(value).encode("utf-8"))
+
+    def get_or_compute(
+        self,
+        content: bytes,
+        engine: str,
+        version: str,
+        compute: Callable[[], Any],
+        serialize: Callable[[Any], Any] = lambda value: value,
+        deserialize: Callable[[Any], Any] = lambda value: value,
+    ) -> Any:
+        """
+        Get a cached result, computing and caching it on a miss.
+
+        Args:
+            content (bytes): Content.
+            engine (str): Engine name.
+            version (str): Engine version.
+            compute (Callable): Function computing the result.
+            serialize (Callable): Function converting the result to a JSON
+                serializable value.
+            deserialize (Callable): Inverse of serialize.
+
+        Returns:
+            Any: Result.
+        """
+        key = self.key(content, engine, version)
+        value = self.get(key)
+        if value is not None:
+            return deserialize(value)
+        result = compute()
+        self.put(key, serialize(result))
+        return result
+
+
+def serialize_tables(tables: List[pd.DataFrame]) -> List[Dict]:
+    """
+    Serialize Table Transformer extraction results.
+
+    Args:
+        tables (List[pd.DataFrame]): Extracted tables.
+
+    Returns:
+        List[Dict]: Serialized tables.
+    """
+    return [dataframe_to_dict(df) for df in tables]
+
+
+def deserialize_tables(data: List[Dict]) -> List[pd.DataFrame]:
+    """
+    Deserialize Table Transformer extraction results.
+
+    Args:
+        data (List[Dict]): Serialized tables.
+
+    Returns:
+        List[pd.DataFrame]: Extracted tables.
+    """
+    return [dataframe_from_dict(table) for table in data]
+
+
+def serialize_tables_with_confidences(outputs: List) -> List[Dict]:
+    """
+    Serialize ExtractTable extraction results.
+
+    Args:
+        outputs (List): Extracted tables and confidences.
+
+    Returns:
+        List[Dict]: Serialized tables and confidences.
+    """
+    return [
+        {"table": dataframe_to_dict(df), "confidence": dataframe_to_dict(df_conf)}
+        for df, df_conf in outputs
+    ]
+
+
+def deserialize_tables_with_confidences(data: List[Dict]) -> List:
+    """
+    Deserialize ExtractTable extraction results.
+
+    Args:
+        data (List[Dict]): Serialized tables and confidences.
+
+    Returns:
+        List: Extracted tables and confidences.
+    """
+    return [
+        (dataframe_from_dict(output["table"]), dataframe_from_dict(output["confidence"]))
+        for output in data
+    ]
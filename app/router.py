@@ -0,0 +1,202 @@
+"""
+Routing of documents between extraction engines: the free Table
+Transformer engine is run first, and documents are only escalated to the
+paid ExtractTable engine when the quality of its tables is too low.
+"""
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from datetime import datetime, timezone
+import json
+import numpy as np
+import pandas as pd
+from s3fs import S3FileSystem
+from constants import ROUTING_DECISIONS_PATH
+from extract_table_parser import parse_french_numbers
+from normalization import header_row_count
+
+
+class RoutingPolicy(NamedTuple):
+    """
+    Quality thresholds below which a document is escalated to the paid
+    engine.
+    """
+
+    # Maximum proportion of empty cells
+    max_empty_ratio: float
+    # Minimum mean type homogeneity of columns
+    min_column_consistency: float
+    # Minimum proportion of numbers among the value cells
+    min_numeric_rate: float
+    # Whether to escalate documents where no table was found
+    escalate_without_tables: bool
+
+
+ROUTING_POLICIES = {
+    "economy": RoutingPolicy(0.6, 0.7, 0.3, False),
+    "balanced": RoutingPolicy(0.4, 0.8, 0.5, True),
+    "quality": RoutingPolicy(0.25, 0.9, 0.7, True),
+}
+
+
+def table_quality(df: pd.DataFrame) -> Dict[str, float]:
+    """
+    Quality metrics of an extracted table.
+
+    Args:
+        df (pd.DataFrame): Extracted table.
+
+    Returns:
+        Dict[str, float]: Number of cells, proportion of empty cells, mean
+            type homogeneity of columns (1 when each column holds only
+            numbers or only text) and proportion of numbers among the
+            non-empty value cells (below header rows, first column
+            excluded).
+    """
+    cells = df.to_numpy(dtype=object)
+    text = pd.Series(cells.ravel(), dtype=object).astype("string").str.strip()
+    non_empty = text.fillna("").ne("").to_numpy().reshape(cells.shape)
+    numbers = ~np.isnan(parse_french_numbers(cells)) & non_empty
+
+    body = slice(header_row_count(df), None)
+    n_body = non_empty[body].sum(axis=0)
+    numeric_share = np.divide(
+        numbers[body].sum(axis=0), n_body, out=np.zeros(len(n_body)), where=n_body > 0
+    )
+    consistency = np.maximum(numeric_share, 1 - numeric_share)[n_body > 0]
+    n_values = non_empty[body, 1:].sum()
+    return {
+        "n_cells": int(cells.size),
+        "empty_ratio": float(1 - non_empty.mean()) if cells.size else 1.0,
+        "column_consistency": float(consistency.mean()) if consistency.size else 0.0,
+        "numeric_rate": float(numbers[body, 1:].sum() / n_values) if n_values else 0.0,
+    }
+
+
+def document_quality(tables: List[pd.DataFrame]) -> Optional[Dict[str, float]]:
+    """
+    Quality metrics of the tables of a document, weighted by their number
+    of cells.
+
+    Args:
+        tables (List[pd.DataFrame]): Extracted tables.
+
+    Returns:
+        Optional[Dict[str, float]]: Metrics, None if there is no table.
+    """
+    qualities = [table_quality(df) for df in tables if df.size]
+    if not qualities:
+        return None
+    weights = np.array([quality["n_cells"] for quality in qualities], dtype=float)
+    metrics = {
+        metric: float(np.average([quality[metric] for quality in qualities], weights=weights))
+        for metric in ["empty_ratio", "column_consistency", "numeric_rate"]
+    }
+    return dict(metrics, n_tables=len(tables))
+
+
+def needs_escalation(
+    quality: Optional[Dict[str, float]], policy: RoutingPolicy
+) -> Tuple[bool, List[str]]:
+    """
+    Whether a document should be escalated to the paid engine.
+
+    Args:
+        quality (Optional[Dict[str, float]]): Output of `document_quality`.
+        policy (RoutingPolicy): Routing policy.
+
+    Returns:
+        Tuple[bool, List[str]]: Decision and reasons of an escalation.
+    """
+    if quality is None:
+        if policy.escalate_without_tables:
+            return True, ["no_tables"]
+        return False, []
+    reasons = []
+    if quality["empty_ratio"] > policy.max_empty_ratio:
+        reasons.append("empty_ratio")
+    if quality["column_consistency"] < policy.min_column_consistency:
+        reasons.append("column_consistency")
+    if quality["numeric_rate"] < policy.min_numeric_rate:
+        reasons.append("numeric_rate")
+    return bool(reasons), reasons
+
+
+def get_policy(name: str) -> RoutingPolicy:
+    """
+    Get a routing policy by name.
+
+    Args:
+        name (str): Policy name.
+
+    Returns:
+        RoutingPolicy: Policy.
+    """
+    if name not in ROUTING_POLICIES:
+        raise ValueError(
+            f"Unknown routing policy {name}, expected one of {', '.join(ROUTING_POLICIES)}."
+        )
+    return ROUTING_POLICIES[name]
+
+
+def decision_path(siren: str, year: int) -> str:
+    """
+    S3 path of the routing decision of a document.
+
+    Args:
+        siren (str): Firm identifier.
+        year (int): Year.
+
+    Returns:
+        str: S3 path.
+    """
+    return f"{ROUTING_DECISIONS_PATH}/{siren}_{year}.json"
+
+
+def save_decision(fs: S3FileSystem, decision: Dict):
+    """
+    Record a routing decision.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        decision (Dict): Decision, with "siren" and "year" keys.
+    """
+    decision = dict(
+        decision, decided_at=datetime.now(timezone.utc).isoformat(timespec="seconds")
+    )
+    with fs.open(decision_path(decision["siren"], decision["year"]), "w") as f:
+        json.dump(decision, f)
+
+
+def read_decision(fs: S3FileSystem, siren: str, year: int) -> Optional[Dict]:
+    """
+    Read the routing decision of a document.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        siren (str): Firm identifier.
+        year (int): Year.
+
+    Returns:
+        Optional[Dict]: Decision, None if the document was not routed yet.
+    """
+    try:
+        return json.loads(fs.cat_file(decision_path(siren, year)))
+    except FileNotFoundError:
+        return None
+
+
+def read_decisions(fs: S3FileSystem) -> pd.DataFrame:
+    """
+    Read all recorded routing decisions.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+
+    Returns:
+        pd.DataFrame: One row per document.
+    """
+    paths = fs.glob(f"{ROUTING_DECISIONS_PATH}/*.json")
+    if not paths:
+        return pd.DataFrame()
+    return pd.json_normalize(
+        [json.loads(content) for content in fs.cat(paths).values()]
+    )
@@ -0,0 +1,664 @@
+"""
+Storage of extraction results on S3.
+
+Two formats are supported:
+- "legacy": one file per table (`table_{i}.csv` for Table Transformer,
+  `table_{i}.xlsx` plus a confidence file for ExtractTable);
+- "parquet": a single `extraction.parquet` file per document holding all
+  tables and confidences in long format, one row group per table, with
+  table shapes and labels in the file metadata.
+
+All files of an extraction are written concurrently, then committed by a
+manifest (`_manifest.json`) listing them with their sizes and MD5
+digests. Readers only consider extractions with a manifest, and check the
+files they read against it, so that an interrupted write or a partial
+overwrite is never taken for a complete extraction.
+"""
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from datetime import datetime, timezone
+import hashlib
+import io
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from s3fs import S3FileSystem
+from confidence import confidence_stats, document_confidence
+from instrumentation import traced
+from utils import read_excel_from_s3
+from constants import (
+    ENGINES,
+    STORAGE_FORMAT,
+    EXTRACT_TABLE_CONFIDENCES_PATH,
+)
+
+
+PARQUET_FILE_NAME = "extraction.parquet"
+# Tables normalised to a typed schema, stored alongside the raw tables
+NORMALIZED_FILE_NAME = "normalized.parquet"
+# Commit marker of an extraction, written once all its files are written
+MANIFEST_FILE_NAME = "_manifest.json"
+PARQUET_SCHEMA = pa.schema(
+    [
+        ("table", pa.int32()),
+        ("row", pa.int32()),
+        ("col", pa.int32()),
+        ("value", pa.string()),
+        ("confidence", pa.float32()),
+    ]
+)
+
+
+class TableReference(NamedTuple):
+    """
+    Reference to a stored table.
+    """
+
+    engine: str
+    siren: str
+    year: int
+    table_idx: int
+
+
+def format_table_reference(reference: TableReference) -> str:
+    """
+    Format a table reference for display.
+
+    Args:
+        reference (TableReference): Table reference.
+
+    Returns:
+        str: Formatted name.
+    """
+    return f"{reference.siren} ({reference.year}) - Table {reference.table_idx + 1}"
+
+
+def extraction_path(engine: str, siren: str, year: int) -> str:
+    """
+    Directory of the extraction of a document.
+
+    Args:
+        engine (str): Extraction engine.
+        siren (str): Firm identifier.
+        year (int): Year.
+
+    Returns:
+        str: S3 path.
+    """
+    return f"{ENGINES[engine][0]}/{siren}_{year}"
+
+
+def confidence_path(siren: str, year: int) -> str:
+    """
+    Directory of the legacy ExtractTable confidences of a document.
+
+    Args:
+        siren (str): Firm identifier.
+        year (int): Year.
+
+    Returns:
+        str: S3 path.
+    """
+    return f"{EXTRACT_TABLE_CONFIDENCES_PATH}/{siren}_{year}"
+
+
+def parquet_path(engine: str, siren: str, year: int) -> str:
+    """
+    Path of the Parquet file of the extraction of a document.
+
+    Args:
+        engine (str): Extraction engine.
+        siren (str): Firm identifier.
+        year (int): Year.
+
+    Returns:
+        str: S3 path.
+    """
+    return f"{extraction_path(engine, siren, year)}/{PARQUET_FILE_NAME}"
+
+
+def normalized_path(engine: str, siren: str, year: int) -> str:
+    """
+    Path of the normalised tables of the extraction of a document.
+
+    Args:
+        engine (str): Extraction engine.
+        siren (str): Firm identifier.
+        year (int): Year.
+
+    Returns:
+        str: S3 path.
+    """
+    return f"{extraction_path(engine, siren, year)}/{NORMALIZED_FILE_NAME}"
+
+
+def manifest_path(engine: str, siren: str, year: int) -> str:
+    """
+    Path of the manifest of the extraction of a document.
+
+    Args:
+        engine (str): Extraction engine.
+        siren (str): Firm identifier.
+        year (int): Year.
+
+    Returns:
+        str: S3 path.
+    """
+    return f"{extraction_path(engine, siren, year)}/{MANIFEST_FILE_NAME}"
+
+
+def table_files(reference: TableReference, storage_format: str) -> List[str]:
+    """
+    Files read to load a stored table and its confidence.
+
+    Args:
+        reference (TableReference): Table reference.
+        storage_format (str): "parquet" or "legacy".
+
+    Returns:
+        List[str]: S3 paths.
+    """
+    engine, siren, year, table_idx = reference
+    if storage_format == "parquet":
+        return [parquet_path(engine, siren, year)]
+    files = [f"{extraction_path(engine, siren, year)}/table_{table_idx}.{ENGINES[engine][1]}"]
+    if engine == "extract_table":
+        files.append(f"{confidence_path(siren, year)}/table_{table_idx}.xlsx")
+    return files
+
+
+def _labels(labels: pd.Index) -> List:
+    """
+    JSON serializable table labels.
+    """
+    return [label.item() if isinstance(label, np.generic) else label for label in labels]
+
+
+def tables_to_arrow(
+    tables: List[pd.DataFrame],
+    confidences: Optional[List[Optional[pd.DataFrame]]] = None,
+    pages: Optional[List[List[int]]] = None,
+    tables_confidence: Optional[List[Optional[Dict]]] = None,
+) -> Tuple[List[pa.Table], List[Dict]]:
+    """
+    Convert tables and confidences to long format Arrow tables, one per
+    extracted table.
+
+    Args:
+        tables (List[pd.DataFrame]): Extracted tables.
+        confidences (Optional[List[Optional[pd.DataFrame]]]): Confidences.
+        pages (Optional[List[List[int]]]): Pages of the source document
+            spanned by each table.
+        tables_confidence (Optional[List[Optional[Dict]]]): Confidence
+            statistics of each table, computed from the confidences if not
+            specified.
+
+    Returns:
+        Tuple[List[pa.Table], List[Dict]]: Arrow tables and table metadata.
+    """
+    if confidences is None:
+        confidences = [None] * len(tables)
+    arrow_tables = []
+    tables_metadata = []
+    for table_idx, (df, df_conf) in enumerate(zip(tables, confidences)):
+        n_rows, n_cols = df.shape
+        rows, cols = np.divmod(np.arange(n_rows * n_cols, dtype=np.int32), max(n_cols, 1))
+        values = df.to_numpy(dtype=object).ravel()
+        if df_conf is not None:
+            conf = np.full((n_rows, n_cols), np.nan, dtype=np.float32)
+            conf_values = df_conf.to_numpy(dtype=np.float32)
+            conf_rows = min(n_rows, conf_values.shape[0])
+            conf_cols = min(n_cols, conf_values.shape[1])
+            conf[:conf_rows, :conf_cols] = conf_values[:conf_rows, :conf_cols]
+            conf = conf.ravel()
+        else:
+            conf = np.full(n_rows * n_cols, np.nan, dtype=np.float32)
+        arrow_tables.append(
+            pa.table(
+                {
+                    "table": pa.array(np.full(n_rows * n_cols, table_idx, dtype=np.int32)),
+                    "row": pa.array(rows),
+                    "col": pa.array(cols),
+                    "value": pa.array(
+                        [None if pd.isna(value) else str(value) for value in values],
+                        type=pa.string(),
+                    ),
+                    "confidence": pa.array(conf, from_pandas=True),
+                },
+                schema=PARQUET_SCHEMA,
+            )
+        )
+        tables_metadata.append(
+            {
+                "n_rows": n_rows,
+                "n_cols": n_cols,
+                "columns": _labels(df.columns),
+                "index": _labels(df.index),
+                "has_confidence": df_conf is not None,
+            }
+        )
+        if df_conf is not None:
+            tables_metadata[-1]["confidence_stats"] = (
+                confidence_stats(conf)
+                if tables_confidence is None
+                else tables_confidence[table_idx]
+            )
+        if pages is not None:
+            tables_metadata[-1]["pages"] = pages[table_idx]
+    return arrow_tables, tables_metadata
+
+
+def parquet_extraction_bytes(
+    tables: List[pd.DataFrame],
+    confidences: Optional[List[Optional[pd.DataFrame]]] = None,
+    metadata: Optional[Dict] = None,
+    pages: Optional[List[List[int]]] = None,
+    tables_confidence: Optional[List[Optional[Dict]]] = None,
+) -> bytes:
+    """
+    Serialize all tables of a document to a single Parquet file.
+
+    Args:
+        tables (List[pd.DataFrame]): Extracted tables.
+        confidences (Optional[List[Optional[pd.DataFrame]]]): Confidences.
+        metadata (Optional[Dict]): Document metadata.
+        pages (Optional[List[List[int]]]): Pages of the source document
+            spanned by each table.
+        tables_confidence (Optional[List[Optional[Dict]]]): Confidence
+            statistics of each table, computed from the confidences if not
+            specified.
+
+    Returns:
+        bytes: Parquet file.
+    """
+    arrow_tables, tables_metadata = tables_to_arrow(tables, confidences, pages, tables_confidence)
+    file_metadata = dict(metadata or {}, tables=tables_metadata)
+    schema = PARQUET_SCHEMA.with_metadata(
+        {"extraction": json.dumps(file_metadata)}
+    )
+    buffer = io.BytesIO()
+    with pq.ParquetWriter(buffer, schema) as writer:
+        for arrow_table in arrow_tables:
+            # One row group per table, so that tables can be read separately
+            writer.write_table(arrow_table)
+    return buffer.getvalue()
+
+
+def read_parquet_metadata(fs: S3FileSystem, s3_path: str) -> Dict:
+    """
+    Read document metadata from the footer of a Parquet file.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        s3_path (str): S3 path.
+
+    Returns:
+        Dict: Document metadata.
+    """
+    with fs.open(s3_path, "rb") as f:
+        schema = pq.read_schema(f)
+    return json.loads(schema.metadata[b"extraction"])
+
+
+def read_parquet_table(
+    fs: S3FileSystem, s3_path: str, table_idx: int, with_confidence: bool = True
+) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    Read a single table from a Parquet file, fetching only its row group
+    and the required columns.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        s3_path (str): S3 path.
+        table_idx (int): Table index.
+        with_confidence (bool): Whether to read confidences.
+
+    Returns:
+        Tuple[pd.DataFrame, Optional[pd.DataFrame]]: Table and confidence.
+    """
+    with fs.open(s3_path, "rb") as f:
+        parquet_file = pq.ParquetFile(f)
+        metadata = json.loads(parquet_file.schema_arrow.metadata[b"extraction"])
+        table_metadata = metadata["tables"][table_idx]
+        with_confidence = with_confidence and table_metadata["has_confidence"]
+        columns = ["value", "confidence"] if with_confidence else ["value"]
+        arrow_table = parquet_file.read_row_group(table_idx, columns=columns)
+
+    shape = (table_metadata["n_rows"], table_metadata["n_cols"])
+    values = np.array(arrow_table.column("value").to_pylist(), dtype=object).reshape(shape)
+    df = pd.DataFrame(
+        values, index=table_metadata["index"], columns=table_metadata["columns"]
+    )
+    df_conf = None
+    if with_confidence:
+        conf = (
+            arrow_table.column("confidence")
+            .to_numpy(zero_copy_only=False)
+            .astype(np.float32)
+            .reshape(shape)
+        )
+        df_conf = pd.DataFrame(
+            conf, index=table_metadata["index"], columns=table_metadata["columns"]
+        )
+    return df, df_conf
+
+
+def legacy_extraction_files(
+    engine: str,
+    siren: str,
+    year: int,
+    tables: List[pd.DataFrame],
+    confidences: Optional[List[Optional[pd.DataFrame]]] = None,
+) -> Dict[str, bytes]:
+    """
+    Serialize tables of a document as one file per table.
+
+    Args:
+        engine (str): Extraction engine.
+        siren (str): Firm identifier.
+        year (int): Year.
+        tables (List[pd.DataFrame]): Extracted tables.
+        confidences (Optional[List[Optional[pd.DataFrame]]]): Confidences.
+
+    Returns:
+        Dict[str, bytes]: Content of each file by S3 path.
+    """
+    s3_path = extraction_path(engine, siren, year)
+    extension = ENGINES[engine][1]
+    if confidences is None:
+        confidences = [None] * len(tables)
+    files = {}
+    for table_idx, (df, df_conf) in enumerate(zip(tables, confidences)):
+        buffer = io.BytesIO()
+        if extension == "csv":
+            df.to_csv(buffer)
+        else:
+            df.to_excel(buffer)
+        files[f"{s3_path}/table_{table_idx}.{extension}"] = buffer.getvalue()
+        # Save confidences
+        if df_conf is not None:
+            buffer = io.BytesIO()
+            df_conf.to_excel(buffer)
+            files[f"{confidence_path(siren, year)}/table_{table_idx}.xlsx"] = buffer.getvalue()
+    return files
+
+
+def read_legacy_table(
+    fs: S3FileSystem,
+    engine: str,
+    siren: str,
+    year: int,
+    table_idx: int,
+    with_confidence: bool = True,
+) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    Read a table stored as a single file.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        engine (str): Extraction engine.
+        siren (str): Firm identifier.
+        year (int): Year.
+        table_idx (int): Table index.
+        with_confidence (bool): Whether to read confidences.
+
+    Returns:
+        Tuple[pd.DataFrame, Optional[pd.DataFrame]]: Table and confidence.
+    """
+    extension = ENGINES[engine][1]
+    table_path = f"{extraction_path(engine, siren, year)}/table_{table_idx}.{extension}"
+    if extension == "csv":
+        with fs.open(table_path, "rb") as f:
+            df = pd.read_csv(f, index_col=0)
+    else:
+        df = read_excel_from_s3(fs, table_path)
+
+    df_conf = None
+    table_confidence_path = f"{confidence_path(siren, year)}/table_{table_idx}.xlsx"
+    if with_confidence and engine == "extract_table" and fs.exists(table_confidence_path):
+        df_conf = read_excel_from_s3(fs, table_confidence_path)
+    return df, df_conf
+
+
+def commit_extraction(
+    fs: S3FileSystem,
+    engine: str,
+    siren: str,
+    year: int,
+    files: Dict[str, bytes],
+    storage_format: str,
+    n_tables: int,
+    has_confidence: bool,
+    created_at: Optional[str] = None,
+    tables_confidence: Optional[List[Optional[Dict]]] = None,
+) -> Dict:
+    """
+    Write the manifest of an extraction whose files are all written, which
+    makes the extraction visible to readers.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        engine (str): Extraction engine.
+        siren (str): Firm identifier.
+        year (int): Year.
+        files (Dict[str, bytes]): Content of each file by S3 path.
+        storage_format (str): "parquet" or "legacy".
+        n_tables (int): Number of tables.
+        has_confidence (bool): Whether confidences are available.
+        created_at (Optional[str]): Creation date, now if not specified.
+        tables_confidence (Optional[List[Optional[Dict]]]): Confidence
+            statistics of each table.
+
+    Returns:
+        Dict: Manifest.
+    """
+    manifest = {
+        "engine": engine,
+        "siren": siren,
+        "year": int(year),
+        "storage_format": storage_format,
+        "n_tables": n_tables,
+        "has_confidence": has_confidence,
+        "confidence": document_confidence(tables_confidence or []),
+        "tables_confidence": tables_confidence,
+        "created_at": created_at
+        or datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "files": {
+            s3_path: {"size": len(content), "md5": hashlib.md5(content).hexdigest()}
+            for s3_path, content in files.items()
+        },
+    }
+    fs.pipe_file(manifest_path(engine, siren, year), json.dumps(manifest).encode("utf-8"))
+    return manifest
+
+
+@traced("s3_read_manifest")
+def read_manifest(fs: S3FileSystem, engine: str, siren: str, year: int) -> Optional[Dict]:
+    """
+    Read the manifest of an extraction.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        engine (str): Extraction engine.
+        siren (str): Firm identifier.
+        year (int): Year.
+
+    Returns:
+        Optional[Dict]: Manifest, None if the extraction does not exist or
+            was not committed.
+    """
+    try:
+        return json.loads(fs.cat_file(manifest_path(engine, siren, year)))
+    except FileNotFoundError:
+        return None
+
+
+def verify_files(fs: S3FileSystem, manifest: Dict, s3_paths: List[str]):
+    """
+    Check that files of an extraction are those committed by its manifest:
+    their size, and their MD5 digest when the ETag of the object is one
+    (objects uploaded in a single part).
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        manifest (Dict): Manifest of the extraction.
+        s3_paths (List[str]): S3 paths of the checked files, files missing
+            from the manifest are ignored.
+
+    Raises:
+        ValueError: If a file does not match the manifest.
+    """
+    for s3_path in s3_paths:
+        expected = manifest["files"].get(s3_path)
+        if expected is None:
+            continue
+        info = fs.info(s3_path)
+        etag = str(info.get("ETag") or "").strip('"')
+        if info["size"] != expected["size"] or (
+            "md5" in expected and etag and "-" not in etag and etag != expected["md5"]
+        ):
+            raise ValueError(f"File {s3_path} does not match the manifest of its extraction.")
+
+
+def save_extraction(
+    fs: S3FileSystem,
+    engine: str,
+    siren: str,
+    year: int,
+    tables: List[pd.DataFrame],
+    confidences: Optional[List[Optional[pd.DataFrame]]] = None,
+    storage_format: str = STORAGE_FORMAT,
+    pages: Optional[List[List[int]]] = None,
+    normalized: Optional[pd.DataFrame] = None,
+) -> Dict:
+    """
+    Save the extracted tables of a document: all files are written
+    concurrently, then committed by the manifest.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        engine (str): Extraction engine.
+        siren (str): Firm identifier.
+        year (int): Year.
+        tables (List[pd.DataFrame]): Extracted tables.
+        confidences (Optional[List[Optional[pd.DataFrame]]]): Confidences.
+        storage_format (str): "parquet" or "legacy".
+        pages (Optional[List[List[int]]]): Pages of the source document
+            spanned by each table, only stored in the Parquet format.
+        normalized (Optional[pd.DataFrame]): Normalised tables.
+
+    Returns:
+        Dict: Manifest.
+    """
+    created_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    # Computed once, for the Parquet metadata and the manifest
+    tables_confidence = None
+    if confidences is not None:
+        tables_confidence = [
+            None if df_conf is None else confidence_stats(df_conf) for df_conf in confidences
+        ]
+    if storage_format == "parquet":
+        metadata = {
+            "engine": engine,
+            "siren": siren,
+            "year": int(year),
+            "created_at": created_at,
+        }
+        files = {
+            parquet_path(engine, siren, year): parquet_extraction_bytes(
+                tables, confidences, metadata, pages, tables_confidence
+            )
+        }
+    elif storage_format == "legacy":
+        files = legacy_extraction_files(engine, siren, year, tables, confidences)
+    else:
+        raise ValueError(f"Unknown storage format {storage_format}.")
+    if normalized is not None:
+        files[normalized_path(engine, siren, year)] = normalized_bytes(normalized)
+
+    fs.pipe(files)
+    return commit_extraction(
+        fs,
+        engine,
+        siren,
+        year,
+        files,
+        storage_format=storage_format,
+        n_tables=len(tables),
+        has_confidence=confidences is not None
+        and any(df_conf is not None for df_conf in confidences),
+        created_at=created_at,
+        tables_confidence=tables_confidence,
+    )
+
+
+def load_table(
+    fs: S3FileSystem,
+    reference: TableReference,
+    storage_format: Optional[str] = None,
+    with_confidence: bool = True,
+) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    Load a stored table and its confidence, after checking its files
+    against the manifest of the extraction.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        reference (TableReference): Table reference.
+        storage_format (Optional[str]): "parquet" or "legacy", read from
+            the manifest if not specified.
+        with_confidence (bool): Whether to read confidences.
+
+    Returns:
+        Tuple[pd.DataFrame, Optional[pd.DataFrame]]: Table and confidence.
+
+    Raises:
+        ValueError: If the extraction is not committed, or its files do
+            not match its manifest.
+    """
+    engine, siren, year, table_idx = reference
+    manifest = read_manifest(fs, engine, siren, year)
+    if manifest is None:
+        raise ValueError(f"Extraction {engine}/{siren}_{year} is not committed.")
+    storage_format = storage_format or manifest["storage_format"]
+    verify_files(fs, manifest, table_files(reference, storage_format))
+    if storage_format == "parquet":
+        return read_parquet_table(fs, parquet_path(engine, siren, year), table_idx, with_confidence)
+    return read_legacy_table(fs, engine, siren, year, table_idx, with_confidence)
+
+
+def normalized_bytes(df: pd.DataFrame) -> bytes:
+    """
+    Serialize the normalised tables of a document to Parquet.
+
+    Args:
+        df (pd.DataFrame): Normalised tables.
+
+    Returns:
+        bytes: Parquet file.
+    """
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def load_normalized(
+    fs: S3FileSystem, engine: str, siren: str, year: int, columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """
+    Load the normalised tables of a document.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        engine (str): Extraction engine.
+        siren (str): Firm identifier.
+        year (int): Year.
+        columns (Optional[List[str]]): Columns to read, all if not
+            specified.
+
+    Returns:
+        pd.DataFrame: Normalised tables.
+    """
+    with fs.open(normalized_path(engine, siren, year), "rb") as f:
+        return pd.read_parquet(f, columns=columns)
@@ -1,10 +1,26 @@
 """
 Streamlit utilities.
 """
+from typing import Dict, List, Optional, Tuple
 import streamlit as st
 from s3fs import S3FileSystem
 import base64
-from utils import get_extract_table_credits
+import fitz
+import numpy as np
+import pandas as pd
+from confidence import confidence_stats
+from constants import PDF_SAMPLES_PATH, PREFETCH_DEPTH
+from instrumentation import RECORDER, span, traced
+from object_cache import ObjectCache
+from storage import (
+    TableReference,
+    load_normalized,
+    load_table,
+    manifest_path,
+    normalized_path,
+    table_files,
+)
+from utils import get_credit_manager
 
 
 def disable_button():
@@ -14,16 +30,85 @@ def disable_button():
     st.session_state["disable"] = True
 
 
-def display_pdf(fs: S3FileSystem, s3_path: str):
+@st.cache_data(max_entries=1024)
+@traced("pdf_render")
+def render_pdf_page(
+    _fs: S3FileSystem,
+    s3_path: str,
+    page_number: int = 0,
+    dpi: int = 120,
+    version: Optional[str] = None,
+) -> bytes:
+    """
+    Render a PDF page to a PNG image, cached per path, page, resolution and
+    document version.
+
+    Args:
+        _fs (S3FileSystem): S3 file system.
+        s3_path (str): S3 path.
+        page_number (int): Page number.
+        dpi (int): Resolution.
+        version (Optional[str]): Version of the document, so that replaced
+            documents are rendered again.
+
+    Returns:
+        bytes: PNG image.
+    """
+    with fitz.open(stream=_fs.cat_file(s3_path), filetype="pdf") as document:
+        return document[page_number].get_pixmap(dpi=dpi).tobytes("png")
+
+
+@st.cache_data(max_entries=1024)
+@traced("pdf_page_count")
+def count_pdf_pages(_fs: S3FileSystem, s3_path: str, version: Optional[str] = None) -> int:
+    """
+    Count pages of a PDF document, cached per path and document version.
+
+    Args:
+        _fs (S3FileSystem): S3 file system.
+        s3_path (str): S3 path.
+        version (Optional[str]): Version of the document, so that replaced
+            documents are read again.
+
+    Returns:
+        int: Number of pages.
+    """
+    with fitz.open(stream=_fs.cat_file(s3_path), filetype="pdf") as document:
+        return document.page_count
+
+
+def display_pdf(
+    fs: S3FileSystem,
+    s3_path: str,
+    mode: str = "image",
+    dpi: int = 120,
+    version: Optional[str] = None,
+):
     """
     Display PDF.
 
     Args:
         fs (S3FileSystem): S3 file system.
         s3_path (str): S3 path.
+        mode (str): "image" to display cached page images, "embed" to embed
+            the whole file in the page.
+        dpi (int): Resolution of page images.
+        version (Optional[str]): Version of the document, such as the last
+            update date of its extractions in the index, so that cached page
+            images of replaced documents are not displayed.
     """
-    with fs.open(s3_path, "rb") as f:
-        base64_pdf = base64.b64encode(f.read()).decode("utf-8")
+    if mode == "image":
+        for page_number in range(count_pdf_pages(fs, s3_path, version)):
+            st.image(
+                render_pdf_page(fs, s3_path, page_number, dpi, version),
+                use_container_width=True,
+            )
+        return
+
+    with span("s3_read_pdf") as current, fs.open(s3_path, "rb") as f:
+        pdf_bytes = f.read()
+        current.n_bytes = len(pdf_bytes)
+    base64_pdf = base64.b64encode(pdf_bytes).decode("utf-8")
 
     # Embed PDF in HTML
     pdf_display = f'<embed id="pdfViewer" src="data:application/pdf;base64,{base64_pdf}" width="700" height="1000" type="application/pdf">'
@@ -32,6 +117,131 @@ def display_pdf(fs: S3FileSystem, s3_path: str):
     return st.markdown(pdf_display, unsafe_allow_html=True)
 
 
+@st.cache_data(max_entries=256)
+@traced("s3_read_normalized")
+def get_normalized_table(
+    _fs: S3FileSystem, reference: TableReference, version: Optional[str] = None
+) -> Optional[pd.DataFrame]:
+    """
+    Get the normalised version of a stored table.
+
+    Args:
+        _fs (S3FileSystem): S3 file system.
+        reference (TableReference): Table reference.
+        version (Optional[str]): Version of the extraction, such as its
+            update date in the index, so that re-extracted tables are
+            read again.
+
+    Returns:
+        Optional[pd.DataFrame]: Normalised table, None for extractions
+            saved without normalisation.
+    """
+    engine, siren, year, table_idx = reference
+    if not _fs.exists(normalized_path(engine, siren, year)):
+        return None
+    df = load_normalized(_fs, engine, siren, year)
+    return df[df["table"] == table_idx].drop(columns="table").reset_index(drop=True)
+
+
+@st.cache_data(max_entries=256)
+@traced("s3_read_confidence_table")
+def get_confidence_table(
+    _fs: S3FileSystem,
+    reference: TableReference,
+    version: Optional[str] = None,
+    storage_format: Optional[str] = None,
+) -> Tuple[pd.DataFrame, Optional[np.ndarray], Optional[Dict]]:
+    """
+    Get a stored table with its confidences and confidence statistics,
+    cached per table and extraction version.
+
+    Args:
+        _fs (S3FileSystem): S3 file system.
+        reference (TableReference): Table reference.
+        version (Optional[str]): Version of the extraction, such as its
+            update date in the index, so that re-extracted tables are
+            read again.
+        storage_format (Optional[str]): "parquet" or "legacy", read from
+            the manifest if not specified.
+
+    Returns:
+        Tuple[pd.DataFrame, Optional[np.ndarray], Optional[Dict]]: Table
+            with positional labels, confidences aligned with the table and
+            their statistics, None if there are no confidences.
+    """
+    extraction, confidence = load_table(_fs, reference, storage_format)
+    extraction = extraction.fillna("").set_axis(
+        range(extraction.shape[1]), axis=1
+    ).reset_index(drop=True)
+    if confidence is None:
+        return extraction, None, None
+    values = confidence.to_numpy(dtype=np.float32)
+    aligned = np.full(extraction.shape, np.nan, dtype=np.float32)
+    n_rows = min(aligned.shape[0], values.shape[0])
+    n_cols = min(aligned.shape[1], values.shape[1])
+    aligned[:n_rows, :n_cols] = values[:n_rows, :n_cols]
+    return extraction, aligned, confidence_stats(aligned)
+
+
+def prefetch_tables(
+    cache: ObjectCache,
+    references: List[TableReference],
+    selected: TableReference,
+    storage_formats: Dict[Tuple[str, int], str],
+    depth: int = PREFETCH_DEPTH,
+):
+    """
+    Download in the background the files of the tables following the
+    selected one in the viewer list, with their normalised version and
+    document, so that they are displayed without waiting for S3.
+
+    Args:
+        cache (ObjectCache): Object cache read by the viewer.
+        references (List[TableReference]): Table references, in the order
+            of the list.
+        selected (TableReference): Selected table.
+        storage_formats (Dict[Tuple[str, int], str]): Storage format of
+            each (siren, year) extraction.
+        depth (int): Number of following tables to prefetch.
+    """
+    if selected not in references:
+        return
+    position = references.index(selected)
+    s3_paths = []
+    for reference in references[position + 1 : position + 1 + depth]:
+        engine, siren, year, _ = reference
+        s3_paths.append(manifest_path(engine, siren, year))
+        s3_paths += table_files(reference, storage_formats.get((siren, year), "legacy"))
+        s3_paths.append(normalized_path(engine, siren, year))
+        s3_paths.append(f"{PDF_SAMPLES_PATH}/{siren}_{year}.pdf")
+    cache.prefetch(list(dict.fromkeys(s3_paths)))
+
+
+def normalized_table_content(
+    fs: S3FileSystem, reference: TableReference, version: Optional[str] = None
+):
+    """
+    Display the normalised version of a stored table in an expander.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        reference (TableReference): Table reference.
+        version (Optional[str]): Version of the extraction.
+    """
+    normalized = get_normalized_table(fs, reference, version)
+    if normalized is None:
+        return
+    with st.expander("Version normalisée"):
+        st.dataframe(normalized, use_container_width=True, hide_index=True)
+        st.download_button(
+            label="Exporter la version normalisée en .csv",
+            data=normalized.to_csv(sep=";", index=False).encode("utf_8_sig"),
+            file_name=f"{reference.siren}_{reference.year}_{reference.table_idx + 1}_normalise.csv",
+            mime="text/csv",
+            key=f"normalized_export_button_{reference.engine}",
+        )
+
+
 def sidebar_content():
     """
     Add side bar content for ExtractTable authentication.
@@ -39,8 +249,27 @@ def sidebar_content():
     if "auth_token" not in st.session_state:
         st.session_state.auth_token = None
     token = st.sidebar.text_input("ExtractTable token", type="password", key="token")
-    if st.sidebar.button("Authentification - crédits"):
-        if token:
-            st.session_state.auth_token = token
-            remaining_credits = get_extract_table_credits(token)
-            st.sidebar.write(f"Crédits restants: {remaining_credits}")
+    refresh = st.sidebar.button("Authentification - crédits")
+    if refresh and token:
+        st.session_state.auth_token = token
+    if st.session_state.auth_token:
+        credit_manager = get_credit_manager(st.session_state.auth_token)
+        if refresh:
+            # Balance fetched from the validator on explicit request
+            remaining_credits = credit_manager.refresh()
+        else:
+            # Cached balance, net of the jobs submitted in this process
+            remaining_credits = credit_manager.remaining()
+        st.sidebar.write(f"Crédits restants: {remaining_credits}")
+
+
+def http_stats_content():
+    """
+    Add side bar content with the latency of remote calls, from the spans
+    recorded by the HTTP client.
+    """
+    stats = RECORDER.stage_stats()
+    stats = stats[stats["stage"].str.startswith("http ")]
+    if not stats.empty:
+        with st.sidebar.expander("Latence des appels distants"):
+            st.dataframe(stats, hide_index=True)
@@ -0,0 +1,95 @@
+"""
+Merging of tables spanning several consecutive pages.
+"""
+from typing import List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+
+def _is_default_columns(columns: pd.Index) -> bool:
+    # Columns labelled 0, 1, ... by the engine rather than by a header
+    return list(columns) == list(range(len(columns)))
+
+
+def is_continuation(previous: pd.DataFrame, table: pd.DataFrame) -> bool:
+    """
+    Whether a table continues the previous one: both have the same number
+    of columns, and the same header unless the continuation has none.
+
+    Args:
+        previous (pd.DataFrame): Last table of a page.
+        table (pd.DataFrame): First table of the next page.
+
+    Returns:
+        bool: Whether the tables should be merged.
+    """
+    if previous.shape[1] != table.shape[1]:
+        return False
+    return _is_default_columns(table.columns) or list(table.columns) == list(previous.columns)
+
+
+def _append(previous: pd.DataFrame, table: pd.DataFrame) -> pd.DataFrame:
+    table = table.set_axis(previous.columns, axis=1)
+    # Header row repeated at the top of the continuation
+    if len(table) and len(previous) and table.iloc[0].equals(previous.iloc[0]):
+        table = table.iloc[1:]
+    return pd.concat([previous, table], ignore_index=True)
+
+
+def _missing_confidence(n_rows: int, columns: pd.Index) -> pd.DataFrame:
+    # Confidences of a table part extracted without them
+    return pd.DataFrame(np.nan, index=range(n_rows), columns=columns)
+
+
+def merge_continuation_tables(
+    page_outputs: List[Tuple[int, List[Tuple[pd.DataFrame, Optional[pd.DataFrame]]]]]
+) -> List[Tuple[pd.DataFrame, Optional[pd.DataFrame], List[int]]]:
+    """
+    Merge the last table of a page with the first table of the next page
+    when it continues it.
+
+    Args:
+        page_outputs (List[Tuple[int, List[Tuple[pd.DataFrame,
+            Optional[pd.DataFrame]]]]]): Page numbers and extracted tables
+            and confidences of each page, in page order.
+
+    Returns:
+        List[Tuple[pd.DataFrame, Optional[pd.DataFrame], List[int]]]:
+            Tables, confidences and the page numbers each table spans.
+    """
+    merged = []
+    previous_page = None
+    for page_number, outputs in page_outputs:
+        for idx, (df, df_conf) in enumerate(outputs):
+            if (
+                idx == 0
+                and merged
+                and page_number == previous_page + 1
+                and merged[-1][2][-1] == previous_page
+                and is_continuation(merged[-1][0], df)
+            ):
+                previous_df, previous_conf, pages = merged[-1]
+                merged_df = _append(previous_df, df)
+                n_added = len(merged_df) - len(previous_df)
+                if previous_conf is None and df_conf is None:
+                    merged_conf = None
+                else:
+                    # A part without confidences is padded with missing
+                    # values, so that the confidences of the other are kept
+                    columns = (previous_conf if previous_conf is not None else df_conf).columns
+                    if previous_conf is None:
+                        previous_conf = _missing_confidence(len(previous_df), columns)
+                    if df_conf is None:
+                        df_conf = _missing_confidence(n_added, columns)
+                    else:
+                        # Drop the confidences of a removed header row
+                        df_conf = df_conf.iloc[len(df_conf) - n_added:]
+                    merged_conf = pd.concat(
+                        [previous_conf, df_conf.set_axis(columns, axis=1)],
+                        ignore_index=True,
+                    )
+                merged[-1] = (merged_df, merged_conf, pages + [page_number])
+            else:
+                merged.append((df, df_conf, [page_number]))
+        previous_page = page_number
+    return merged
@@ -1,27 +1,58 @@
 """
 Utility functions.
 """
-from typing import List, Tuple
-import json
+from typing import List, Optional, Tuple
+import io
 import os
 from pathlib import Path
 from s3fs import S3FileSystem
 import pandas as pd
-import requests
 import streamlit as st
 import fitz
+import fsspec
 import tempfile
 from ca_query.querier import DocumentQuerier
 import re
-
-
-@st.cache_data
-def check_availability(_document_querier: DocumentQuerier, company_id: str, year: str) -> Tuple:
+from concurrency import RateLimiter
+from credit_manager import CreditManager
+from http_client import HttpClient
+from instrumentation import span, traced
+from result_cache import ResultCache
+from jobs import JobQueue
+from object_cache import ObjectCache
+from constants import (
+    JOBS_DB_PATH,
+    RESULT_CACHE_PATH,
+    EXTRACT_TABLE_VALIDATOR_URL,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_RETRIES,
+    HTTP_MAX_RETRY_AFTER,
+    CREDITS_TTL,
+    MULTIPART_THRESHOLD,
+    MULTIPART_CHUNK_SIZE,
+    S3_ENDPOINT_URL,
+    STORAGE_BACKEND,
+    OBJECT_CACHE_MAX_BYTES,
+    OBJECT_CACHE_MAX_AGE,
+)
+
+
+# Memory-backed temporary directory, falls back to the default temporary
+# directory if not available
+IN_MEMORY_TMP_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+@traced("inpi_availability")
+def query_availability(
+    document_querier: DocumentQuerier, company_id: str, year: str
+) -> Tuple:
     """
-    Check if a document is available for a given company and year.
+    Query the INPI API to check if a document is available for a given
+    company and year.
 
     Args:
-        _document_querier (DocumentQuerier): Document querier.
+        document_querier (DocumentQuerier): Document querier.
         company_id (str): Company identifier.
         year (str): Year.
 
@@ -30,7 +61,7 @@ def check_availability(_document_querier: DocumentQuerier, company_id: str, year
     """
     try:
         # Make an API request to check availability for each document
-        availability, document_id = _document_querier.check_document_availability(
+        availability, document_id = document_querier.check_document_availability(
             company_id, year
         )
     except KeyError:
@@ -44,41 +75,170 @@ def check_availability(_document_querier: DocumentQuerier, company_id: str, year
 
 
 @st.cache_data
-def download_pdf(_document_querier: DocumentQuerier, document_id: str):
+def check_availability(_document_querier: DocumentQuerier, company_id: str, year: str) -> Tuple:
     """
-    Download a PDF document from its ID.
+    Check if a document is available for a given company and year.
 
     Args:
         _document_querier (DocumentQuerier): Document querier.
+        company_id (str): Company identifier.
+        year (str): Year.
+
+    Returns:
+        Tuple: Availability status and document ID.
+    """
+    return query_availability(_document_querier, company_id, year)
+
+
+@traced("inpi_download")
+def fetch_pdf(document_querier: DocumentQuerier, document_id: str) -> bytes:
+    """
+    Fetch a PDF document from the INPI API.
+
+    Args:
+        document_querier (DocumentQuerier): Document querier.
         document_id (str): Document ID.
+
+    Returns:
+        bytes: PDF document.
     """
-    with tempfile.TemporaryDirectory() as tmpdirname:
+    # The querier writes to a file: use a memory-backed directory if available
+    # rather than the container ephemeral disk
+    with tempfile.TemporaryDirectory(dir=IN_MEMORY_TMP_DIR) as tmpdirname:
         tmp_dir = Path(tmpdirname)
         tmp_file_path = tmp_dir / "tmp.pdf"
-        _document_querier.download_from_id(
+        document_querier.download_from_id(
             document_id, save_path=tmp_file_path, s3=False
         )
 
         with open(tmp_file_path, "rb") as pdf_file:
             PDFbyte = pdf_file.read()
         # Also return fitz Document ? Probleme can't cache
-    if len(PDFbyte) < 10000:
-        print(PDFbyte)
     return PDFbyte
 
 
+@st.cache_data(max_entries=16)
+def download_pdf(_document_querier: DocumentQuerier, document_id: str):
+    """
+    Download a PDF document from its ID, caching the most recent
+    documents.
+
+    Args:
+        _document_querier (DocumentQuerier): Document querier.
+        document_id (str): Document ID.
+    """
+    return fetch_pdf(_document_querier, document_id)
+
+
+def fetch_availability(
+    document_querier: DocumentQuerier,
+    company_id: str,
+    year: str,
+    rate_limiter: Optional[RateLimiter] = None,
+) -> Tuple:
+    """
+    Check availability of a document, with rate limiting.
+
+    Args:
+        document_querier (DocumentQuerier): Document querier.
+        company_id (str): Company identifier.
+        year (str): Year.
+        rate_limiter (Optional[RateLimiter]): Rate limiter acquired before
+            the call to the INPI API.
+
+    Returns:
+        Tuple: Availability status and document ID.
+    """
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    return query_availability(document_querier, company_id, year)
+
+
+def fetch_document(
+    document_querier: DocumentQuerier,
+    company_id: str,
+    year: str,
+    rate_limiter: Optional[RateLimiter] = None,
+) -> Tuple:
+    """
+    Check availability of a document and download it if available.
+
+    Args:
+        document_querier (DocumentQuerier): Document querier.
+        company_id (str): Company identifier.
+        year (str): Year.
+        rate_limiter (Optional[RateLimiter]): Rate limiter acquired before
+            each call to the INPI API.
+
+    Returns:
+        Tuple: Availability status, document ID and PDF document
+            (None if unavailable).
+    """
+    availability, document_id = fetch_availability(
+        document_querier, company_id, year, rate_limiter
+    )
+    if not availability:
+        return availability, document_id, None
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    return availability, document_id, fetch_pdf(document_querier, document_id)
+
+
 @st.cache_resource
 def get_file_system():
     """
-    Get s3 file system.
+    Get s3 file system, or its in-memory stand-in.
     """
+    if STORAGE_BACKEND == "memory":
+        return fsspec.filesystem("memory")
+    if STORAGE_BACKEND != "s3":
+        raise ValueError(f"Unknown storage backend {STORAGE_BACKEND}.")
     return S3FileSystem(
-        client_kwargs={'endpoint_url': 'https://'+'minio.lab.sspcloud.fr'},
+        client_kwargs={'endpoint_url': S3_ENDPOINT_URL},
         key=os.getenv("AWS_ACCESS_KEY_ID"),
         secret=os.getenv("AWS_SECRET_ACCESS_KEY"),
     )
 
 
+@st.cache_resource
+def get_http_client() -> HttpClient:
+    """
+    Get pooled HTTP client shared by all remote calls.
+    """
+    return HttpClient(
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        retries=HTTP_RETRIES,
+        max_retry_after=HTTP_MAX_RETRY_AFTER,
+    )
+
+
+@st.cache_resource
+def get_result_cache() -> ResultCache:
+    """
+    Get content-addressed cache of extraction results.
+    """
+    return ResultCache(fs=get_file_system(), s3_path=RESULT_CACHE_PATH)
+
+
+@st.cache_resource
+def get_object_cache() -> ObjectCache:
+    """
+    Get in-memory cache of S3 objects read by the viewer.
+    """
+    return ObjectCache(
+        get_file_system(), max_bytes=OBJECT_CACHE_MAX_BYTES, max_age=OBJECT_CACHE_MAX_AGE
+    )
+
+
+@st.cache_resource
+def get_job_queue() -> JobQueue:
+    """
+    Get extraction job queue.
+    """
+    return JobQueue(JOBS_DB_PATH)
+
+
 @st.cache_resource(ttl=3600)
 def get_querier():
     """
@@ -108,6 +268,7 @@ def get_root_path():
     return Path(__file__).parent.parent
 
 
+@traced("s3_list")
 def list_files(fs: S3FileSystem, s3_path: str) -> List:
     """
     List files in s3_path directory.
@@ -129,6 +290,7 @@ def list_files(fs: S3FileSystem, s3_path: str) -> List:
     return files
 
 
+@traced("extract_table_credits")
 def get_extract_table_credits(token: str) -> int:
     """
     Get ExtractTable credits.
@@ -142,14 +304,30 @@ def get_extract_table_credits(token: str) -> int:
     headers = {"x-api-key": token}
 
     # Token validation
-    validation_url = "https://validator.extracttable.com"
-    validation_response = requests.request("GET", validation_url, headers=headers)
-    total_credits = json.loads(validation_response.text)["usage"]["credits"]
-    used_credits = json.loads(validation_response.text)["usage"]["used"]
+    validation_response = get_http_client().get(
+        EXTRACT_TABLE_VALIDATOR_URL, headers=headers
+    )
+    usage = validation_response.json()["usage"]
+    total_credits = usage["credits"]
+    used_credits = usage["used"]
     remaining_credits = total_credits - used_credits
     return remaining_credits
 
 
+@st.cache_resource
+def get_credit_manager(token: str) -> CreditManager:
+    """
+    Get ExtractTable credit manager for a given token.
+
+    Args:
+        token (str): ExtractTable token.
+
+    Returns:
+        CreditManager: Credit manager.
+    """
+    return CreditManager(lambda: get_extract_table_credits(token), ttl=CREDITS_TTL)
+
+
 def read_excel_from_s3(
     fs: S3FileSystem,
     s3_path: str,
@@ -167,32 +345,75 @@ def read_excel_from_s3(
     # Check file extension
     if not s3_path.endswith(".xlsx"):
         raise ValueError("File must be an Excel file.")
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Download the Excel file from S3 to the temporary directory
-        local_path = os.path.join(temp_dir, 'tmp_file.xlsx')
-        fs.get(s3_path, local_path)
+    # Read the Excel file from an in-memory buffer
+    with span("s3_read_excel") as current:
+        content = fs.cat_file(s3_path)
+        current.n_bytes = len(content)
+    return pd.read_excel(io.BytesIO(content), index_col=0)
+
+
+@traced("pdf_serialize")
+def document_to_bytes(document: fitz.Document) -> bytes:
+    """
+    Serialize a document deterministically, so that identical documents
+    have identical bytes.
+
+    PyMuPDF serializes an order of magnitude faster to a file than to an
+    in-memory buffer, so the document is saved to a memory-backed
+    temporary file when available.
+
+    Args:
+        document (fitz.Document): Document.
 
-        # Read the Excel file using pandas
-        df = pd.read_excel(local_path, index_col=0)
-    return df
+    Returns:
+        bytes: PDF document.
+    """
+    if IN_MEMORY_TMP_DIR is None:
+        return document.tobytes(no_new_id=True)
+    with tempfile.TemporaryDirectory(dir=IN_MEMORY_TMP_DIR) as tmpdir:
+        # MuPDF replaces the file rather than writing to it, so it is read
+        # back by path
+        file_path = Path(tmpdir) / "document.pdf"
+        document.save(file_path, no_new_id=True)
+        return file_path.read_bytes()
 
 
 def upload_pdf_to_s3(document: fitz.Document, fs: S3FileSystem, s3_path: str):
     """
     Upload a PDF document to S3.
 
+    Documents larger than MULTIPART_THRESHOLD are streamed with a multipart
+    upload, others are sent in a single request.
+
     Args:
         document (fitz.Document): Document.
         fs (S3FileSystem): S3 file system.
         s3_path (str): S3 path.
     """
-    with tempfile.TemporaryDirectory() as temp_dir:
-        local_path = os.path.join(temp_dir, 'tmp_file.pdf')
-        document.save(
-            local_path
-        )
-        fs.put(local_path, s3_path)
-        return
+    pdf_bytes = document_to_bytes(document)
+    with span("s3_upload", n_bytes=len(pdf_bytes)):
+        if len(pdf_bytes) <= MULTIPART_THRESHOLD:
+            fs.pipe_file(s3_path, pdf_bytes)
+            return
+        buffer = memoryview(pdf_bytes)
+        with fs.open(s3_path, "wb", block_size=MULTIPART_CHUNK_SIZE) as f:
+            for start in range(0, len(buffer), MULTIPART_CHUNK_SIZE):
+                f.write(buffer[start:start + MULTIPART_CHUNK_SIZE])
+
+
+@traced("s3_exists")
+def exists_on_s3(fs: S3FileSystem, s3_path: str) -> bool:
+    """
+    Check if an object exists on S3.
+
+    Args:
+        fs (S3FileSystem): S3 file system.
+        s3_path (str): S3 path.
+
+    Returns:
+        bool: True if the object exists.
+    """
+    return fs.exists(s3_path)
 
 
 def read_pdf_from_s3(fs: S3FileSystem, s3_path: str):
@@ -203,13 +424,10 @@ def read_pdf_from_s3(fs: S3FileSystem, s3_path: str):
         fs (S3FileSystem): S3 file system.
         s3_path (str): S3 path.
     """
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Download the PDF file from S3 to the temporary directory
-        local_path = os.path.join(temp_dir, 'tmp_file.pdf')
-        fs.get(s3_path, local_path)
-        # Read the PDF file using fitz
-        document = fitz.open(local_path)
-    return document
+    with span("s3_read_pdf") as current:
+        pdf_bytes = fs.cat_file(s3_path)
+        current.n_bytes = len(pdf_bytes)
+    return fitz.open(stream=pdf_bytes, filetype="pdf")
 
 
 def format_extraction_name(file_path: str) -> str:
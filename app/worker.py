@@ -0,0 +1,97 @@
+"""
+Worker processes executing the extraction jobs of the job queue.
+
+Usage:
+    python worker.py [--workers N] [--poll-interval SECONDS]
+
+Jobs use the ExtractTable token sent with them by the app, or else the
+token of the EXTRACT_TABLE_TOKEN environment variable. INPI credentials
+are read from TEST_INPI_USERNAME and TEST_INPI_PASSWORD.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import time
+from constants import JOBS_DB_PATH
+from jobs import JobQueue
+
+
+# Running jobs not updated for this long are considered abandoned
+STALE_JOB_SECONDS = 3600
+
+
+def work(worker: str, poll_interval: float):
+    """
+    Claim and execute jobs until interrupted.
+
+    Args:
+        worker (str): Worker identifier.
+        poll_interval (float): Waiting time when the queue is empty.
+    """
+    # Imported in the worker process, after fork
+    from pipeline import process_document
+    from utils import get_file_system, get_querier
+
+    queue = JobQueue(JOBS_DB_PATH)
+    fs = get_file_system()
+    token = os.getenv("EXTRACT_TABLE_TOKEN")
+    while True:
+        job = queue.claim(worker)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        job_token = job["token"] or token
+        try:
+            if {"extract_table", "auto"} & set(job["engines"]) and not job_token:
+                raise ValueError(
+                    "An ExtractTable token must be sent with the job or "
+                    "EXTRACT_TABLE_TOKEN set to use ExtractTable."
+                )
+            result = process_document(
+                fs,
+                get_querier(),
+                job["siren"],
+                job["year"],
+                job["engines"],
+                token=job_token,
+                progress_callback=lambda stage: queue.update_stage(job["id"], stage),
+            )
+        except Exception as e:
+            queue.fail(job["id"], f"{type(e).__name__}: {e}")
+        else:
+            queue.complete(job["id"], result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run extraction job workers.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    args = parser.parse_args()
+
+    queue = JobQueue(JOBS_DB_PATH)
+    n_requeued = queue.requeue_stale(STALE_JOB_SECONDS)
+    if n_requeued:
+        print(f"{n_requeued} abandoned jobs re-queued.")
+
+    processes = [
+        multiprocessing.Process(
+            target=work,
+            args=(f"{socket.gethostname()}-{worker_idx}", args.poll_interval),
+            daemon=True,
+        )
+        for worker_idx in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    print(f"{args.workers} workers started on {JOBS_DB_PATH}.")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+"""
+Local stand-ins for the remote services of the pipeline, so that it can be
+benchmarked offline: the page selection and Table Transformer API
+(`/select_page` and `/extract`), the ExtractTable trigger, result and
+validator endpoints, and the INPI document API of `DocumentQuerier`.
+
+The HTTP services run in a separate process, so that their CPU time and
+memory are not counted in the measurements of the client. Each call waits
+for a configurable latency and fails with a 503 status with a configurable
+probability. Responses are deterministic functions of the uploaded
+document.
+
+Usage:
+    python benchmarks/mock_services.py [--port 8765] [--latency 0.05] [--error-rate 0.0]
+"""
+from typing import Dict, List, Optional, Tuple
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import random
+import threading
+import time
+from dataclasses import asdict, dataclass
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+import fitz
+import requests
+
+
+# Title of the page of the synthetic reports holding the subsidiaries table
+TABLE_PAGE_TITLE = "Tableau des filiales et participations"
+TABLE_COLUMNS = [
+    "Filiales et participations",
+    "Capital",
+    "Capitaux propres",
+    "Quote-part du capital (%)",
+    "Valeur comptable des titres",
+    "Chiffre d'affaires",
+    "Résultat",
+]
+
+
+@dataclass
+class MockConfig:
+    """
+    Behaviour of the mock services.
+    """
+
+    # Latency of each call in seconds, and uniform jitter around it
+    latency: float = 0.05
+    jitter: float = 0.0
+    # Probability of a call failing with a 503 status
+    error_rate: float = 0.0
+    # Duration of an ExtractTable job, polled until then
+    processing_time: float = 0.0
+    # Size of the tables returned by the extraction engines
+    n_rows: int = 30
+    n_cols: int = 7
+    n_tables: int = 1
+    seed: int = 0
+
+    def wait(self, rng: random.Random):
+        """
+        Sleep for the latency of a call.
+
+        Args:
+            rng (random.Random): Random generator.
+        """
+        delay = self.latency + rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def fails(self, rng: random.Random) -> bool:
+        """
+        Whether a call fails.
+
+        Args:
+            rng (random.Random): Random generator.
+
+        Returns:
+            bool: True if the call fails.
+        """
+        return rng.random() < self.error_rate
+
+
+def synthetic_report(siren: str, year: int, n_pages: int = 40, table_page: Optional[int] = None) -> bytes:
+    """
+    Synthetic annual report: pages of text and figures, one of which holds
+    the subsidiaries table.
+
+    Args:
+        siren (str): Firm identifier, printed on each page.
+        year (int): Year.
+        n_pages (int): Number of pages.
+        table_page (Optional[int]): Page of the subsidiaries table, chosen
+            from the SIREN if not specified.
+
+    Returns:
+        bytes: PDF document.
+    """
+    rng = random.Random(f"{siren}_{year}")
+    if table_page is None:
+        table_page = rng.randrange(n_pages // 2, n_pages)
+    document = fitz.open()
+    for page_idx in range(n_pages):
+        page = document.new_page()
+        page.insert_text((50, 40), f"Comptes annuels {year} - Siren {siren} - page {page_idx + 1}")
+        if page_idx == table_page:
+            page.insert_text((50, 70), TABLE_PAGE_TITLE, fontsize=13)
+            for col_idx, column in enumerate(TABLE_COLUMNS):
+                page.insert_text((50 + col_idx * 75, 100), column[:14], fontsize=7)
+            for row_idx in range(30):
+                y = 120 + row_idx * 20
+                values = [f"Filiale {row_idx + 1}"] + [
+                    f"{rng.randint(10**3, 10**7):,}".replace(",", " ") for _ in TABLE_COLUMNS[1:]
+                ]
+                for col_idx, value in enumerate(values):
+                    page.insert_text((50 + col_idx * 75, y), value, fontsize=7)
+                page.draw_line((45, y + 5), (580, y + 5))
+        else:
+            for line_idx in range(35):
+                page.insert_text(
+                    (50, 70 + line_idx * 20),
+                    f"Note {line_idx + 1} : montant de {rng.randint(10**3, 10**6):,} euros "
+                    "au titre de l'exercice.".replace(",", " "),
+                    fontsize=9,
+                )
+    pdf_bytes = document.tobytes()
+    document.close()
+    return pdf_bytes
+
+
+def _table_page(pdf_bytes: bytes) -> int:
+    # Page of the subsidiaries table, first page if there is none
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
+        for page_idx, page in enumerate(document):
+            if TABLE_PAGE_TITLE in page.get_text():
+                return page_idx
+    return 0
+
+
+def _table_cells(pdf_bytes: bytes, config: MockConfig, table_idx: int) -> List[List[str]]:
+    # Header and rows of an extracted table, seeded by the document
+    rng = random.Random(hashlib.sha256(pdf_bytes).hexdigest() + str(table_idx))
+    header = [TABLE_COLUMNS[col % len(TABLE_COLUMNS)] for col in range(config.n_cols)]
+    rows = [
+        [f"Filiale {row + 1}"]
+        + [f"{rng.randint(10**3, 10**7):,}".replace(",", " ") for _ in range(config.n_cols - 1)]
+        for row in range(config.n_rows)
+    ]
+    return [header] + rows
+
+
+def table_transformer_response(pdf_bytes: bytes, config: MockConfig) -> Dict:
+    """
+    Response of the `/extract` endpoint: one mapping of columns to rows to
+    cells per table.
+
+    Args:
+        pdf_bytes (bytes): Document.
+        config (MockConfig): Mock configuration.
+
+    Returns:
+        Dict: Response.
+    """
+    tables = []
+    for table_idx in range(config.n_tables):
+        cells = _table_cells(pdf_bytes, config, table_idx)
+        tables.append(
+            {
+                str(col): {str(row): values[col] for row, values in enumerate(cells)}
+                for col in range(config.n_cols)
+            }
+        )
+    return {"tables": tables}
+
+
+def extract_table_result(pdf_bytes: bytes, config: MockConfig) -> Dict:
+    """
+    Result of a successful ExtractTable job.
+
+    Args:
+        pdf_bytes (bytes): Document.
+        config (MockConfig): Mock configuration.
+
+    Returns:
+        Dict: Job result.
+    """
+    rng = random.Random(hashlib.sha256(pdf_bytes).hexdigest())
+    tables = []
+    for table_idx in range(config.n_tables):
+        cells = _table_cells(pdf_bytes, config, table_idx)
+        tables.append(
+            {
+                "TableJson": {
+                    str(row): {str(col): value for col, value in enumerate(values)}
+                    for row, values in enumerate(cells)
+                },
+                "TableConfidence": {
+                    str(row): {str(col): round(rng.uniform(0.5, 1), 3) for col in range(len(values))}
+                    for row, values in enumerate(cells)
+                },
+            }
+        )
+    return {"JobStatus": "Success", "Tables": tables}
+
+
+def _uploaded_file(content_type: str, body: bytes) -> bytes:
+    # Content of the first file of a multipart/form-data body
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    for part in message.iter_parts():
+        if part.get_filename() is not None or part.get_param("name", header="content-disposition") in (
+            "pdf_file",
+            "pdf_page",
+        ):
+            return part.get_payload(decode=True)
+    raise ValueError("No file in request.")
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of all mock HTTP services.
+    """
+
+    config = MockConfig()
+    # Documents of ExtractTable jobs and their submission time, by job ID
+    jobs: Dict[str, Tuple[bytes, float]] = {}
+    n_completed = 0
+    job_ids = itertools.count(1)
+    lock = threading.Lock()
+    rng = random.Random(0)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload: Dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self) -> bool:
+        # Wait for the call latency, and report whether the call fails
+        with self.lock:
+            rng = random.Random(self.rng.random())
+        self.config.wait(rng)
+        if self.config.fails(rng):
+            self._send(503, {"message": "Service unavailable"})
+            return True
+        return False
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self._simulate():
+            return
+        path = urlsplit(self.path).path
+        pdf_bytes = _uploaded_file(self.headers["Content-Type"], body)
+        if path == "/select_page":
+            self._send(200, {"page_number": _table_page(pdf_bytes)})
+        elif path == "/extract":
+            self._send(200, table_transformer_response(pdf_bytes, self.config))
+        elif path == "/extracttable/trigger":
+            job_id = str(next(self.job_ids))
+            if self.config.processing_time <= 0:
+                with self.lock:
+                    self.n_completed += 1
+                self._send(200, dict(extract_table_result(pdf_bytes, self.config), JobId=job_id))
+            else:
+                with self.lock:
+                    self.jobs[job_id] = (pdf_bytes, time.monotonic())
+                self._send(200, {"JobId": job_id, "JobStatus": "Processing"})
+        else:
+            self._send(404, {"message": f"Unknown path {path}"})
+
+    def do_GET(self):
+        if self._simulate():
+            return
+        url = urlsplit(self.path)
+        if url.path == "/extracttable/getresult":
+            job_id = parse_qs(url.query).get("JobId", [""])[0]
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is not None and time.monotonic() - job[1] >= self.config.processing_time:
+                    # Results are returned once, as their documents are not kept
+                    del self.jobs[job_id]
+                    self.n_completed += 1
+            if job is None:
+                self._send(200, {"JobStatus": "Failed", "Message": f"Unknown job {job_id}"})
+            elif job_id in self.jobs:
+                self._send(200, {"JobId": job_id, "JobStatus": "Processing"})
+            else:
+                self._send(200, dict(extract_table_result(job[0], self.config), JobId=job_id))
+        elif url.path == "/extracttable/validator":
+            self._send(200, {"usage": {"credits": 10**6, "used": self.n_completed}})
+        else:
+            self._send(404, {"message": f"Unknown path {url.path}"})
+
+
+def service_urls(base_url: str) -> Dict[str, str]:
+    """
+    Environment variables pointing the application to the mock services.
+
+    Args:
+        base_url (str): URL of the mock server.
+
+    Returns:
+        Dict[str, str]: Environment variables.
+    """
+    return {
+        "EXTRACTION_API_URL": base_url,
+        "EXTRACT_TABLE_TRIGGER_URL": f"{base_url}/extracttable/trigger",
+        "EXTRACT_TABLE_RESULT_URL": f"{base_url}/extracttable/getresult",
+        "EXTRACT_TABLE_VALIDATOR_URL": f"{base_url}/extracttable/validator",
+    }
+
+
+def serve(port: int, config: MockConfig):
+    """
+    Serve the mock HTTP services until interrupted.
+
+    Args:
+        port (int): Port.
+        config (MockConfig): Mock configuration.
+    """
+    MockHandler.config = config
+    MockHandler.rng = random.Random(config.seed)
+    ThreadingHTTPServer(("127.0.0.1", port), MockHandler).serve_forever()
+
+
+class MockServer:
+    """
+    Mock HTTP services run in a child process, as a context manager.
+    """
+
+    def __init__(self, config: MockConfig, port: int = 0):
+        """
+        Constructor.
+
+        Args:
+            config (MockConfig): Mock configuration.
+            port (int): Port, a free port is chosen if 0.
+        """
+        if port == 0:
+            with ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler) as server:
+                port = server.server_address[1]
+        self.config = config
+        self.url = f"http://127.0.0.1:{port}"
+        self.process = multiprocessing.Process(
+            target=serve, args=(port, config), daemon=True
+        )
+
+    def __enter__(self) -> "MockServer":
+        self.process.start()
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                requests.get(f"{self.url}/health", timeout=1)
+                return self
+            except requests.ConnectionError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
+
+
+class MockDocumentQuerier:
+    """
+    Stand-in for `ca_query.querier.DocumentQuerier`, serving synthetic
+    annual reports for any SIREN and year.
+    """
+
+    def __init__(self, config: MockConfig, n_pages: int = 40, availability_rate: float = 1.0):
+        """
+        Constructor.
+
+        Args:
+            config (MockConfig): Latency and error injection of each call.
+            n_pages (int): Number of pages of the reports.
+            availability_rate (float): Proportion of available documents.
+        """
+        self.config = config
+        self.n_pages = n_pages
+        self.availability_rate = availability_rate
+        self._rng = random.Random(config.seed)
+        self._lock = threading.Lock()
+        # Generated reports by document ID
+        self._reports: Dict[str, bytes] = {}
+
+    def report(self, document_id: str) -> bytes:
+        """
+        Annual report of a document ID, generated on first use.
+
+        Args:
+            document_id (str): Document ID.
+
+        Returns:
+            bytes: PDF document.
+        """
+        if document_id not in self._reports:
+            siren, year = document_id.split("_")
+            self._reports[document_id] = synthetic_report(siren, int(year), self.n_pages)
+        return self._reports[document_id]
+
+    def preload(self, documents: List[Tuple[str, int]]):
+        """
+        Generate the reports of documents in advance, so that their
+        generation is not measured as download time.
+
+        Args:
+            documents (List[Tuple[str, int]]): SIRENs and years.
+        """
+        for siren, year in documents:
+            self.report(f"{siren}_{year}")
+
+    def _simulate(self, url: str):
+        with self._lock:
+            rng = random.Random(self._rng.random())
+        self.config.wait(rng)
+        if self.config.fails(rng):
+            response = requests.Response()
+            response.status_code = 503
+            response.url = url
+            raise requests.HTTPError(f"503 Server Error for url: {url}", response=response)
+
+    def check_document_availability(self, siren: str, year: int) -> Tuple[bool, Optional[str]]:
+        """
+        Check if the annual report of a company is available.
+
+        Args:
+            siren (str): Firm identifier.
+            year (int): Year.
+
+        Returns:
+            Tuple[bool, Optional[str]]: Availability and document ID.
+        """
+        self._simulate(f"inpi://companies/{siren}/attachments")
+        available = random.Random(f"{siren}_{year}").random() < self.availability_rate
+        return available, f"{siren}_{year}" if available else None
+
+    def download_from_id(self, document_id: str, save_path, s3: bool = False):
+        """
+        Download a document to a local file.
+
+        Args:
+            document_id (str): Document ID.
+            save_path: Local path.
+            s3 (bool): Unused, for compatibility.
+        """
+        self._simulate(f"inpi://bilans/{document_id}/download")
+        Path(save_path).write_bytes(self.report(document_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8765)
+    for field, value in asdict(MockConfig()).items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(value), default=value)
+    args = vars(parser.parse_args())
+    port = args.pop("port")
+    for name, url in service_urls(f"http://127.0.0.1:{port}").items():
+        print(f"{name}={url}")
+    serve(port, MockConfig(**args))
+
+
+if __name__ == "__main__":
+    main()
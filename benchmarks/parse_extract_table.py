@@ -0,0 +1,118 @@
+"""
+Micro-benchmark of the conversion of ExtractTable job results to
+DataFrames, comparing the former `pd.DataFrame.from_dict` implementation
+with the single-pass parser of `extract_table_parser`.
+
+Usage:
+    python benchmarks/parse_extract_table.py [--rows 2000] [--cols 12] [--tables 4] [--repeat 10]
+"""
+from typing import Dict
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent / "app"))
+
+from extract_table_parser import parse_extract_table_response, parse_french_numbers  # noqa: E402
+
+
+def legacy_parse_extract_table_response(json_object: Dict):
+    outputs = []
+    for extracted_table in range(len(json_object["Tables"])):
+        df = pd.DataFrame.from_dict(
+            json_object["Tables"][extracted_table]["TableJson"], orient="index"
+        )
+        df.index = df.index.map(int)
+        df = df.sort_index(axis=0)
+        try:
+            df_conf = pd.DataFrame.from_dict(
+                json_object["Tables"][extracted_table]["TableConfidence"], orient="index"
+            )
+            df_conf.index = df_conf.index.map(int)
+            df_conf = df_conf.sort_index(axis=0)
+            outputs.append((df, df_conf))
+        except KeyError:
+            outputs.append((df, None))
+    return outputs
+
+
+def synthetic_response(n_rows: int, n_cols: int, n_tables: int) -> Dict:
+    """
+    Synthetic ExtractTable job result with French formatted numbers.
+    """
+    rng = random.Random(0)
+    tables = []
+    for _ in range(n_tables):
+        table_json = {}
+        table_confidence = {}
+        # Rows are not returned in order by the API
+        for row in rng.sample(range(n_rows), n_rows):
+            table_json[str(row)] = {
+                str(col): f"{rng.randint(-10**6, 10**6):,},{rng.randint(0, 99):02d}".replace(",", " ", 1)
+                if row else f"Colonne {col}"
+                for col in range(n_cols)
+            }
+            table_confidence[str(row)] = {str(col): rng.random() for col in range(n_cols)}
+        tables.append({"TableJson": table_json, "TableConfidence": table_confidence})
+    return {"JobStatus": "Success", "Tables": tables}
+
+
+def measure(func, repeat: int) -> float:
+    """
+    Mean latency of a function in milliseconds.
+    """
+    func()  # Warm-up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return round((time.perf_counter() - start) / repeat * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--cols", type=int, default=12)
+    parser.add_argument("--tables", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    response = synthetic_response(args.rows, args.cols, args.tables)
+    # Both implementations must return the same cells
+    for (legacy_df, legacy_conf), (df, df_conf) in zip(
+        legacy_parse_extract_table_response(response), parse_extract_table_response(response)
+    ):
+        assert legacy_df.equals(df)
+        np.testing.assert_allclose(legacy_conf.to_numpy(), df_conf.to_numpy(), rtol=1e-6)
+
+    cells = np.concatenate(
+        [pd.DataFrame.from_dict(table["TableJson"], orient="index").to_numpy().ravel()
+         for table in response["Tables"]]
+    )
+    results = [
+        {
+            "function": "parse_extract_table_response",
+            "before_ms": measure(lambda: legacy_parse_extract_table_response(response), args.repeat),
+            "after_ms": measure(lambda: parse_extract_table_response(response), args.repeat),
+        },
+        {
+            "function": "parse_french_numbers",
+            "before_ms": measure(
+                lambda: [
+                    pd.to_numeric(str(cell).replace(" ", "").replace(",", "."), errors="coerce")
+                    for cell in cells
+                ],
+                args.repeat,
+            ),
+            "after_ms": measure(lambda: parse_french_numbers(cells), args.repeat),
+        },
+    ]
+    print(f"{args.tables} tables of {args.rows} x {args.cols} cells")
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
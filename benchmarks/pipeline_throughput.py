@@ -0,0 +1,221 @@
+"""
+End-to-end benchmark of the extraction pipeline against local stand-ins of
+the remote services, to validate performance changes before a release.
+
+Synthetic annual reports are served by a mock INPI querier, the page
+selection, Table Transformer and ExtractTable APIs by the mock HTTP
+services of `mock_services`, and S3 by the in-memory storage backend. The
+benchmark runs the pipeline on a batch of documents, then lists the
+extractions and loads them as the viewer does, and reports:
+
+- per phase: wall time, throughput and peak memory,
+- per function: call count, errors, latency percentiles and volume, from
+  the spans recorded by `instrumentation`.
+
+Usage:
+    python benchmarks/pipeline_throughput.py [--documents 20] [--pages 40] [--workers 4]
+        [--engines table_transformer extract_table] [--latency 0.05] [--error-rate 0.0]
+        [--output results.json]
+"""
+from typing import Callable, Dict
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent / "app"))
+
+from mock_services import MockConfig, MockDocumentQuerier, MockServer, service_urls  # noqa: E402
+
+
+def measure_phase(name: str, func: Callable[[], int], trace_memory: bool) -> Dict:
+    """
+    Wall time, throughput and peak memory of a phase.
+
+    Args:
+        name (str): Phase name.
+        func (Callable[[], int]): Phase, returning its number of items.
+        trace_memory (bool): Measure the peak of Python allocations, which
+            slows down the phase.
+
+    Returns:
+        Dict: Measurements.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    n_items = func()
+    duration = time.perf_counter() - start
+    result = {
+        "phase": name,
+        "items": n_items,
+        "seconds": round(duration, 3),
+        "items_per_s": round(n_items / duration, 2) if duration else None,
+    }
+    if trace_memory:
+        result["peak_mib"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        tracemalloc.stop()
+    return result
+
+
+def stage_throughput(spans: pd.DataFrame) -> pd.DataFrame:
+    """
+    Latency, throughput and volume of each instrumented function.
+
+    Args:
+        spans (pd.DataFrame): Recorded spans.
+
+    Returns:
+        pd.DataFrame: One row per stage.
+    """
+    return (
+        spans.assign(
+            duration_ms=spans["duration"] * 1000,
+            error=spans["outcome"] == "error",
+            n_bytes=spans["n_bytes"].fillna(0),
+        )
+        .groupby("stage")
+        .agg(
+            calls=("duration_ms", "size"),
+            errors=("error", "sum"),
+            mean_ms=("duration_ms", "mean"),
+            p50_ms=("duration_ms", "median"),
+            p95_ms=("duration_ms", lambda duration: duration.quantile(0.95)),
+            total_s=("duration", "sum"),
+            mib=("n_bytes", lambda n_bytes: n_bytes.sum() / 2**20),
+        )
+        .assign(mib_per_s=lambda df: df["mib"] / df["total_s"].where(df["total_s"] > 0))
+        .drop(columns="total_s")
+        .round(2)
+        .sort_values("p95_ms", ascending=False)
+        .reset_index()
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--engines",
+        nargs="+",
+        default=["table_transformer", "extract_table"],
+        choices=["table_transformer", "extract_table", "auto"],
+    )
+    parser.add_argument("--page-selection", default="remote", choices=["remote", "local"])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--processing-time", type=float, default=0.0)
+    parser.add_argument("--rows", type=int, default=30)
+    parser.add_argument("--tables", type=int, default=1)
+    parser.add_argument("--trace-memory", action="store_true")
+    parser.add_argument("--output", help="JSON file of the results")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        processing_time=args.processing_time,
+        n_rows=args.rows,
+        n_tables=args.tables,
+    )
+    with MockServer(config) as server:
+        # The application reads its settings when imported
+        os.environ.update(service_urls(server.url))
+        os.environ.update(
+            STORAGE_BACKEND="memory",
+            PAGE_SELECTION_BACKEND=args.page_selection,
+            SPAN_LOGS="false",
+        )
+        from streamlit.logger import set_log_level
+
+        # Warnings of Streamlit functions called outside of a Streamlit app
+        set_log_level("error")
+        from concurrency import run_concurrently
+        from constants import PDF_SAMPLES_PATH, TABLE_TRANSFORMER_EXTRACTIONS_PATH
+        from extraction_index import read_index, refresh_index
+        from instrumentation import RECORDER
+        from pipeline import page_sample_path, process_document
+        from storage import TableReference, load_table
+        from streamlit_utils import render_pdf_page
+        from utils import get_file_system, list_files
+
+        fs = get_file_system()
+        querier = MockDocumentQuerier(config, n_pages=args.pages)
+        documents = [(f"{100000000 + idx:09d}", 2022) for idx in range(args.documents)]
+        querier.preload(documents)
+        errors = []
+
+        def run_pipeline() -> int:
+            for (company_id, year), _, error in run_concurrently(
+                lambda item: process_document(fs, querier, *item, args.engines, token="benchmark"),
+                documents,
+                max_workers=args.workers,
+                retries=0,
+            ):
+                if error is not None:
+                    errors.append(f"{company_id}_{year}: {type(error).__name__}: {error}")
+            return len(documents)
+
+        def run_listing() -> int:
+            files = list_files(fs, PDF_SAMPLES_PATH) + list_files(
+                fs, TABLE_TRANSFORMER_EXTRACTIONS_PATH
+            )
+            refresh_index(fs, full=True)
+            return len(files)
+
+        def run_viewer() -> int:
+            n_tables = 0
+            for entry in read_index(fs):
+                for table_idx in range(entry["n_tables"]):
+                    load_table(
+                        fs, TableReference(entry["engine"], entry["siren"], int(entry["year"]), table_idx)
+                    )
+                    n_tables += 1
+                render_pdf_page(fs, page_sample_path(entry["siren"], entry["year"]))
+            return n_tables
+
+        phases = [
+            measure_phase("end_to_end", run_pipeline, args.trace_memory),
+            measure_phase("listing", run_listing, args.trace_memory),
+            measure_phase("viewer_load", run_viewer, args.trace_memory),
+        ]
+
+    stages = stage_throughput(RECORDER.to_frame())
+    max_rss_mib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+    print(
+        f"{args.documents} documents of {args.pages} pages, engines: {', '.join(args.engines)}, "
+        f"latency: {args.latency}s, error rate: {args.error_rate:.0%}"
+    )
+    print(f"Failed documents: {len(errors)}, peak RSS: {max_rss_mib:.0f} MiB\n")
+    print(pd.DataFrame(phases).to_string(index=False))
+    print()
+    print(stages.to_string(index=False))
+    for error in errors[:10]:
+        print(error)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "arguments": vars(args),
+                    "failed_documents": errors,
+                    "max_rss_mib": max_rss_mib,
+                    "phases": phases,
+                    "stages": stages.to_dict(orient="records"),
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Benchmark of the S3 read/write helpers of `utils`, comparing the former
+temporary-file implementations with the in-memory ones.
+
+An in-memory fsspec file system stands in for S3, so that the measured
+latency and bytes copied only come from the helpers themselves. Bytes
+copied are the bytes read and written through system calls (Linux only),
+including writes to the memory-backed /dev/shm used to serialize PDFs.
+
+Usage:
+    python benchmarks/s3_io.py [--pages 100] [--repeat 10]
+"""
+from typing import Callable, Dict
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+import fitz
+import fsspec
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent / "app"))
+
+from utils import read_excel_from_s3, read_pdf_from_s3, upload_pdf_to_s3  # noqa: E402
+
+
+def legacy_read_excel_from_s3(fs, s3_path: str) -> pd.DataFrame:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        local_path = os.path.join(temp_dir, "tmp_file.xlsx")
+        fs.get(s3_path, local_path)
+        df = pd.read_excel(local_path, index_col=0)
+    return df
+
+
+def legacy_upload_pdf_to_s3(document: fitz.Document, fs, s3_path: str):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        local_path = os.path.join(temp_dir, "tmp_file.pdf")
+        document.save(local_path)
+        fs.put(local_path, s3_path)
+
+
+def legacy_read_pdf_from_s3(fs, s3_path: str) -> fitz.Document:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        local_path = os.path.join(temp_dir, "tmp_file.pdf")
+        fs.get(s3_path, local_path)
+        document = fitz.open(local_path)
+    return document
+
+
+def synthetic_pdf(n_pages: int) -> fitz.Document:
+    """
+    Synthetic annual report with text and a ruled table on each page.
+    """
+    document = fitz.open()
+    for page_idx in range(n_pages):
+        page = document.new_page()
+        for line_idx in range(40):
+            y = 50 + line_idx * 18
+            page.insert_text(
+                (50, y),
+                f"Filiale {page_idx}-{line_idx}   {line_idx * 1234:,} €   {line_idx % 100} %",
+            )
+            page.draw_line((45, y + 4), (550, y + 4))
+    return document
+
+
+def io_counters() -> Dict[str, int]:
+    """
+    Bytes read and written through system calls by the current process.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return {"read": int(counters["rchar"]), "written": int(counters["wchar"])}
+    except OSError:
+        return {"read": 0, "written": 0}
+
+
+def measure(func: Callable, repeat: int) -> Dict[str, float]:
+    """
+    Mean latency and bytes copied of a function.
+    """
+    func()  # Warm-up
+    start_counters = io_counters()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    duration = (time.perf_counter() - start) / repeat
+    end_counters = io_counters()
+    return {
+        "latency_ms": round(duration * 1000, 2),
+        "bytes_copied": (
+            end_counters["read"] - start_counters["read"]
+            + end_counters["written"] - start_counters["written"]
+        ) // repeat,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    fs = fsspec.filesystem("memory")
+    document = synthetic_pdf(args.pages)
+    fs.pipe_file("/bench/document.pdf", document.tobytes())
+    table = pd.DataFrame(
+        [[f"{row * col:,}" for col in range(10)] for row in range(500)]
+    )
+    with fs.open("/bench/table.xlsx", "wb") as f:
+        table.to_excel(f)
+
+    cases = {
+        "read_excel_from_s3": (
+            lambda: legacy_read_excel_from_s3(fs, "/bench/table.xlsx"),
+            lambda: read_excel_from_s3(fs, "/bench/table.xlsx"),
+        ),
+        "upload_pdf_to_s3": (
+            lambda: legacy_upload_pdf_to_s3(document, fs, "/bench/upload.pdf"),
+            lambda: upload_pdf_to_s3(document, fs, "/bench/upload.pdf"),
+        ),
+        "read_pdf_from_s3": (
+            lambda: legacy_read_pdf_from_s3(fs, "/bench/document.pdf"),
+            lambda: read_pdf_from_s3(fs, "/bench/document.pdf"),
+        ),
+    }
+    results = []
+    for name, (legacy_func, func) in cases.items():
+        for implementation, case_func in [("before", legacy_func), ("after", func)]:
+            results.append(
+                {"function": name, "implementation": implementation}
+                | measure(case_func, args.repeat)
+            )
+    print(f"PDF size: {len(document.tobytes()) / 2**20:.2f} MiB ({args.pages} pages)")
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()